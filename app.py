@@ -27,10 +27,16 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 import atexit
 import signal
+import calendar
 # RQ相关导入
-from rq_config import RQConfig, get_queue_info, get_failed_jobs, redis_conn
+from rq_config import RQConfig, get_queue_info, get_failed_jobs, redis_conn, count_scheduled_subscriptions
+from push_pipeline import push_pipeline
+from push_digest import push_digest
 # 搜索缓存服务导入
 from search_cache_service import search_cache_service
+from email_renderer import PushEmailRenderer
+from smtp_pool import smtp_pool, settings_from_config, build_message
+from mail_dispatcher import MailQuotaDispatcher, OutgoingMail, account_from_config
 # 延迟导入 tasks 避免循环导入
 # from tasks import batch_schedule_all_subscriptions, immediate_push_subscription
 import os
@@ -407,6 +413,13 @@ class JournalDataCache:
 # 创建全局单例实例
 journal_cache = JournalDataCache()
 
+# 推送邮件渲染器: 文章卡片片段随期刊数据重新加载自动失效
+push_email_renderer = PushEmailRenderer(
+    journal_quality=lambda issn: PubMedAPI().get_journal_quality(issn),
+    journal_version=lambda: journal_cache.load_timestamp,
+    max_fragments=int(os.environ.get('EMAIL_FRAGMENT_CACHE_SIZE', 5000))
+)
+
 import re
 
 # 东八区时区（北京时间）
@@ -815,8 +828,31 @@ class Subscription(db.Model):
     push_time = db.Column(db.String(5), default='09:00')  # 推送时间 HH:MM
     push_day = db.Column(db.String(10), default='monday')  # 每周推送的星期几
     push_month_day = db.Column(db.Integer, default=1)  # 每月推送的日期
+
+    # AI生成的PubMed检索式（创建/编辑时生成，输入不变时推送直接复用）
+    ai_query = db.Column(db.Text)  # AI检索式
+    ai_query_hash = db.Column(db.String(64))  # 生成输入摘要（关键词+提示词模板+模型）
+    ai_query_prompt_version = db.Column(db.String(16))  # 提示词模板版本（内容摘要）
+    ai_query_model = db.Column(db.String(120))  # 生成所用模型（提供商ID:模型标识）
+    ai_query_generated_at = db.Column(db.DateTime)  # 生成时间
+    
+    # 下次推送时间（与calculate_next_push_time规则一致，推送设置变化时自动重新计算）
+    next_push_at = db.Column(db.DateTime)
     
     user = db.relationship('User', backref='subscriptions')
+
+    # 索引与migrate_database.py中的HOT_PATH_INDEXES一致
+    __table_args__ = (
+        db.Index('ix_subscription_user_active', 'user_id', 'is_active'),
+        db.Index('ix_subscription_active_next_push', 'is_active', 'next_push_at'),
+    )
+    
+    # 影响下次推送时间的字段
+    SCHEDULE_FIELDS = ('push_frequency', 'push_time', 'push_day', 'push_month_day', 'is_active')
+    
+    def refresh_next_push_at(self, after=None):
+        """按当前推送设置重新计算下次推送时间（禁用的订阅为空）"""
+        self.next_push_at = calculate_next_push_time(self, after) if self.is_active is not False else None
     
     def get_jcr_quartiles(self):
         """获取JCR分区列表"""
@@ -884,6 +920,83 @@ class Subscription(db.Model):
             'exclude_no_issn': self.exclude_no_issn
         }
 
+
+@db.event.listens_for(Subscription, 'before_insert')
+def _subscription_before_insert(mapper, connection, subscription):
+    subscription.refresh_next_push_at()
+
+@db.event.listens_for(Subscription, 'before_update')
+def _subscription_before_update(mapper, connection, subscription):
+    """推送频率、时间或启用状态变化时重新计算下次推送时间"""
+    state = db.inspect(subscription)
+    if any(state.attrs[name].history.has_changes() for name in Subscription.SCHEDULE_FIELDS):
+        subscription.refresh_next_push_at()
+
+def calculate_next_push_time(subscription, after=None):
+    """计算订阅在after（默认当前时间）之后的下次推送时间"""
+    try:
+        current_time = after or beijing_now()
+        
+        # 解析推送时间
+        if not subscription.push_time:
+            push_hour, push_minute = 9, 0  # 默认9:00
+        else:
+            try:
+                push_hour, push_minute = map(int, subscription.push_time.split(':'))
+            except:
+                push_hour, push_minute = 9, 0
+        
+        # 根据推送频率计算下次时间
+        if subscription.push_frequency == 'daily':
+            next_time = current_time.replace(hour=push_hour, minute=push_minute, second=0, microsecond=0)
+            if next_time <= current_time:
+                next_time += timedelta(days=1)
+            return next_time
+            
+        elif subscription.push_frequency == 'weekly':
+            # 获取目标星期几
+            weekday_map = {
+                'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
+                'friday': 4, 'saturday': 5, 'sunday': 6
+            }
+            target_weekday = weekday_map.get(subscription.push_day or 'monday', 0)
+            
+            next_time = current_time.replace(hour=push_hour, minute=push_minute, second=0, microsecond=0)
+            days_ahead = target_weekday - current_time.weekday()
+            
+            # 当天是推送日且推送时间未到时当天推送
+            if days_ahead < 0 or (days_ahead == 0 and next_time <= current_time):
+                days_ahead += 7
+                
+            next_time += timedelta(days=days_ahead)
+            return next_time
+            
+        elif subscription.push_frequency == 'monthly':
+            # 每月指定日期
+            target_day = subscription.push_month_day or 1
+            
+            def month_push_time(year, month):
+                # 月份天数不足时在该月最后一天推送（如31号在4月为30号、2月为28/29号）
+                day = min(target_day, calendar.monthrange(year, month)[1])
+                return current_time.replace(year=year, month=month, day=day, hour=push_hour, minute=push_minute,
+                                            second=0, microsecond=0)
+            
+            next_time = month_push_time(current_time.year, current_time.month)
+            if next_time <= current_time:
+                # 下个月的同一天
+                if current_time.month == 12:
+                    next_time = month_push_time(current_time.year + 1, 1)
+                else:
+                    next_time = month_push_time(current_time.year, current_time.month + 1)
+                        
+            return next_time
+        
+        return None
+        
+    except Exception as e:
+        app.logger.error(f"计算订阅 {subscription.id} 下次推送时间失败: {e}")
+        return None
+
 # 文章模型
 class Article(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -916,6 +1029,13 @@ class UserArticle(db.Model):
     article = db.relationship('Article', backref='user_articles')
     subscription = db.relationship('Subscription', backref='matched_articles')
 
+    __table_args__ = (
+        db.Index('uq_user_article_user_article_subscription', 'user_id', 'article_id', 'subscription_id', unique=True),
+        db.Index('ix_user_article_user_push_date', 'user_id', 'push_date'),
+        db.Index('ix_user_article_article_id', 'article_id'),
+        db.Index('ix_user_article_subscription_id', 'subscription_id'),
+    )
+
 # 系统日志模型
 class SystemLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -928,6 +1048,12 @@ class SystemLog(db.Model):
 
     user = db.relationship('User', backref='logs')
 
+    __table_args__ = (
+        db.Index('ix_system_log_timestamp', 'timestamp'),
+        db.Index('ix_system_log_level_timestamp', 'level', 'timestamp'),
+        db.Index('ix_system_log_module_timestamp', 'module', 'timestamp'),
+    )
+
 # 密码重置令牌模型
 class PasswordResetToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -999,9 +1125,8 @@ class SystemSetting(db.Model):
     
     @staticmethod
     def get_setting(key, default=None):
-        """获取系统设置"""
-        setting = SystemSetting.query.filter_by(key=key).first()
-        return setting.value if setting else default
+        """获取系统设置（读取进程内快照）"""
+        return settings_snapshot.get(key, default)
     
     @staticmethod
     def set_setting(key, value, description=None, category='general'):
@@ -1019,8 +1144,73 @@ class SystemSetting(db.Model):
             )
             db.session.add(setting)
         db.session.commit()
+        settings_snapshot.invalidate()
         return setting
 
+
+class SettingsSnapshot:
+    """
+    进程内系统设置快照
+    
+    首次读取时一次性加载全部设置，之后直接读内存。每隔CHECK_INTERVAL秒
+    比较一次Redis中的设置版本号，set_setting递增版本号，其他Web和Worker进程
+    最迟在CHECK_INTERVAL秒后重新加载；Redis不可用时每个间隔直接重新加载。
+    绕过set_setting直接改库（如迁移脚本）的修改最迟MAX_AGE秒后生效
+    """
+    
+    VERSION_KEY = "pubmed:settings:version"
+    CHECK_INTERVAL = float(os.environ.get('SETTINGS_CHECK_INTERVAL', 5))
+    MAX_AGE = 300
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = None
+        self._version = None
+        self._loaded_at = 0
+        self._checked_at = 0
+    
+    def get(self, key, default=None):
+        return self._current().get(key, default)
+    
+    def invalidate(self):
+        """本进程立即失效，并通知其他进程重新加载"""
+        with self._lock:
+            self._values = None
+        try:
+            redis_conn.incr(self.VERSION_KEY)
+        except Exception as e:
+            app.logger.warning(f"更新设置版本号失败，其他进程将在 {self.CHECK_INTERVAL} 秒内重新加载: {e}")
+    
+    def _current(self):
+        values = self._values
+        now = time.time()
+        if values is not None and now - self._checked_at < self.CHECK_INTERVAL:
+            return values
+        
+        with self._lock:
+            if self._values is not None and now - self._checked_at < self.CHECK_INTERVAL:
+                return self._values
+            
+            version = self._remote_version()
+            if (self._values is None or version is None or version != self._version
+                    or now - self._loaded_at >= self.MAX_AGE):
+                self._values = {setting.key: setting.value for setting in SystemSetting.query.all()}
+                self._version = version
+                self._loaded_at = now
+            self._checked_at = now
+            return self._values
+    
+    def _remote_version(self):
+        """读取Redis中的设置版本号，Redis不可用时返回None"""
+        try:
+            version = redis_conn.get(self.VERSION_KEY)
+            return int(version) if version is not None else 0
+        except Exception:
+            return None
+
+# 全局系统设置快照
+settings_snapshot = SettingsSnapshot()
+
 # 邮件配置模型
 class MailConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -1129,11 +1319,13 @@ class AIPromptTemplate(db.Model):
 
 # 邮件发送器类 - 支持多邮箱轮询
 class MailSender:
+    SENDER_NAME = 'PubMed Literature Push'
+    
     def __init__(self):
         self.current_config = None
-        
+    
     def get_available_mail_config(self):
-        """获取可用的邮件配置（轮询策略）"""
+        """获取可用的邮件配置（轮询策略，仅在Redis不可用时使用）"""
         # 获取所有活跃的邮件配置，按最后使用时间排序
         configs = MailConfig.query.filter_by(is_active=True).order_by(
             MailConfig.last_used.asc().nullsfirst()
@@ -1150,8 +1342,56 @@ class MailSender:
         
         return None
     
+    def get_mail_accounts(self):
+        """所有活跃的发件邮箱（一次查询，数据库中的今日计数只用于初始化Redis配额计数）"""
+        today = beijing_now().date()
+        configs = MailConfig.query.filter_by(is_active=True).order_by(
+            MailConfig.last_used.asc().nullsfirst()
+        ).all()
+        return [
+            account_from_config(
+                config,
+                config.current_count or 0 if config.last_used and config.last_used.date() == today else 0
+            )
+            for config in configs
+        ]
+    
     def send_email(self, to_email, subject, html_body, text_body=None):
         """发送邮件，自动选择可用的邮箱配置"""
+        return self.send_batch([OutgoingMail(to_email, subject, html_body, text_body)])[0]
+    
+    def send_batch(self, mails):
+        """
+        发送一批邮件
+        
+        按各邮箱剩余配额分配后并行发送，配额计数由mail_dispatcher在Redis中原子维护，
+        并定期写回MailConfig；Redis不可用时逐封使用数据库计数发送
+        
+        Args:
+            mails: OutgoingMail列表
+        
+        Returns:
+            list: 与mails一一对应的是否发送成功
+        """
+        try:
+            results = mail_dispatcher.dispatch(self.get_mail_accounts(), mails, sender_name=self.SENDER_NAME)
+        except Exception as e:
+            app.logger.warning(f"邮件配额调度不可用，改为逐封发送: {e}")
+            return [self._send_with_db_quota(mail) for mail in mails]
+        
+        for mail, result in zip(mails, results):
+            if result.success:
+                log_activity('INFO', 'mail', f'邮件发送成功: {mail.to_email} via {result.account}')
+            elif result.account is None:
+                log_activity('ERROR', 'mail', f'邮件发送失败: {mail.to_email} - {result.error}')
+            else:
+                log_activity('ERROR', 'mail', f'邮件发送失败: {mail.to_email} via {result.account} - {result.error}')
+        
+        mail_dispatcher.maybe_persist(self._persist_counts)
+        return [result.success for result in results]
+    
+    def _send_with_db_quota(self, mail):
+        """使用数据库计数选择邮箱并发送一封邮件"""
         config = self.get_available_mail_config()
         
         if not config:
@@ -1159,108 +1399,237 @@ class MailSender:
             return False
         
         try:
-            from flask_mail import Message, Mail
-            
-            # 创建临时邮件配置
-            app.config['MAIL_SERVER'] = config.smtp_server
-            app.config['MAIL_PORT'] = config.smtp_port
-            app.config['MAIL_USERNAME'] = config.username
-            app.config['MAIL_PASSWORD'] = config.password
-            
-            # 根据端口设置正确的加密方式
-            if config.smtp_port == 465:
-                # 465端口使用SSL，不使用TLS
-                app.config['MAIL_USE_SSL'] = True
-                app.config['MAIL_USE_TLS'] = False
-            elif config.smtp_port == 587:
-                # 587端口使用TLS，不使用SSL
-                app.config['MAIL_USE_SSL'] = False
-                app.config['MAIL_USE_TLS'] = True
-            else:
-                # 其他端口按配置设置
-                app.config['MAIL_USE_TLS'] = config.use_tls
-                app.config['MAIL_USE_SSL'] = False
-            
-            # 初始化邮件对象
-            mail = Mail(app)
-            
             # 创建邮件消息
             # 使用from_email字段(如果有),否则使用username
             sender_email = config.from_email or config.username
-            msg = Message(
-                subject=subject,
-                sender=('PubMed Literature Push', sender_email),
-                recipients=[to_email]
-            )
-            msg.html = html_body
-            if text_body:
-                msg.body = text_body
+            msg = build_message(mail.subject, sender_email, [mail.to_email], mail.html_body, mail.text_body,
+                                sender_name=self.SENDER_NAME)
             
-            # 发送邮件
-            mail.send(msg)
+            # 通过连接池发送（复用该邮箱已登录的SMTP会话）
+            smtp_pool.send(settings_from_config(config), msg)
             
             # 增加使用计数
             config.increment_count()
             
-            log_activity('INFO', 'mail', f'邮件发送成功: {to_email} via {config.name}')
+            log_activity('INFO', 'mail', f'邮件发送成功: {mail.to_email} via {config.name}')
             return True
             
         except Exception as e:
-            log_activity('ERROR', 'mail', f'邮件发送失败: {to_email} via {config.name} - {str(e)}')
+            log_activity('ERROR', 'mail', f'邮件发送失败: {mail.to_email} via {config.name} - {str(e)}')
             return False
     
+    @staticmethod
+    def _persist_counts(counts, last_used):
+        """把Redis中的今日发送量和最后使用时间写回MailConfig（独立事务，不提交调用方的会话）"""
+        from sqlalchemy import bindparam
+        
+        rows = [
+            {'b_id': config_id, 'b_count': count, 'b_last_used': last_used[config_id]}
+            for config_id, count in counts.items()
+            if config_id in last_used
+        ]
+        if not rows:
+            return
+        table = MailConfig.__table__
+        statement = table.update().where(table.c.id == bindparam('b_id')).values(
+            current_count=bindparam('b_count'), last_used=bindparam('b_last_used')
+        )
+        with db.engine.begin() as connection:
+            connection.execute(statement, rows)
+    
     def get_mail_stats(self):
-        """获取邮箱使用统计"""
+        """获取邮箱使用统计（今日发送量优先使用Redis中的实时计数）"""
         configs = MailConfig.query.filter_by(is_active=True).all()
+        try:
+            live_counts = mail_dispatcher.get_counts(self.get_mail_accounts())
+        except Exception as e:
+            app.logger.warning(f"读取邮件配额计数失败，使用数据库计数: {e}")
+            live_counts = {}
         stats = []
         
         for config in configs:
+            if config.id in live_counts:
+                current_count = live_counts[config.id]
+                available = current_count < config.daily_limit
+            else:
+                current_count = config.current_count
+                available = config.can_send()
             stats.append({
                 'id': config.id,
                 'name': config.name,
                 'username': config.username,
                 'daily_limit': config.daily_limit,
-                'current_count': config.current_count,
-                'available': config.can_send(),
+                'current_count': current_count,
+                'available': available,
                 'last_used': config.last_used
             })
         
         return stats
 
+# 全局邮件配额调度器（今日发送量保存在Redis中，按北京时间切换日期）
+mail_dispatcher = MailQuotaDispatcher(
+    redis_conn,
+    clock=beijing_now,
+    max_parallel=int(os.environ.get('MAIL_DISPATCH_PARALLEL', 4)),
+    persist_interval=int(os.environ.get('MAIL_QUOTA_PERSIST_INTERVAL', 60))
+)
+
 # 全局邮件发送器实例
 mail_sender = MailSender()
 
 # 日志记录函数
-def log_activity(level, module, message, user_id=None, ip_address=None):
-    """记录系统活动日志"""
-    def _log_to_db():
-        log_entry = SystemLog(
-            level=level,
-            module=module,
-            message=message,
-            user_id=user_id,
-            ip_address=ip_address
-        )
-        db.session.add(log_entry)
-        db.session.commit()
+class SystemLogWriter:
+    """
+    系统日志缓冲写入器
     
-    try:
-        # 尝试直接记录（如果在应用上下文中）
-        _log_to_db()
-    except Exception as e:
-        # 检查是否是应用上下文错误
-        error_msg = str(e).lower()
-        if "application context" in error_msg or "outside of application context" in error_msg:
-            # 没有应用上下文，创建一个
+    log_activity只把日志放入内存队列，由后台线程按批量(BATCH_SIZE)或间隔(FLUSH_INTERVAL)
+    一次插入，不再在调用方的事务里单独提交。队列满时调用方最多等待PUT_TIMEOUT秒(背压)，
+    仍满则丢弃并计数，下一批写入时附带一条丢弃汇总。进程正常退出时(atexit)写完剩余日志；
+    RQ任务子进程通过os._exit退出，由rq_worker在每个任务结束后调用flush
+    """
+    
+    BATCH_SIZE = 200
+    FLUSH_INTERVAL = 2.0
+    MAX_QUEUE = 10000
+    PUT_TIMEOUT = 0.05
+    MAX_RETRIES = 3
+    
+    def __init__(self):
+        self._reset()
+        atexit.register(self.close)
+        # fork出的子进程不继承父进程队列中的日志，避免重复写入
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+    
+    def write(self, level, module, message, user_id=None, ip_address=None):
+        """放入写入队列"""
+        record = {
+            'timestamp': beijing_now(),
+            'level': level,
+            'module': module,
+            'message': message,
+            'user_id': user_id,
+            'ip_address': ip_address
+        }
+        self._ensure_thread()
+        try:
+            self._queue.put(record, timeout=self.PUT_TIMEOUT)
+        except queue.Full:
+            with self._lock:
+                self._pending_dropped += 1
+                self.dropped += 1
+        if self._queue.qsize() >= self.BATCH_SIZE:
+            self._wakeup.set()
+    
+    def flush(self):
+        """同步写入队列中的全部日志（与后台线程互斥，返回时队列中的日志均已处理）"""
+        with self._insert_lock:
+            while True:
+                batch = []
+                try:
+                    while len(batch) < self.BATCH_SIZE:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                if not batch and not self._pending_dropped:
+                    return
+                self._insert(batch)
+    
+    def close(self):
+        """停止后台线程并写完剩余日志"""
+        self._stop.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=self.FLUSH_INTERVAL + 5)
+        self.flush()
+    
+    def get_stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped
+        }
+    
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._insert_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self.MAX_QUEUE)
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = os.getpid()
+        self._pending_dropped = 0
+        self.written = 0
+        self.dropped = 0
+    
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='system-log-writer', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        # 队列攒满一批时被唤醒，否则每隔FLUSH_INTERVAL写入一次
+        while not self._stop.is_set():
+            self._wakeup.wait(self.FLUSH_INTERVAL)
+            self._wakeup.clear()
             try:
-                with app.app_context():
-                    _log_to_db()
-            except Exception as inner_e:
-                print(f"日志记录失败: {inner_e}")
-        else:
-            print(f"日志记录失败: {e}")
+                self.flush()
+            except Exception as e:
+                print(f"日志写入线程异常: {e}")
+    
+    def _insert(self, batch):
+        """批量插入，失败时重试，最终失败的日志计入丢弃数（调用方需持有_insert_lock）"""
+        from flask import has_app_context
+        
+        with self._lock:
+            dropped, self._pending_dropped = self._pending_dropped, 0
+        if dropped:
+            batch = batch + [{
+                'timestamp': beijing_now(), 'level': 'WARNING', 'module': 'system',
+                'message': f'日志队列已满，丢弃了 {dropped} 条日志', 'user_id': None, 'ip_address': None
+            }]
+        
+        last_error = None
+        for attempt in range(self.MAX_RETRIES):
+            try:
+                if has_app_context():
+                    self._execute_insert(batch)
+                else:
+                    with app.app_context():
+                        self._execute_insert(batch)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                last_error = e
+                # SQLite写锁被占用时稍后重试
+                time.sleep(0.5 * (attempt + 1))
+        
+        with self._lock:
+            self.dropped += len(batch)
+        print(f"日志批量写入失败，丢弃 {len(batch)} 条: {last_error}")
+    
+    @staticmethod
+    def _execute_insert(batch):
+        with db.engine.begin() as connection:
+            connection.execute(SystemLog.__table__.insert(), batch)
+
+# 全局日志写入器
+system_log_writer = SystemLogWriter()
+
+def log_activity(level, module, message, user_id=None, ip_address=None):
+    """记录系统活动日志（异步批量写入）"""
+    system_log_writer.write(level, module, message, user_id, ip_address)
 
 # 简化的推送服务类
+class PushGroupBusy(Exception):
+    """同组订阅的搜索正由其他任务执行（RQ任务据此延后重新排队，不占用Worker等待）"""
+
 class SimpleLiteraturePushService:
     def __init__(self):
         self.mail_sender = mail_sender  # 使用全局邮件发送器实例
@@ -1292,8 +1661,21 @@ class SimpleLiteraturePushService:
         
         return results
     
-    def process_single_subscription(self, subscription_id):
-        """处理单个订阅的推送逻辑"""
+    # 推送分组: 相同检索词、窗口、篇数和筛选条件的订阅共享一次搜索
+    PUSH_GROUP_LOCK_PREFIX = "pubmed:push_group_lock"
+    PUSH_GROUP_LOCK_TTL = 300      # 搜索锁最长持有5分钟
+    PUSH_GROUP_WAIT_SECONDS = 120  # 同组订阅最多延后2分钟，之后直接搜索
+    PUSH_GROUP_RETRY_DELAY = 10    # 同组搜索被占用时延后重新排队的秒数
+
+    # 推送波次统计(Hash: subscriptions/searches)，按时间索引最近的波次
+    PUSH_WAVE_PREFIX = "pubmed:push_wave"
+    PUSH_WAVE_INDEX_KEY = "pubmed:push_waves"
+    PUSH_WAVE_TTL = 7 * 24 * 3600
+    PUSH_WAVE_KEEP = 50
+
+    def process_single_subscription(self, subscription_id, fetch_result=None, wave_id=None, on_new_articles=None,
+                                    defer_when_busy=False):
+        """处理单个订阅的推送逻辑（defer_when_busy时同组搜索被占用会抛出PushGroupBusy）"""
         try:
             # 获取订阅信息
             subscription = Subscription.query.get(subscription_id)
@@ -1318,18 +1700,10 @@ class SimpleLiteraturePushService:
             # 使用订阅的个人参数设置
             filter_params = subscription.get_filter_params()
             
-            # 搜索新文章
-            api = PubMedAPI()
-            
-            fetch_result = api.search_and_fetch_with_filter(
-                keywords=subscription.keywords,
-                max_results=min(filter_params['max_results'], int(SystemSetting.get_setting('push_max_articles', '10'))),
-                days_back=filter_params['days_back'],
-                jcr_filter=filter_params['jcr_filter'],
-                zky_filter=filter_params['zky_filter'],
-                exclude_no_issn=filter_params['exclude_no_issn'],
-                user_email=user.email
-            )
+            # 搜索新文章（分组推送时使用同组共享的搜索结果）
+            if fetch_result is None:
+                fetch_result = self._fetch_for_push(subscription, user, filter_params, defer_when_busy)
+                self._record_push_wave(wave_id or self._current_wave_id(), 1, 0 if fetch_result.get('from_cache') else 1)
             
             # 检查是否有符合条件的文章
             if fetch_result.get('filtered_count', 0) == 0:
@@ -1346,70 +1720,17 @@ class SimpleLiteraturePushService:
                     'message': 'No new articles found'
                 }
             
-            # 过滤已推送的文章并保存新文章
-            new_articles = []
-            for article_data in fetch_result.get('articles', []):
-                # 检查文章是否已存在
-                existing_article = Article.query.filter_by(pmid=article_data['pmid']).first()
-                
-                if not existing_article:
-                    # 保存新文章
-                    article = Article(
-                        pmid=article_data['pmid'],
-                        title=article_data['title'],
-                        authors=article_data['authors'],
-                        journal=article_data['journal'],
-                        pubmed_url=article_data['url'],
-                        abstract=article_data.get('abstract', ''),
-                        issn=article_data.get('issn', ''),
-                        eissn=article_data.get('eissn', ''),
-                    )
-                    db.session.add(article)
-                    db.session.flush()
-                else:
-                    # 使用已存在的文章，但更新ISSN信息（如果之前没有）
-                    article = existing_article
-                    
-                    # 检查并更新ISSN信息
-                    updated = False
-                    if not article.issn and article_data.get('issn'):
-                        article.issn = article_data.get('issn')
-                        updated = True
-                    if not article.eissn and article_data.get('eissn'):
-                        article.eissn = article_data.get('eissn')
-                        updated = True
-                    
-                    if updated:
-                        db.session.flush()
-                        log_activity('INFO', 'push', f'更新文章 {article.pmid} 的ISSN信息')
-                
-                # 检查用户是否已收到此文章推送
-                existing_user_article = UserArticle.query.filter_by(
-                    user_id=user.id, 
-                    article_id=article.id,
-                    subscription_id=subscription.id
-                ).first()
-                
-                if not existing_user_article:
-                    # 重新检查ISSN筛选条件（基于最新的文章数据）
-                    if filter_params['exclude_no_issn']:
-                        has_issn = bool(article.issn or article.eissn)
-                        if not has_issn:
-                            log_activity('INFO', 'push', f'跳过无ISSN文章: {article.pmid}')
-                            continue
-                    
-                    # 创建用户-文章关联
-                    user_article = UserArticle(
-                        user_id=user.id,
-                        article_id=article.id,
-                        subscription_id=subscription.id
-                    )
-                    db.session.add(user_article)
-                    new_articles.append(article)
+            # 过滤已推送的文章并批量保存新文章（与更新搜索时间在同一事务中提交）
+            saved = self._save_new_articles(
+                user, subscription, fetch_result.get('articles', []),
+                filter_params['exclude_no_issn'], per_subscription=True
+            )
+            new_articles = saved['articles']
             
             # 更新订阅的最后搜索时间
             subscription.last_search = beijing_now()
             db.session.commit()
+            self._log_saved_articles(saved)
             
             if not new_articles:
                 log_activity('INFO', 'scheduler', f'订阅 {subscription_id} 无新文章（筛选后）')
@@ -1422,31 +1743,21 @@ class SimpleLiteraturePushService:
                     'message': 'No new articles after filtering'
                 }
             
-            # 使用AI翻译摘要（如果启用）
-            if SystemSetting.get_setting('ai_translation_enabled', 'false') == 'true':
-                try:
-                    log_activity('INFO', 'push', f'开始为订阅 {subscription_id} 的 {len(new_articles)} 篇文章进行AI翻译')
-                    ai_service.batch_translate_abstracts(new_articles)
-                    log_activity('INFO', 'push', f'订阅 {subscription_id} 的文章AI翻译完成')
-                except Exception as e:
-                    log_activity('WARNING', 'push', f'订阅 {subscription_id} 的AI翻译失败: {str(e)}')
-            
-            # 使用AI生成文献简介（如果启用）
-            if SystemSetting.get_setting('ai_brief_intro_enabled', 'false') == 'true':
-                try:
-                    log_activity('INFO', 'push', f'开始为订阅 {subscription_id} 的 {len(new_articles)} 篇文章生成AI简介')
-                    ai_service.batch_generate_brief_intros(new_articles)
-                    log_activity('INFO', 'push', f'订阅 {subscription_id} 的文章AI简介生成完成')
-                except Exception as e:
-                    log_activity('WARNING', 'push', f'订阅 {subscription_id} 的AI简介生成失败: {str(e)}')
-            
-            # 发送邮件通知
-            articles_by_subscription = {subscription.keywords: new_articles}
-            self._send_email_notification(user, new_articles, articles_by_subscription)
+            # 分阶段推送: 新文章交给后续的AI增强、渲染和发送任务
+            if on_new_articles is not None:
+                on_new_articles(subscription, user, new_articles)
+                return {
+                    'subscription_id': subscription_id,
+                    'user_email': user.email,
+                    'keywords': subscription.keywords,
+                    'success': True,
+                    'articles_found': len(new_articles),
+                    'message': f'Handed off {len(new_articles)} new articles'
+                }
             
-            # 更新用户最后推送时间（按订阅级别，用户可能有多个订阅在不同时间推送）
-            user.last_push = beijing_now()
-            db.session.commit()
+            self.enrich_push_articles(subscription_id, new_articles)
+            message = self.render_push_email(user, new_articles, {subscription.keywords: new_articles})
+            self.deliver_push_email(user, message)
             
             log_activity('INFO', 'scheduler', f'订阅 {subscription_id} 推送完成：发送了 {len(new_articles)} 篇新文章给用户 {user.email}')
             
@@ -1459,7 +1770,10 @@ class SimpleLiteraturePushService:
                 'message': f'Sent {len(new_articles)} new articles'
             }
             
+        except PushGroupBusy:
+            raise
         except Exception as e:
+            db.session.rollback()
             error_msg = f'处理订阅 {subscription_id} 失败: {str(e)}'
             log_activity('ERROR', 'scheduler', error_msg)
             return {
@@ -1485,6 +1799,7 @@ class SimpleLiteraturePushService:
         articles_by_subscription = {}  # 按订阅分组的文章
         
         for subscription in subscriptions:
+            saved = None
             try:
                 # 使用订阅的个人参数设置
                 filter_params = subscription.get_filter_params()
@@ -1500,85 +1815,36 @@ class SimpleLiteraturePushService:
                     jcr_filter=filter_params['jcr_filter'],
                     zky_filter=filter_params['zky_filter'],
                     exclude_no_issn=filter_params['exclude_no_issn'],
-                    user_email=user.email
+                    user_email=user.email,
+                    subscription=subscription
                 )
                 
                 # 检查是否有符合条件的文章
                 if fetch_result.get('filtered_count', 0) > 0:
                     
-                    # 过滤已推送的文章并保存新文章
-                    new_articles = []
-                    for article_data in fetch_result.get('articles', []):
-                        # 检查文章是否已存在
-                        existing_article = Article.query.filter_by(pmid=article_data['pmid']).first()
-                        
-                        if not existing_article:
-                            # 保存新文章
-                            article = Article(
-                                pmid=article_data['pmid'],
-                                title=article_data['title'],
-                                authors=article_data['authors'],
-                                journal=article_data['journal'],
-                                pubmed_url=article_data['url'],
-                                abstract=article_data.get('abstract', ''),
-                                issn=article_data.get('issn', ''),
-                                eissn=article_data.get('eissn', ''),
-                            )
-                            db.session.add(article)
-                            db.session.flush()
-                        else:
-                            # 使用已存在的文章，但更新ISSN信息（如果之前没有）
-                            article = existing_article
-                            
-                            # 检查并更新ISSN信息
-                            updated = False
-                            if not article.issn and article_data.get('issn'):
-                                article.issn = article_data.get('issn')
-                                updated = True
-                            if not article.eissn and article_data.get('eissn'):
-                                article.eissn = article_data.get('eissn')
-                                updated = True
-                            
-                            if updated:
-                                db.session.flush()
-                                log_activity('INFO', 'push', f'更新文章 {article.pmid} 的ISSN信息')
-                        
-                        # 检查用户是否已收到此文章推送
-                        existing_user_article = UserArticle.query.filter_by(
-                            user_id=user.id, article_id=article.id
-                        ).first()
-                        
-                        if not existing_user_article:
-                            # 重新检查ISSN筛选条件（基于最新的文章数据）
-                            if filter_params['exclude_no_issn']:
-                                has_issn = bool(article.issn or article.eissn)
-                                if not has_issn:
-                                    log_activity('INFO', 'push', f'跳过无ISSN文章: {article.pmid}')
-                                    continue
-                            
-                            # 创建用户-文章关联
-                            user_article = UserArticle(
-                                user_id=user.id,
-                                article_id=article.id,
-                                subscription_id=subscription.id
-                            )
-                            db.session.add(user_article)
-                            new_articles.append(article)
+                    # 过滤已推送的文章并批量保存新文章（同一用户收到过的文章不再推送）
+                    saved = self._save_new_articles(
+                        user, subscription, fetch_result.get('articles', []),
+                        filter_params['exclude_no_issn'], per_subscription=False
+                    )
+                    new_articles = saved['articles']
                     
                     # 如果这个订阅有新文章，记录到分组中
                     if new_articles:
                         articles_by_subscription[subscription.keywords] = new_articles
                         all_new_articles.extend(new_articles)
                 
-                # 更新订阅的最后搜索时间
+                # 更新订阅的最后搜索时间（每个订阅一个事务）
                 subscription.last_search = beijing_now()
+                db.session.commit()
+                if saved:
+                    self._log_saved_articles(saved)
                 
             except Exception as e:
+                db.session.rollback()
                 log_activity('ERROR', 'push', f'处理订阅 {subscription.id} 失败: {str(e)}')
                 continue
         
-        db.session.commit()
-        
         # 为每个有新文章的订阅单独发送邮件
         total_sent_articles = 0
         emails_sent = 0
@@ -1619,12 +1885,6 @@ class SimpleLiteraturePushService:
             
             log_activity('INFO', 'push', f'为用户 {user.email} 总共发送了 {emails_sent} 封邮件，推送了 {total_sent_articles} 篇新文章')
         
-        # 检查并清理过多的文章
-        try:
-            self._cleanup_old_articles_if_needed()
-        except Exception as e:
-            log_activity('WARNING', 'system', f'文章自动清理失败: {str(e)}')
-        
         return {
             'user_id': user.id,
             'user_email': user.email,
@@ -1634,561 +1894,623 @@ class SimpleLiteraturePushService:
             'message': f'Sent {emails_sent} emails with {total_sent_articles} new articles'
         }
     
-    def _cleanup_old_articles_if_needed(self):
-        """检查文章数量，超过1000篇时清理最早的100篇"""
-        try:
-            total_articles = Article.query.count()
-            max_articles = int(SystemSetting.get_setting('max_articles_limit', '1000'))
-            cleanup_count = int(SystemSetting.get_setting('cleanup_articles_count', '100'))
-            
-            if total_articles > max_articles:
-                # 获取最早的文章（按ID排序，ID越小越早）
-                oldest_articles = Article.query.order_by(Article.id.asc()).limit(cleanup_count).all()
-                
-                if oldest_articles:
-                    # 删除这些文章对应的UserArticle记录
-                    article_ids = [article.id for article in oldest_articles]
-                    UserArticle.query.filter(UserArticle.article_id.in_(article_ids)).delete(synchronize_session=False)
-                    
-                    # 删除文章本身
-                    Article.query.filter(Article.id.in_(article_ids)).delete(synchronize_session=False)
-                    
-                    db.session.commit()
-                    
-                    log_activity('INFO', 'system', 
-                               f'自动清理完成：删除了{len(oldest_articles)}篇最早的文章，当前文章总数：{total_articles - len(oldest_articles)}')
-                    
-                    app.logger.info(f"文章自动清理: 删除了{len(oldest_articles)}篇文章，剩余{total_articles - len(oldest_articles)}篇")
-                    
-        except Exception as e:
-            app.logger.error(f"文章自动清理失败: {str(e)}")
-            raise
+    def enrich_push_articles(self, subscription_id, articles):
+        """推送阶段2: AI翻译摘要和生成文献简介（如果启用），结果保存在文章记录中"""
+        # 使用AI翻译摘要（如果启用）
+        if SystemSetting.get_setting('ai_translation_enabled', 'false') == 'true':
+            try:
+                log_activity('INFO', 'push', f'开始为订阅 {subscription_id} 的 {len(articles)} 篇文章进行AI翻译')
+                ai_service.batch_translate_abstracts(articles)
+                log_activity('INFO', 'push', f'订阅 {subscription_id} 的文章AI翻译完成')
+            except Exception as e:
+                log_activity('WARNING', 'push', f'订阅 {subscription_id} 的AI翻译失败: {str(e)}')
+        
+        # 使用AI生成文献简介（如果启用）
+        if SystemSetting.get_setting('ai_brief_intro_enabled', 'false') == 'true':
+            try:
+                log_activity('INFO', 'push', f'开始为订阅 {subscription_id} 的 {len(articles)} 篇文章生成AI简介')
+                ai_service.batch_generate_brief_intros(articles)
+                log_activity('INFO', 'push', f'订阅 {subscription_id} 的文章AI简介生成完成')
+            except Exception as e:
+                log_activity('WARNING', 'push', f'订阅 {subscription_id} 的AI简介生成失败: {str(e)}')
     
-    def _send_email_notification(self, user, articles, articles_by_subscription=None):
-        """发送邮件通知 - 现在只处理单个订阅"""
+    def render_push_email(self, user, articles, articles_by_subscription=None):
+        """推送阶段3: 生成邮件主题和内容"""
+        from datetime import datetime
+        current_date = datetime.now().strftime('%Y年%m月%d日')
+        
+        # 生成邮件主题，包含关键词信息
+        if articles_by_subscription and len(articles_by_subscription) == 1:
+            # 获取关键词（单个订阅）
+            keywords = list(articles_by_subscription.keys())[0]
+            subject = f"{current_date} {keywords}文献推送-您有{len(articles)}篇新文献"
+        elif articles_by_subscription:
+            # 摘要邮件: 多个订阅合并
+            subject = f"{current_date} {len(articles_by_subscription)}个主题文献推送汇总-您有{len(articles)}篇新文献"
+        else:
+            # 备用格式
+            subject = f"{current_date} PubMed文献推送-您有{len(articles)}篇新文献"
+        
+        return {
+            'subject': subject,
+            'html_body': self._generate_email_html(user, articles, articles_by_subscription),
+            'text_body': self._generate_email_text(user, articles, articles_by_subscription),
+            'articles_count': len(articles)
+        }
+    
+    def deliver_push_email(self, user, message):
+        """推送阶段4: 发送已渲染的邮件并更新用户最后推送时间"""
         try:
-            # 获取当前日期
-            from datetime import datetime
-            current_date = datetime.now().strftime('%Y年%m月%d日')
-
-            # 生成邮件主题，包含关键词信息
-            if articles_by_subscription and len(articles_by_subscription) == 1:
-                # 获取关键词（现在总是只有一个）
-                keywords = list(articles_by_subscription.keys())[0]
-                subject = f"{current_date} {keywords}文献推送-您有{len(articles)}篇新文献"
-            else:
-                # 备用格式
-                subject = f"{current_date} PubMed文献推送-您有{len(articles)}篇新文献"
-            
-            # 生成邮件内容
-            html_body = self._generate_email_html(user, articles, articles_by_subscription)
-            text_body = self._generate_email_text(user, articles, articles_by_subscription)
-            
-            # 使用MailSender发送邮件
-            success = self.mail_sender.send_email(user.email, subject, html_body, text_body)
+            success = self.mail_sender.send_email(user.email, message['subject'], message['html_body'], message['text_body'])
             
             if success:
-                log_activity('INFO', 'push', f'邮件推送成功: {user.email}, {len(articles)} 篇文章')
+                log_activity('INFO', 'push', f'邮件推送成功: {user.email}, {message["articles_count"]} 篇文章')
             else:
                 log_activity('ERROR', 'push', f'邮件推送失败: {user.email}')
-                
         except Exception as e:
+            success = False
             log_activity('ERROR', 'push', f'邮件推送异常: {user.email}, {e}')
-    
-    def _generate_email_html(self, user, articles, articles_by_subscription=None):
-        """生成邮件HTML内容 - 现在只处理单个订阅"""
         
-        # 生成开头文案，包含关键词信息
-        if articles_by_subscription and len(articles_by_subscription) == 1:
-            # 获取关键词（现在总是只有一个）
-            keywords = list(articles_by_subscription.keys())[0]
-            greeting_text = f"您设置的<strong>{keywords}</strong>主题词，我们为您找到了以下最新的学术文献："
-        else:
-            # 备用格式
-            greeting_text = "我们为您找到了以下最新的学术文献："
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>PubMed文献推送</title>
-            <style>
-                /* 基础样式 */
-                * {{ box-sizing: border-box; }}
-                body {{ 
-                    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif; 
-                    margin: 0; 
-                    padding: 15px; 
-                    background-color: #f8f9fa; 
-                    line-height: 1.5;
-                    color: #212529;
-                }}
-                
-                /* 容器样式 */
-                .container {{ 
-                    max-width: 800px; 
-                    margin: 0 auto; 
-                    background-color: white; 
-                    border-radius: 12px; 
-                    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-                    overflow: hidden;
-                }}
-                
-                /* 头部样式 */
-                .header {{ 
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                    color: white; 
-                    padding: 30px 20px; 
-                    text-align: center; 
-                }}
-                .header h1 {{ 
-                    margin: 0 0 10px 0; 
-                    font-size: 28px; 
-                    font-weight: 600; 
-                }}
-                .header p {{ 
-                    margin: 0; 
-                    font-size: 16px; 
-                    opacity: 0.9; 
-                }}
-                
-                /* 内容区域 */
-                .content {{ 
-                    padding: 30px 20px; 
-                }}
-                .greeting {{ 
-                    font-size: 16px; 
-                    margin-bottom: 25px; 
-                    color: #495057; 
-                }}
-                
-                /* 简介汇总样式 */
-                .brief-summary {{
-                    background: linear-gradient(135deg, #fff3cd 0%, #ffeaa7 100%);
-                    border: 1px solid #ffeaa7;
-                    border-radius: 12px;
-                    padding: 20px;
-                    margin-bottom: 30px;
-                    box-shadow: 0 3px 6px rgba(255, 193, 7, 0.1);
-                }}
-                .summary-title {{
-                    font-size: 18px;
-                    font-weight: 600;
-                    color: #856404;
-                    margin-bottom: 15px;
-                    text-align: center;
-                }}
-                .summary-content {{
-                    font-size: 14px;
-                    line-height: 1.8;
-                    color: #6c5f00;
-                    text-align: left;
-                }}
-                
-                /* 文章样式 */
-                .article {{ 
-                    border: 1px solid #e9ecef; 
-                    border-radius: 8px; 
-                    padding: 20px; 
-                    margin-bottom: 20px; 
-                    background-color: #fff;
-                    box-shadow: 0 2px 4px rgba(0, 0, 0, 0.05);
-                }}
-                .article:last-child {{ 
-                    margin-bottom: 0; 
-                }}
-                
-                /* 序号和标题 */
-                .article-header {{ 
-                    display: flex; 
-                    align-items: flex-start; 
-                    margin-bottom: 15px; 
-                }}
-                .article-number {{ 
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                    color: white; 
-                    font-weight: bold; 
-                    padding: 8px 12px; 
-                    border-radius: 20px; 
-                    min-width: 35px; 
-                    text-align: center; 
-                    margin-right: 15px; 
-                    flex-shrink: 0;
-                    font-size: 14px;
-                }}
-                .title {{ 
-                    font-size: 18px; 
-                    font-weight: 600; 
-                    color: #2c3e50; 
-                    margin: 0; 
-                    line-height: 1.4;
-                }}
-                .title a {{ 
-                    color: #2c3e50; 
-                    text-decoration: none; 
-                }}
-                .title a:hover {{ 
-                    color: #667eea; 
-                }}
-                
-                /* 期刊信息 */
-                .journal-info {{ 
-                    margin: 15px 0; 
-                    padding: 15px; 
-                    background-color: #f8f9fa; 
-                    border-radius: 6px;
-                }}
-                .journal-name {{ 
-                    font-weight: 600; 
-                    color: #495057; 
-                    font-size: 15px; 
-                    margin-bottom: 8px; 
-                }}
-                
-                /* 质量标签 */
-                .quality-badges {{ 
-                    margin: 10px 0; 
-                }}
-                .quality-badge {{ 
-                    display: inline-block; 
-                    padding: 6px 12px; 
-                    border-radius: 20px; 
-                    font-size: 12px; 
-                    font-weight: 600; 
-                    margin: 2px 5px 2px 0; 
-                    white-space: nowrap;
-                }}
-                .jcr-quartile {{ 
-                    background-color: #e3f2fd; 
-                    color: #1565c0; 
-                }}
-                .impact-factor {{ 
-                    background-color: #f3e5f5; 
-                    color: #7b1fa2; 
-                }}
-                .cas-category {{ 
-                    background-color: #e8f5e8; 
-                    color: #2e7d32; 
-                }}
-                .top-journal {{ 
-                    background-color: #fff3e0; 
-                    color: #f57c00; 
-                    border: 1px solid #ffcc02; 
-                }}
-                
-                /* 摘要样式 */
-                .abstract-section {{ 
-                    margin: 20px 0; 
-                }}
-                .abstract-title {{ 
-                    font-weight: 600; 
-                    color: #495057; 
-                    font-size: 14px; 
-                    margin-bottom: 8px; 
-                    border-left: 4px solid #667eea; 
-                    padding-left: 10px;
-                }}
-                .abstract-content {{ 
-                    color: #6c757d; 
-                    font-size: 14px; 
-                    line-height: 1.6; 
-                    padding: 12px; 
-                    background-color: #f8f9fa; 
-                    border-radius: 6px; 
-                    border: 1px solid #e9ecef;
-                }}
-                .chinese-abstract {{ 
-                    background-color: #fff8e1; 
-                    border: 1px solid #ffecb3; 
-                }}
-                
-                /* 底部样式 */
-                .footer {{ 
-                    text-align: center; 
-                    padding: 30px 20px; 
-                    background-color: #f8f9fa; 
-                    color: #6c757d; 
-                    font-size: 13px; 
-                    line-height: 1.5;
-                }}
-                .footer p {{ 
-                    margin: 5px 0; 
-                }}
-                
-                /* 移动端适配 */
-                @media only screen and (max-width: 600px) {{
-                    body {{ padding: 10px; }}
-                    .container {{ border-radius: 8px; }}
-                    .header {{ padding: 20px 15px; }}
-                    .header h1 {{ font-size: 24px; }}
-                    .content {{ padding: 20px 15px; }}
-                    .brief-summary {{ padding: 15px; margin-bottom: 20px; }}
-                    .summary-title {{ font-size: 16px; }}
-                    .summary-content {{ font-size: 13px; line-height: 1.6; }}
-                    .article {{ padding: 15px; }}
-                    .article-header {{ flex-direction: column; align-items: flex-start; }}
-                    .article-number {{ margin-bottom: 10px; margin-right: 0; }}
-                    .title {{ font-size: 16px; }}
-                    .quality-badge {{ margin: 2px 3px 2px 0; font-size: 11px; padding: 4px 8px; }}
-                    .abstract-content {{ font-size: 13px; padding: 10px; }}
-                }}
-                
-                /* 超小屏幕适配 */
-                @media only screen and (max-width: 480px) {{
-                    body {{ padding: 5px; }}
-                    .header {{ padding: 15px 10px; }}
-                    .header h1 {{ font-size: 22px; }}
-                    .content {{ padding: 15px 10px; }}
-                    .article {{ padding: 12px; }}
-                    .title {{ font-size: 15px; }}
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>📚 PubMed 文献推送</h1>
-                    <p>为您推送 {len(articles)} 篇最新文献</p>
-                </div>
-                
-                <div class="content">
-                    <div class="greeting">
-                        <p>亲爱的用户，</p>
-                        <p>{greeting_text}</p>
-                    </div>
+        # 更新用户最后推送时间（按订阅级别，用户可能有多个订阅在不同时间推送）
+        user.last_push = beijing_now()
+        db.session.commit()
+        return success
+    
+    def deliver_push_wave(self, deliveries):
         """
+        一组推送邮件统一AI增强、渲染后，通过mail_sender.send_batch按各邮箱剩余配额并行发送
         
-        # 添加文献简介汇总部分
-        brief_intros = []
-        for i, article in enumerate(articles, 1):
-            title = getattr(article, 'title', '未知标题')
-            brief_intro = getattr(article, 'brief_intro', '')
-            if brief_intro:
-                # 使用醒目的编号样式，不使用href链接（避免邮件客户端转换）
-                brief_intros.append(f'''
-                    <div style="padding: 12px 0; border-bottom: 1px solid #ffeaa7;">
-                        <div style="margin-bottom: 8px;">
-                            <span style="display: inline-block; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; font-weight: bold; padding: 4px 12px; border-radius: 6px; margin-right: 10px; font-size: 14px; min-width: 30px; text-align: center;">第{i}篇</span>
-                            <span style="color: #2c3e50; font-size: 14px; font-weight: 600;">{title}</span>
-                        </div>
-                        <div style="color: #495057; font-size: 15px; line-height: 1.6; margin-left: 0px; padding-left: 0px;">
-                            {brief_intro}
-                        </div>
-                    </div>
-                ''')
-
-        if brief_intros:
-            html_content += f"""
-                    <div class="brief-summary">
-                        <div class="summary-title">📋 文献速览（按序号查看下方详情）</div>
-                        <div class="summary-content">
-                            {''.join(brief_intros)}
-                        </div>
-                    </div>
-            """
-        
-        # 获取PubMed API实例来查询期刊质量
-        api = PubMedAPI()
+        Args:
+            deliveries: [(subscription, user, new_articles), ...]
         
-        for i, article in enumerate(articles, 1):
-            # 获取期刊质量信息
-            issn = getattr(article, 'issn', '') or getattr(article, 'eissn', '')
-            journal_quality = api.get_journal_quality(issn) if issn else {}
-            
-            # 构建质量标签
-            quality_badges = []
-            
-            # JCR分区
-            if journal_quality.get('jcr_quartile'):
-                quality_badges.append(f'<span class="quality-badge jcr-quartile">JCR {journal_quality["jcr_quartile"]}</span>')
-            
-            # 影响因子
-            if journal_quality.get('jcr_if'):
-                quality_badges.append(f'<span class="quality-badge impact-factor">IF {journal_quality["jcr_if"]}</span>')
-                
-            # 中科院分区（如果是Top期刊，显示为"1区Top"格式）
-            if journal_quality.get('zky_category'):
-                if journal_quality.get('zky_top') and journal_quality['zky_top'] == '是':
-                    quality_badges.append(f'<span class="quality-badge top-journal">{journal_quality["zky_category"]}区 Top</span>')
-                else:
-                    quality_badges.append(f'<span class="quality-badge cas-category">中科院 {journal_quality["zky_category"]}区</span>')
-            
-            quality_html = f'<div class="quality-badges">{"".join(quality_badges)}</div>' if quality_badges else ''
-            
-            # 构建摘要部分
-            abstract_html = ""
-            if hasattr(article, 'abstract') and article.abstract:
-                # 英文摘要
-                abstract_html += f'''
-                    <div class="abstract-section">
-                        <div class="abstract-title">📄 英文摘要</div>
-                        <div class="abstract-content">{article.abstract}</div>
-                    </div>
-                '''
-                
-                # 中文翻译（如果有）
-                if hasattr(article, 'abstract_translation') and article.abstract_translation:
-                    abstract_html += f'''
-                        <div class="abstract-section">
-                            <div class="abstract-title">📝 中文摘要</div>
-                            <div class="abstract-content chinese-abstract">{article.abstract_translation}</div>
-                        </div>
-                    '''
-                
-            
-            # 获取发表日期
-            pub_date_html = ""
-            if hasattr(article, 'publish_date') and article.publish_date:
-                pub_date_html = f'<div style="color: #6c757d; font-size: 13px; margin-top: 5px;">📅 发表日期: {article.publish_date.strftime("%Y-%m-%d")}</div>'
-            elif hasattr(article, 'pub_date') and article.pub_date:
-                pub_date_html = f'<div style="color: #6c757d; font-size: 13px; margin-top: 5px;">📅 发表日期: {article.pub_date}</div>'
-            
-            # 构建ISSN信息
-            issn_info = ""
-            article_issn = getattr(article, 'issn', '')
-            article_eissn = getattr(article, 'eissn', '')
-            
-            issn_parts = []
-            if article_issn:
-                issn_parts.append(f"ISSN: {article_issn}")
-            if article_eissn:
-                issn_parts.append(f"eISSN: {article_eissn}")
-            
-            if issn_parts:
-                issn_info = f'<div style="color: #6c757d; font-size: 13px; margin-top: 5px;">📝 {" • ".join(issn_parts)}</div>'
-            
-            html_content += f"""
-                    <div class="article" id="article-{i}">
-                        <div class="article-header">
-                            <div class="article-number">第{i}篇</div>
-                            <h3 class="title">
-                                <a href="{getattr(article, 'pubmed_url', '#')}" target="_blank">
-                                    {getattr(article, 'title', '未知标题')}
-                                </a>
-                            </h3>
-                        </div>
-
-                        <div class="journal-info">
-                            <div class="journal-name">
-                                📖 {getattr(article, 'journal', '未知期刊')}
-                            </div>
-                            {pub_date_html}
-                            {issn_info}
-                            {quality_html}
-                        </div>
-
-                        {abstract_html}
-                    </div>
-            """
+        Returns:
+            int: 发送成功的邮件数
+        """
+        prepared = []
+        for subscription, user, articles in deliveries:
+            try:
+                self.enrich_push_articles(subscription.id, articles)
+                prepared.append((user, self.render_push_email(user, articles, {subscription.keywords: articles})))
+            except Exception as e:
+                db.session.rollback()
+                log_activity('ERROR', 'push', f'订阅 {subscription.id} 邮件生成失败: {e}')
+        if not prepared:
+            return 0
+        
+        results = self.mail_sender.send_batch([
+            OutgoingMail(user.email, message['subject'], message['html_body'], message['text_body'])
+            for user, message in prepared
+        ])
+        
+        now = beijing_now()
+        for (user, message), success in zip(prepared, results):
+            if success:
+                log_activity('INFO', 'push', f'邮件推送成功: {user.email}, {message["articles_count"]} 篇文章')
+            else:
+                log_activity('ERROR', 'push', f'邮件推送失败: {user.email}')
+            user.last_push = now
+        db.session.commit()
+        return sum(1 for success in results if success)
+    
+    def process_subscription_group(self, subscription_ids, wave_id=None, on_new_articles=None, defer_when_busy=False):
+        """
+        分组推送: 同组订阅只搜索一次，再按订阅分别去重、AI增强和发送邮件
         
-        html_content += f"""
-                </div>
-                
-                <div class="footer">
-                    <p><strong>此邮件由 PubMed Literature Push 自动发送，请勿回复。</strong></p>
-                    <p>如需修改推送设置，请登录系统管理后台</p>
-                </div>
-            </div>
-        </body>
-        </html>
+        运行时重新计算分组键，入队后参数已变化的订阅单独搜索
+        
+        Args:
+            subscription_ids: 同一分组的订阅ID列表
+            wave_id: 推送波次标识，默认为当前小时
+            on_new_articles: 分阶段推送时接收各订阅新文章的回调
+            defer_when_busy: 同组搜索被其他任务占用时抛出PushGroupBusy，由RQ任务延后重新排队
+        
+        Returns:
+            dict: {'success', 'results', 'subscriptions', 'searches'}
         """
+        wave_id = wave_id or self._current_wave_id()
+        subscriptions = Subscription.query.filter(Subscription.id.in_(subscription_ids)).all()
+        active = [sub for sub in subscriptions if sub.is_active and sub.user and sub.user.is_active]
+        if not active:
+            return {'success': True, 'results': [], 'subscriptions': 0, 'searches': 0}
+        
+        leader = active[0]
+        group_key = self.get_push_group_key(leader)
+        filter_params = leader.get_filter_params()
+        
+        searches = 0
+        shared_result = None
+        try:
+            shared_result = self._fetch_for_push(leader, leader.user, filter_params, defer_when_busy)
+            if not shared_result.get('from_cache'):
+                searches += 1
+        except PushGroupBusy:
+            raise
+        except Exception as e:
+            log_activity('ERROR', 'scheduler', f'分组搜索失败，改为逐个订阅搜索: {str(e)}')
         
-        return html_content
+        # 未使用分阶段推送时，先收集各订阅的新文章，最后整组按邮箱配额并行发送
+        outbox = []
+        if on_new_articles is None:
+            on_new_articles = lambda subscription, user, articles: outbox.append((subscription, user, articles))
+        
+        results = []
+        for subscription in active:
+            if shared_result is not None and self.get_push_group_key(subscription) == group_key:
+                results.append(self.process_single_subscription(
+                    subscription.id, fetch_result=shared_result, on_new_articles=on_new_articles
+                ))
+            else:
+                results.append(self.process_single_subscription(
+                    subscription.id, wave_id=wave_id, on_new_articles=on_new_articles
+                ))
+        if outbox:
+            self.deliver_push_wave(outbox)
+        
+        # 单独搜索的订阅已在process_single_subscription中计入波次统计
+        shared_count = len(active) - sum(
+            1 for subscription in active
+            if shared_result is None or self.get_push_group_key(subscription) != group_key
+        )
+        if shared_count:
+            self._record_push_wave(wave_id, shared_count, searches)
+        
+        log_activity('INFO', 'scheduler', f'分组推送完成: 关键词 "{leader.keywords[:50]}", '
+                                          f'{len(active)} 个订阅共享 {searches} 次PubMed搜索')
+        return {
+            'success': True,
+            'results': results,
+            'subscriptions': len(active),
+            'searches': searches
+        }
     
-    def _generate_email_text(self, user, articles, articles_by_subscription=None):
-        """生成邮件纯文本内容 - 现在只处理单个订阅"""
+    def get_push_group_key(self, subscription):
+        """推送分组键: 标准化关键词 + 搜索窗口 + 推送篇数 + 期刊筛选条件"""
+        import json
+        import hashlib
+        
+        def canonical(value):
+            # 筛选条件中的列表与顺序无关
+            if isinstance(value, dict):
+                return {key: canonical(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return sorted(str(item) for item in value)
+            return value
+        
+        filter_params = subscription.get_filter_params()
+        payload = {
+            'keywords': ' '.join(subscription.keywords.lower().split()),
+            'days_back': filter_params['days_back'],
+            'max_results': self._push_max_results(filter_params),
+            'jcr_filter': canonical(filter_params['jcr_filter']),
+            'zky_filter': canonical(filter_params['zky_filter']),
+            'exclude_no_issn': bool(filter_params['exclude_no_issn'])
+        }
+        return hashlib.md5(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def get_push_wave_stats(self, limit=10):
+        """最近推送波次的搜索共享统计"""
+        try:
+            wave_ids = redis_conn.zrevrange(self.PUSH_WAVE_INDEX_KEY, 0, limit - 1)
+            pipe = redis_conn.pipeline(transaction=False)
+            for wave_id in wave_ids:
+                pipe.hgetall(f"{self.PUSH_WAVE_PREFIX}:{wave_id.decode('utf-8') if isinstance(wave_id, bytes) else wave_id}")
+            waves = []
+            for wave_id, raw in zip(wave_ids, pipe.execute()):
+                counters = {
+                    (name.decode('utf-8') if isinstance(name, bytes) else name): int(value)
+                    for name, value in raw.items()
+                }
+                subscriptions = counters.get('subscriptions', 0)
+                searches = counters.get('searches', 0)
+                waves.append({
+                    'wave': wave_id.decode('utf-8') if isinstance(wave_id, bytes) else wave_id,
+                    'subscriptions': subscriptions,
+                    'searches': searches,
+                    'saved_calls': subscriptions - searches
+                })
+            return waves
+        except Exception as e:
+            app.logger.error(f"读取推送波次统计失败: {e}")
+            return []
+    
+    @staticmethod
+    def _push_max_results(filter_params):
+        """推送篇数: 订阅设置与系统推送上限中的较小者"""
+        return min(filter_params['max_results'], int(SystemSetting.get_setting('push_max_articles', '10')))
+    
+    def _fetch_for_push(self, subscription, user, filter_params, defer_when_busy=False):
+        """
+        搜索订阅的新文章
         
-        # 生成开头文案，包含关键词信息
-        if articles_by_subscription and len(articles_by_subscription) == 1:
-            # 获取关键词（现在总是只有一个）
-            keywords = list(articles_by_subscription.keys())[0]
-            greeting_text = f"您设置的{keywords}主题词，我们为您找到了以下最新的学术文献："
+        同组订阅同时推送时，只有拿到分组锁的任务调用PubMed；
+        defer_when_busy时其他任务抛出PushGroupBusy，由RQ任务延后重新排队，
+        届时直接命中前者写入的搜索缓存，等待期间不占用Worker。否则直接搜索
+        """
+        lock_key = f"{self.PUSH_GROUP_LOCK_PREFIX}:{self.get_push_group_key(subscription)}"
+        acquired = False
+        try:
+            acquired = bool(redis_conn.set(lock_key, 1, nx=True, ex=self.PUSH_GROUP_LOCK_TTL))
+        except Exception as e:
+            app.logger.warning(f"推送分组锁不可用，直接搜索: {e}")
         else:
-            # 备用格式
-            greeting_text = "我们为您找到了以下最新的学术文献："
-            
-        content = f"PubMed 文献推送\\n\\n{greeting_text}\\n\\n"
+            if not acquired and defer_when_busy:
+                raise PushGroupBusy(lock_key)
+        
+        try:
+            api = PubMedAPI()
+            return api.search_and_fetch_with_filter(
+                keywords=subscription.keywords,
+                max_results=self._push_max_results(filter_params),
+                days_back=filter_params['days_back'],
+                jcr_filter=filter_params['jcr_filter'],
+                zky_filter=filter_params['zky_filter'],
+                exclude_no_issn=filter_params['exclude_no_issn'],
+                user_email=user.email,
+                subscription=subscription
+            )
+        finally:
+            if acquired:
+                try:
+                    redis_conn.delete(lock_key)
+                except Exception:
+                    pass
+    
+    @staticmethod
+    def _current_wave_id():
+        """定时推送的波次标识（按小时）"""
+        return beijing_now().strftime('%Y-%m-%d %H:00')
+    
+    def _record_push_wave(self, wave_id, subscriptions, searches):
+        """累计推送波次的订阅数和实际PubMed搜索次数"""
+        try:
+            wave_key = f"{self.PUSH_WAVE_PREFIX}:{wave_id}"
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.hincrby(wave_key, 'subscriptions', subscriptions)
+            pipe.hincrby(wave_key, 'searches', searches)
+            pipe.expire(wave_key, self.PUSH_WAVE_TTL)
+            pipe.zadd(self.PUSH_WAVE_INDEX_KEY, {wave_id: time.time()}, nx=True)
+            pipe.zremrangebyrank(self.PUSH_WAVE_INDEX_KEY, 0, -(self.PUSH_WAVE_KEEP + 1))
+            pipe.execute()
+        except Exception as e:
+            app.logger.error(f"记录推送波次统计失败: {e}")
+    
+    def _save_new_articles(self, user, subscription, articles_data, exclude_no_issn, per_subscription=True):
+        """
+        批量保存文章并创建用户-文章关联（不提交事务，由调用方提交）
         
-        # 添加文献简介汇总部分
-        brief_intros = []
-        for i, article in enumerate(articles, 1):
-            title = getattr(article, 'title', '未知标题')
-            brief_intro = getattr(article, 'brief_intro', '')
-            if brief_intro:
-                brief_intros.append(f"{i}、{title}：{brief_intro}")
+        已存在的文章和关联各用一次IN查询加载，缺失的文章和关联各用一条批量INSERT写入
         
-        if brief_intros:
-            content += "📋 今日推送文献简介\\n"
-            content += "=" * 40 + "\\n"
-            for brief in brief_intros:
-                content += f"{brief}\\n\\n"
-            content += "=" * 40 + "\\n\\n"
+        Args:
+            user: 用户
+            subscription: 订阅
+            articles_data: 搜索返回的文章数据列表
+            exclude_no_issn: 是否跳过没有ISSN的文章
+            per_subscription: 是否按订阅判断已推送（否则同一用户收到过即跳过）
         
-        api = PubMedAPI()
+        Returns:
+            dict: {'articles': 新推送的Article列表, 'issn_updated': 补充ISSN的PMID列表,
+                   'skipped_no_issn': 因无ISSN跳过的PMID列表}
+        """
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
         
-        for i, article in enumerate(articles, 1):
-            # 获取期刊质量信息
-            issn = getattr(article, 'issn', '') or getattr(article, 'eissn', '')
-            journal_quality = api.get_journal_quality(issn) if issn else {}
-            
-            content += f"{i}. {getattr(article, 'title', '未知标题')}\\n"
-            content += f"   期刊: {getattr(article, 'journal', '未知期刊')}"
-            
-            # 添加发表日期
-            if hasattr(article, 'publish_date') and article.publish_date:
-                content += f" • {article.publish_date.strftime('%Y-%m-%d')}"
-            elif hasattr(article, 'pub_date') and article.pub_date:
-                content += f" • {article.pub_date}"
-            content += "\\n"
-            
-            # 添加ISSN信息
-            article_issn = getattr(article, 'issn', '')
-            article_eissn = getattr(article, 'eissn', '')
-            issn_parts = []
-            if article_issn:
-                issn_parts.append(f"ISSN: {article_issn}")
-            if article_eissn:
-                issn_parts.append(f"eISSN: {article_eissn}")
-            
-            if issn_parts:
-                content += f"   {' • '.join(issn_parts)}\\n"
-            
-            # 添加期刊质量信息
-            quality_info = []
-            if journal_quality.get('jcr_quartile'):
-                quality_info.append(f"JCR {journal_quality['jcr_quartile']}")
-            if journal_quality.get('jcr_if'):
-                quality_info.append(f"IF {journal_quality['jcr_if']}")
-            if journal_quality.get('zky_category'):
-                if journal_quality.get('zky_top') and journal_quality['zky_top'] == '是':
-                    quality_info.append(f"中科院 {journal_quality['zky_category']}区 Top")
-                else:
-                    quality_info.append(f"中科院 {journal_quality['zky_category']}区")
-            
-            if quality_info:
-                content += f"   期刊质量: {' | '.join(quality_info)}\\n"
+        result = {'articles': [], 'issn_updated': [], 'skipped_no_issn': []}
+        
+        # 按PMID去重，保持搜索结果顺序
+        articles_by_pmid = {}
+        for article_data in articles_data:
+            articles_by_pmid.setdefault(article_data['pmid'], article_data)
+        if not articles_by_pmid:
+            return result
+        pmids = list(articles_by_pmid)
+        
+        articles = self._load_articles_by_pmid(pmids)
+        
+        # 保存新文章
+        missing_rows = [
+            {
+                'pmid': pmid,
+                'title': article_data['title'],
+                'authors': article_data['authors'],
+                'journal': article_data['journal'],
+                'pubmed_url': article_data['url'],
+                'abstract': article_data.get('abstract', ''),
+                'issn': article_data.get('issn', ''),
+                'eissn': article_data.get('eissn', ''),
+            }
+            for pmid, article_data in articles_by_pmid.items() if pmid not in articles
+        ]
+        if missing_rows:
+            # 并发推送可能已写入同一文章，冲突时忽略，随后统一加载
+            db.session.execute(
+                sqlite_insert(Article.__table__).on_conflict_do_nothing(index_elements=['pmid']),
+                missing_rows
+            )
+            articles.update(self._load_articles_by_pmid([row['pmid'] for row in missing_rows]))
+        
+        # 使用已存在的文章，但更新ISSN信息（如果之前没有）
+        for pmid, article_data in articles_by_pmid.items():
+            article = articles.get(pmid)
+            if article is None:
+                continue
+            updated = False
+            if not article.issn and article_data.get('issn'):
+                article.issn = article_data.get('issn')
+                updated = True
+            if not article.eissn and article_data.get('eissn'):
+                article.eissn = article_data.get('eissn')
+                updated = True
+            if updated:
+                result['issn_updated'].append(pmid)
+        
+        # 检查用户是否已收到这些文章的推送
+        article_ids = [article.id for article in articles.values()]
+        pushed_query = db.session.query(UserArticle.article_id).filter(
+            UserArticle.user_id == user.id,
+            UserArticle.article_id.in_(article_ids)
+        )
+        if per_subscription:
+            pushed_query = pushed_query.filter(UserArticle.subscription_id == subscription.id)
+        pushed_ids = {row[0] for row in pushed_query.all()}
+        
+        for pmid in pmids:
+            article = articles.get(pmid)
+            if article is None or article.id in pushed_ids:
+                continue
+            # 重新检查ISSN筛选条件（基于最新的文章数据）
+            if exclude_no_issn and not (article.issn or article.eissn):
+                result['skipped_no_issn'].append(pmid)
+                continue
+            result['articles'].append(article)
+        
+        # 创建用户-文章关联（唯一索引保证并发推送时不重复写入）
+        if result['articles']:
+            db.session.execute(sqlite_insert(UserArticle.__table__).on_conflict_do_nothing(
+                index_elements=['user_id', 'article_id', 'subscription_id']
+            ), [
+                {
+                    'user_id': user.id,
+                    'article_id': article.id,
+                    'subscription_id': subscription.id
+                }
+                for article in result['articles']
+            ])
+        
+        return result
+    
+    @staticmethod
+    def _load_articles_by_pmid(pmids):
+        """按PMID批量加载文章"""
+        return {
+            article.pmid: article
+            for article in Article.query.filter(Article.pmid.in_(pmids)).all()
+        }
+    
+    def _log_saved_articles(self, saved):
+        """记录批量保存中的ISSN补充和跳过情况（事务提交后调用，日志写入不拆分保存事务）"""
+        if saved['issn_updated']:
+            log_activity('INFO', 'push', f'更新 {len(saved["issn_updated"])} 篇文章的ISSN信息: '
+                                         f'{", ".join(saved["issn_updated"][:20])}')
+        if saved['skipped_no_issn']:
+            log_activity('INFO', 'push', f'跳过 {len(saved["skipped_no_issn"])} 篇无ISSN文章: '
+                                         f'{", ".join(saved["skipped_no_issn"][:20])}')
+    
+    def _send_email_notification(self, user, articles, articles_by_subscription=None):
+        """发送邮件通知 - 现在只处理单个订阅"""
+        try:
+            # 生成邮件主题和内容
+            message = self.render_push_email(user, articles, articles_by_subscription)
             
-            content += f"   链接: {getattr(article, 'pubmed_url', '#')}\\n"
+            # 使用MailSender发送邮件
+            success = self.mail_sender.send_email(user.email, message['subject'], message['html_body'], message['text_body'])
             
-            # 添加英文摘要
-            if hasattr(article, 'abstract') and article.abstract:
-                content += f"   英文摘要: {article.abstract}\\n"
-                
-                # 添加中文摘要（如果有）
-                if hasattr(article, 'abstract_translation') and article.abstract_translation:
-                    content += f"   中文摘要: {article.abstract_translation}\\n"
+            if success:
+                log_activity('INFO', 'push', f'邮件推送成功: {user.email}, {len(articles)} 篇文章')
+            else:
+                log_activity('ERROR', 'push', f'邮件推送失败: {user.email}')
                 
-            
-            content += "\\n"
-        
-        content += "此邮件由 PubMed Literature Push 自动发送，请勿回复。\\n"
-        
-        return content
+        except Exception as e:
+            log_activity('ERROR', 'push', f'邮件推送异常: {user.email}, {e}')
+    
+    def _generate_email_html(self, user, articles, articles_by_subscription=None):
+        """生成邮件HTML内容 - 多个订阅（摘要邮件）时按关键词分节"""
+        return push_email_renderer.render_html(
+            articles, self._email_keywords(articles_by_subscription), self._email_sections(articles_by_subscription)
+        )
+    
+    def _generate_email_text(self, user, articles, articles_by_subscription=None):
+        """生成邮件纯文本内容 - 多个订阅（摘要邮件）时按关键词分节"""
+        return push_email_renderer.render_text(
+            articles, self._email_keywords(articles_by_subscription), self._email_sections(articles_by_subscription)
+        )
+    
+    @staticmethod
+    def _email_keywords(articles_by_subscription):
+        """邮件开头文案中的关键词（摘要邮件列出全部关键词）"""
+        if articles_by_subscription:
+            return '、'.join(articles_by_subscription.keys())
+        return None
+    
+    @staticmethod
+    def _email_sections(articles_by_subscription):
+        """摘要邮件的关键词分节，单个订阅时不分节"""
+        if articles_by_subscription and len(articles_by_subscription) > 1:
+            return list(articles_by_subscription.items())
+        return None
 
 # 全局推送服务实例
 push_service = SimpleLiteraturePushService()
 
+
+class DataRetentionService:
+    """
+    数据保留清理
+    
+    按时间和引用关系清理过期数据，每次只删除一小批并立即提交，
+    批次之间短暂停顿，避免长事务锁住SQLite影响推送和页面访问:
+    
+    1. 系统日志: 早于 log_retention_days 天
+    2. 推送记录: 早于 article_retention_days 天（不短于订阅的最大检索天数，避免重复推送）
+    3. 文章: 没有任何推送记录引用且早于保留天数；仍超过 max_articles_limit 时
+       继续删除最早的未引用文章（至少保留1天）
+    """
+    
+    PROGRESS_KEY = "pubmed:retention:progress"
+    PROGRESS_TTL = 7 * 24 * 3600
+    CHUNK_PAUSE = 0.2  # 批次之间的停顿秒数
+    
+    def run(self):
+        """执行一轮清理，返回各表删除数量"""
+        started = time.time()
+        chunk_size = self._chunk_size()
+        now = beijing_now()
+        log_days = int(SystemSetting.get_setting('log_retention_days', '30'))
+        article_days = self._article_retention_days()
+        
+        log_cutoff = (now - timedelta(days=log_days)).strftime('%Y-%m-%d %H:%M:%S')
+        article_cutoff = (now - timedelta(days=article_days)).strftime('%Y-%m-%d %H:%M:%S')
+        
+        self._report('running', {'log_retention_days': log_days, 'article_retention_days': article_days})
+        deleted = {}
+        
+        # 按timestamp索引顺序删除过期日志
+        deleted['system_log'] = self.delete_in_chunks(
+            'system_log',
+            "SELECT id FROM system_log WHERE timestamp < :cutoff ORDER BY timestamp LIMIT :limit",
+            {'cutoff': log_cutoff}, chunk_size, deleted
+        )
+        
+        # 推送记录的id与推送时间同序，按主键顺序扫描到第一批过期记录即可
+        deleted['user_article'] = self.delete_in_chunks(
+            'user_article',
+            "SELECT id FROM user_article WHERE push_date < :cutoff ORDER BY id LIMIT :limit",
+            {'cutoff': article_cutoff}, chunk_size, deleted
+        )
+        
+        # 未被引用的过期文章（引用检查走ix_user_article_article_id）
+        unreferenced = ("NOT EXISTS (SELECT 1 FROM user_article WHERE user_article.article_id = article.id)")
+        deleted['article'] = self.delete_in_chunks(
+            'article',
+            f"SELECT id FROM article WHERE created_at < :cutoff AND {unreferenced} ORDER BY id LIMIT :limit",
+            {'cutoff': article_cutoff}, chunk_size, deleted
+        )
+        
+        # 文章数量上限: 只删除1天前入库且未被引用的文章
+        max_articles = int(SystemSetting.get_setting('max_articles_limit', '1000'))
+        excess = db.session.execute(db.text("SELECT COUNT(*) FROM article")).scalar() - max_articles
+        if excess > 0:
+            deleted['article'] += self.delete_in_chunks(
+                'article',
+                f"SELECT id FROM article WHERE created_at < :cutoff AND {unreferenced} ORDER BY id LIMIT :limit",
+                {'cutoff': (now - timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')},
+                chunk_size, deleted, max_rows=excess
+            )
+        
+        duration = time.time() - started
+        self._report('finished', {'duration': round(duration, 1)}, deleted)
+        log_activity('INFO', 'system', f'数据保留清理完成: 日志 {deleted["system_log"]} 条, '
+                                       f'推送记录 {deleted["user_article"]} 条, 文章 {deleted["article"]} 篇 '
+                                       f'(耗时 {duration:.1f}秒)')
+        return deleted
+    
+    def purge_push_records(self, user_id=None):
+        """分批删除全部（或指定用户的）推送记录，返回删除数量"""
+        if user_id is None:
+            select_sql = "SELECT id FROM user_article ORDER BY id LIMIT :limit"
+            params = {}
+        else:
+            select_sql = "SELECT id FROM user_article WHERE user_id = :user_id ORDER BY id LIMIT :limit"
+            params = {'user_id': user_id}
+        return self.delete_in_chunks('user_article', select_sql, params, self._chunk_size(), pause=False)
+    
+    def purge_articles(self):
+        """分批删除全部文章及推送记录，返回 (文章数, 推送记录数)"""
+        chunk_size = self._chunk_size()
+        user_articles = self.purge_push_records()
+        articles = self.delete_in_chunks(
+            'article', "SELECT id FROM article ORDER BY id LIMIT :limit", {}, chunk_size, pause=False
+        )
+        return articles, user_articles
+    
+    def delete_in_chunks(self, table, select_sql, params, chunk_size, progress=None, max_rows=None, pause=True):
+        """
+        按select_sql选出的id分批删除，每批单独提交
+        
+        Args:
+            table: 表名
+            select_sql: 选出待删除id的SQL，需包含 :limit 参数
+            params: SQL参数
+            chunk_size: 每批删除数量
+            progress: 已完成的各表删除数量，用于进度报告
+            max_rows: 最多删除的行数
+            pause: 批次之间是否停顿
+        
+        Returns:
+            int: 删除的行数
+        """
+        total = 0
+        while max_rows is None or total < max_rows:
+            limit = chunk_size if max_rows is None else min(chunk_size, max_rows - total)
+            ids = [row[0] for row in db.session.execute(db.text(select_sql), {**params, 'limit': limit})]
+            if not ids:
+                break
+            
+            placeholders = ', '.join(f':id{index}' for index in range(len(ids)))
+            db.session.execute(
+                db.text(f"DELETE FROM {table} WHERE id IN ({placeholders})"),
+                {f'id{index}': value for index, value in enumerate(ids)}
+            )
+            db.session.commit()
+            total += len(ids)
+            
+            if progress is not None:
+                self._report('running', {'table': table}, {**progress, table: progress.get(table, 0) + total})
+            if len(ids) < limit:
+                break
+            if pause:
+                time.sleep(self.CHUNK_PAUSE)
+        return total
+    
+    def get_progress(self):
+        """最近一次清理的进度"""
+        try:
+            raw = redis_conn.hgetall(self.PROGRESS_KEY)
+            return {
+                (key.decode('utf-8') if isinstance(key, bytes) else key):
+                (value.decode('utf-8') if isinstance(value, bytes) else value)
+                for key, value in raw.items()
+            }
+        except Exception as e:
+            app.logger.error(f"读取数据清理进度失败: {e}")
+            return {}
+    
+    def _article_retention_days(self):
+        """推送记录保留天数不短于订阅的最大检索天数，否则已推送文章会再次推送"""
+        retention_days = int(SystemSetting.get_setting('article_retention_days', '180'))
+        max_days_back = db.session.query(db.func.max(Subscription.days_back)).scalar() or 0
+        return max(retention_days, max_days_back + 1)
+    
+    @staticmethod
+    def _chunk_size():
+        return max(int(SystemSetting.get_setting('cleanup_articles_count', '100')), 1)
+    
+    def _report(self, status, info=None, deleted=None):
+        """写入清理进度（Redis不可用时忽略）"""
+        try:
+            mapping = {'status': status, 'updated_at': beijing_now().strftime('%Y-%m-%d %H:%M:%S')}
+            mapping.update({key: str(value) for key, value in (info or {}).items()})
+            mapping.update({f'deleted_{table}': str(count) for table, count in (deleted or {}).items()})
+            pipe = redis_conn.pipeline(transaction=False)
+            if status == 'running' and not deleted:
+                pipe.delete(self.PROGRESS_KEY)
+            pipe.hset(self.PROGRESS_KEY, mapping=mapping)
+            pipe.expire(self.PROGRESS_KEY, self.PROGRESS_TTL)
+            pipe.execute()
+        except Exception as e:
+            app.logger.warning(f"写入数据清理进度失败: {e}")
+
+# 全局数据保留清理实例
+data_retention_service = DataRetentionService()
+
 # 初始化调度器
 # 初始化调度器（使用配置的时区）
 scheduler = BackgroundScheduler(timezone=APP_TIMEZONE)
@@ -2284,7 +2606,8 @@ def monitor_rq_scheduler():
             f'低优先级:{queue_info["low"]["length"]}, '
             f'定时任务:{total_scheduled}')
 
-        # 核心改进：检查调度任务丢失或不一致情况
+        # 核心改进：检查调度任务丢失或不一致情况（只统计订阅推送调度，不含数据清理等其他定时任务）
+        total_scheduled = count_scheduled_subscriptions()
         active_subscription_count = Subscription.query.filter_by(is_active=True).join(User).filter_by(is_active=True).count()
 
         # 检测三种异常情况：
@@ -2317,12 +2640,16 @@ def monitor_rq_scheduler():
                 print(f"[RQ监控] 已清理过期的调度标记文件")
 
             # 触发批量调度任务（标记文件将在任务成功后由Worker创建）
+            # 上一次批量调度仍在写入时不重复排队；中断的批量调度会从上次进度继续
             from tasks import batch_schedule_all_subscriptions
-            from rq_config import enqueue_job
-            job = enqueue_job(batch_schedule_all_subscriptions, priority='high')
+            from rq_config import enqueue_job, bulk_schedule_running
+            if bulk_schedule_running():
+                print(f"[RQ监控] 批量调度正在进行，跳过本次恢复")
+            else:
+                job = enqueue_job(batch_schedule_all_subscriptions, priority='high')
 
-            log_activity('INFO', 'rq_monitor', f'自动恢复批量调度任务已排队: {job.id}')
-            print(f"[RQ监控] 自动恢复批量调度任务已排队: {job.id}")
+                log_activity('INFO', 'rq_monitor', f'自动恢复批量调度任务已排队: {job.id}')
+                print(f"[RQ监控] 自动恢复批量调度任务已排队: {job.id}")
 
         # 检查失败任务数量
         failed_jobs = get_failed_jobs()
@@ -2398,240 +2725,124 @@ def fallback_to_apscheduler():
         
 # 删除：单worker环境下不再需要心跳机制
 
-def check_and_push_articles():
-    """检查并执行推送任务"""
-    with app.app_context():  # 添加Flask应用上下文
-        try:
-            current_time = beijing_now()
-            hour = current_time.hour
-            minute = current_time.minute
-            weekday = current_time.strftime('%A').lower()
-            day_of_month = current_time.day
-            
-            # 详细日志：记录每次检查
-            app.logger.info(f"[调度器] 开始检查推送任务 - {current_time.strftime('%Y-%m-%d %H:%M:%S')} (PID: {os.getpid()})")
-            print(f"[调度器] 检查推送任务 - {current_time.strftime('%Y-%m-%d %H:%M:%S')} (PID: {os.getpid()})")
-            
-            # 获取所有活跃订阅（按订阅推送的新逻辑）
-            subscriptions = Subscription.query.filter_by(is_active=True).join(User).filter_by(is_active=True).all()
-            
-            # 统计订阅分布信息
-            frequency_counts = {}
-            user_subscription_counts = {}
-            
-            for sub in subscriptions:
-                # 统计频率分布
-                freq = sub.push_frequency or 'daily'
-                frequency_counts[freq] = frequency_counts.get(freq, 0) + 1
-                
-                # 统计用户订阅数
-                user_email = sub.user.email
-                user_subscription_counts[user_email] = user_subscription_counts.get(user_email, 0) + 1
-            
-            app.logger.info(f"[调度器] 找到 {len(subscriptions)} 个活跃订阅 (涉及 {len(user_subscription_counts)} 个用户)")
-            app.logger.info(f"[调度器] 订阅频率分布: {frequency_counts}")
-            print(f"[调度器] 找到 {len(subscriptions)} 个活跃订阅，涉及 {len(user_subscription_counts)} 个用户")
-            
-            push_count = 0
-            successful_pushes = 0
-            failed_pushes = 0
-            
-            for subscription in subscriptions:
-                # 添加调试信息
-                app.logger.info(f"[调度器调试] 检查订阅 {subscription.id} (用户: {subscription.user.email}, 关键词: {subscription.keywords}): 推送时间={subscription.push_time}, 频率={subscription.push_frequency}, 推送日={subscription.push_day}")
-                
-                if should_push_subscription_now(subscription, hour, minute, weekday, day_of_month):
-                    try:
-                        app.logger.info(f"[调度器] 开始为订阅 {subscription.id} 推送文章 (用户: {subscription.user.email}, 推送时间: {subscription.push_time}, 频率: {subscription.push_frequency})")
-                        print(f"[调度器] 开始为订阅 {subscription.id} 推送文章 (用户: {subscription.user.email})")
-                        
-                        # 按订阅推送单个订阅
-                        result = push_service.process_single_subscription(subscription.id)
-                        push_count += 1
-                        
-                        if result and result.get('success'):
-                            articles_count = result.get('articles_found', 0)
-                            successful_pushes += 1
-                            if articles_count > 0:
-                                log_activity('INFO', 'push', f'订阅推送成功: {subscription.keywords} -> {subscription.user.email}, 文章数: {articles_count}')
-                                app.logger.info(f"[调度器] 订阅 {subscription.id} 推送成功: {articles_count} 篇文章")
-                                print(f"[调度器] 订阅 {subscription.id} 推送成功: {articles_count} 篇文章")
-                            else:
-                                log_activity('INFO', 'push', f'订阅无新文章: {subscription.keywords} -> {subscription.user.email}')
-                                app.logger.info(f"[调度器] 订阅 {subscription.id} 无新文章推送")
-                                
-                        else:
-                            failed_pushes += 1
-                            error_msg = result.get('error', '未知错误') if result else '推送服务返回空结果'
-                            log_activity('ERROR', 'push', f'订阅推送失败: {subscription.keywords} -> {subscription.user.email}, 错误: {error_msg}')
-                            app.logger.error(f"[调度器] 订阅 {subscription.id} 推送失败: {error_msg}")
-                            print(f"[调度器] 订阅 {subscription.id} 推送失败: {error_msg}")
-                            
-                    except Exception as e:
-                        failed_pushes += 1
-                        log_activity('ERROR', 'push', f'订阅推送异常: {subscription.keywords} -> {subscription.user.email}, 错误: {str(e)}')
-                        app.logger.error(f"[调度器] 订阅 {subscription.id} 推送异常: {e}")
-                        print(f"[调度器] 订阅 {subscription.id} 推送异常: {e}")
-                else:
-                    # 详细日志：记录为什么不推送
-                    if subscription.push_time:
-                        app.logger.debug(f"[调度器] 订阅 {subscription.id} 时间不匹配 (设定: {subscription.push_time}, 当前: {hour:02d}:{minute:02d})")
-            
-            if push_count > 0:
-                app.logger.info(f"[调度器] 本次检查完成，处理了 {push_count} 个订阅 (成功: {successful_pushes}, 失败: {failed_pushes})")
-                print(f"[调度器] 本次检查完成，处理了 {push_count} 个订阅 (成功: {successful_pushes}, 失败: {failed_pushes})")
-                log_activity('INFO', 'scheduler', f'调度器执行完成: 总订阅数={len(subscriptions)}, 触发推送={push_count}, 成功={successful_pushes}, 失败={failed_pushes}')
-            else:
-                app.logger.debug(f"[调度器] 本次检查完成，无订阅需要推送")
-                log_activity('INFO', 'scheduler', f'调度器执行完成: 总订阅数={len(subscriptions)}, 无触发推送')
-                        
-        except Exception as e:
-            log_activity('ERROR', 'push', f'推送检查任务失败: {str(e)}')
-            app.logger.error(f"[调度器] 推送检查任务失败: {e}")
-            print(f"[调度器] 推送检查任务失败: {e}")
-
-def should_push_subscription_now(subscription, current_hour, current_minute, current_weekday, current_day):
-    """判断订阅是否应该在当前时间推送"""
-    app.logger.info(f"[调度器调试] should_push_subscription_now: 订阅={subscription.id}, 用户={subscription.user.email}, 当前时间={current_hour}:{current_minute}, 当前星期={current_weekday}")
-    
-    # 检查推送时间
-    if subscription.push_time:
-        try:
-            push_hour, push_minute = map(int, subscription.push_time.split(':'))
-            
-            # 智能时间匹配：允许补推错过的时间
-            current_total_minutes = current_hour * 60 + current_minute
-            push_total_minutes = push_hour * 60 + push_minute
-            
-            # 情况1：精确匹配（±1分钟）
-            time_match = (current_hour == push_hour and abs(current_minute - push_minute) <= 1)
-            
-            # 情况2：补推逻辑 - 当前时间已过推送时间，但在同一小时内的后续检查中补推
-            if not time_match and current_hour == push_hour and current_minute > push_minute:
-                time_match = True  # 同一小时内的补推
-                app.logger.info(f"[补推] 订阅 {subscription.id} 补推逻辑触发：设定时间 {push_hour}:{push_minute:02d}，当前时间 {current_hour}:{current_minute:02d}")
-            
-            # 情况3：跨小时补推 - 推送时间已过且在1小时内
-            elif not time_match and current_total_minutes > push_total_minutes and current_total_minutes - push_total_minutes <= 60:
-                time_match = True  # 1小时内的跨小时补推
-                app.logger.info(f"[跨小时补推] 订阅 {subscription.id} 跨小时补推：设定时间 {push_hour}:{push_minute:02d}，当前时间 {current_hour}:{current_minute:02d}")
-            
-            app.logger.info(f"[调度器调试] should_push_subscription_now: 订阅 {subscription.id} 设置时间 {push_hour}:{push_minute}, 时间匹配: {time_match}")
-            if not time_match:
-                return False
-        except:
-            app.logger.error(f"[调度器调试] should_push_subscription_now: 订阅 {subscription.id} 推送时间格式错误: {subscription.push_time}")
-            return False
-    else:
-        # 默认推送时间8:00
-        default_time_match = (current_hour == 8 and current_minute <= 1)
-        app.logger.info(f"[调度器调试] should_push_subscription_now: 订阅 {subscription.id} 使用默认时间8:00, 匹配: {default_time_match}")
-        if not default_time_match:
-            return False
-    
-    # 检查推送频率
-    if subscription.push_frequency == 'daily':
-        return should_push_subscription_daily(subscription)
-    elif subscription.push_frequency == 'weekly':
-        return should_push_subscription_weekly(subscription, current_weekday)
-    elif subscription.push_frequency == 'monthly':
-        return should_push_subscription_monthly(subscription, current_day)
-    
-    return False
-
-def should_push_subscription_daily(subscription):
-    """检查订阅是否应该每日推送"""
-    if not subscription.last_search:
-        app.logger.info(f"[调度器调试] should_push_subscription_daily: 订阅 {subscription.id} 从未搜索过，返回True")
-        return True
-    
-    # 统一时区格式进行比较（避免 offset-naive 和 offset-aware 时间混合）
-    try:
-        current_time = beijing_now()
-        last_search_time = subscription.last_search
-        
-        # 如果 last_search 没有时区信息，假设它是北京时间
-        if last_search_time.tzinfo is None:
-            last_search_time = APP_TIMEZONE.localize(last_search_time)
-        # 如果时区不同，转换为北京时间
-        elif last_search_time.tzinfo != APP_TIMEZONE:
-            last_search_time = last_search_time.astimezone(APP_TIMEZONE)
-        
-        time_since_last = current_time - last_search_time
-        should_push = time_since_last.total_seconds() > 20 * 3600  # 20小时
-        app.logger.info(f"[调度器调试] should_push_subscription_daily: 订阅 {subscription.id} 距离上次搜索 {time_since_last.total_seconds()/3600:.1f} 小时，应该推送: {should_push}")
-        return should_push
-        
-    except Exception as e:
-        app.logger.error(f"[调度器调试] should_push_subscription_daily: 订阅 {subscription.id} 时间比较异常: {e}")
-        # 异常情况下默认允许推送
-        return True
-
-def should_push_subscription_weekly(subscription, current_weekday):
-    """检查订阅是否应该每周推送"""
-    app.logger.info(f"[调度器调试] should_push_subscription_weekly: 订阅={subscription.id}, 当前星期={current_weekday}, 设置星期={subscription.push_day}, 最后搜索={subscription.last_search}")
-    
-    if not subscription.last_search:
-        app.logger.info(f"[调度器调试] should_push_subscription_weekly: 订阅 {subscription.id} 从未搜索过，返回True")
-        return True
-    
-    # 检查今天是否是设置的推送日
-    subscription_weekday = subscription.push_day or 'monday'
-    if current_weekday != subscription_weekday:
-        app.logger.info(f"[调度器调试] should_push_subscription_weekly: 订阅 {subscription.id} 今天不是推送日 ({current_weekday} != {subscription_weekday})，返回False")
-        return False
-    
-    # 统一时区格式进行比较
-    try:
-        current_time = beijing_now()
-        last_search_time = subscription.last_search
-        
-        # 如果 last_search 没有时区信息，假设它是北京时间
-        if last_search_time.tzinfo is None:
-            last_search_time = APP_TIMEZONE.localize(last_search_time)
-        # 如果时区不同，转换为北京时间
-        elif last_search_time.tzinfo != APP_TIMEZONE:
-            last_search_time = last_search_time.astimezone(APP_TIMEZONE)
-        
-        time_since_last = current_time - last_search_time
-        should_push = time_since_last.days >= 6
-        app.logger.info(f"[调度器调试] should_push_subscription_weekly: 订阅 {subscription.id} 距离上次搜索 {time_since_last.days} 天，应该推送: {should_push}")
-        return should_push
-        
-    except Exception as e:
-        app.logger.error(f"[调度器调试] should_push_subscription_weekly: 订阅 {subscription.id} 时间比较异常: {e}")
-        # 异常情况下默认允许推送
-        return True
+# 到期后超过此时间才检查到的推送（如服务停机期间错过）不再补推，直接推进到下次推送时间
+PUSH_CATCH_UP_WINDOW = timedelta(hours=1)
+
+def backfill_next_push_at(batch_size=1000):
+    """为尚未计算下次推送时间的活跃订阅（升级前创建的订阅）补充next_push_at"""
+    current_time = beijing_now()
+    filled = 0
+    last_id = 0
+    while True:
+        subscriptions = Subscription.query.filter(
+            Subscription.is_active == True,
+            Subscription.next_push_at.is_(None),
+            Subscription.id > last_id
+        ).order_by(Subscription.id).limit(batch_size).all()
+        if not subscriptions:
+            return filled
+        last_id = subscriptions[-1].id
+        rows = [
+            {'id': subscription.id, 'next_push_at': calculate_next_push_time(subscription, current_time)}
+            for subscription in subscriptions
+        ]
+        rows = [row for row in rows if row['next_push_at'] is not None]
+        if rows:
+            db.session.bulk_update_mappings(Subscription, rows)
+            db.session.commit()
+            filled += len(rows)
 
-def should_push_subscription_monthly(subscription, current_day):
-    """检查订阅是否应该每月推送"""
-    if not subscription.last_search:
-        return True
-    
-    # 检查今天是否是设置的推送日
-    subscription_day = subscription.push_month_day or 1
-    if current_day != subscription_day:
-        return False
+def check_and_push_articles():
+    """
+    检查并执行推送任务
     
-    # 统一时区格式进行比较（避免 offset-naive 和 offset-aware 时间混合）
-    try:
-        current_time = beijing_now()
-        last_search_time = subscription.last_search
-        
-        # 如果 last_search 没有时区信息，假设它是北京时间
-        if last_search_time.tzinfo is None:
-            last_search_time = APP_TIMEZONE.localize(last_search_time)
-        # 如果时区不同，转换为北京时间
-        elif last_search_time.tzinfo != APP_TIMEZONE:
-            last_search_time = last_search_time.astimezone(APP_TIMEZONE)
-        
-        time_since_last = current_time - last_search_time
-        return time_since_last.days >= 25
-        
-    except Exception as e:
-        app.logger.error(f"[调度器] 订阅 {subscription.id} 每月推送时间比较异常: {e}")
-        # 异常情况下默认允许推送
-        return True
+    只用一次索引范围查询取出 next_push_at 已到的订阅，先批量推进到下次推送时间并提交
+    （进程中断或检查重叠时不会重复推送），再逐个推送
+    """
+    with app.app_context():  # 添加Flask应用上下文
+        try:
+            current_time = beijing_now()
+            app.logger.debug(f"[调度器] 开始检查推送任务 - {current_time.strftime('%Y-%m-%d %H:%M:%S')} (PID: {os.getpid()})")
+            
+            backfilled = backfill_next_push_at()
+            if backfilled:
+                app.logger.info(f"[调度器] 为 {backfilled} 个订阅补充了下次推送时间")
+            
+            due_subscriptions = Subscription.query.filter(
+                Subscription.is_active == True,
+                Subscription.next_push_at <= current_time
+            ).order_by(Subscription.next_push_at).all()
+            
+            if not due_subscriptions:
+                app.logger.debug(f"[调度器] 本次检查完成，无订阅需要推送")
+                return
+            
+            # 批量推进下次推送时间；超出补推窗口或用户已禁用的只推进不推送
+            now_naive = current_time.replace(tzinfo=None)
+            to_push = []
+            skipped = 0
+            advances = []
+            for subscription in due_subscriptions:
+                late_by = now_naive - subscription.next_push_at.replace(tzinfo=None)
+                if late_by <= PUSH_CATCH_UP_WINDOW and subscription.user and subscription.user.is_active:
+                    to_push.append(subscription)
+                else:
+                    skipped += 1
+                advances.append({
+                    'id': subscription.id,
+                    'next_push_at': calculate_next_push_time(subscription, current_time)
+                })
+            db.session.bulk_update_mappings(Subscription, advances)
+            db.session.commit()
+            
+            app.logger.info(f"[调度器] {len(due_subscriptions)} 个订阅到期，推送 {len(to_push)} 个，"
+                            f"跳过 {skipped} 个（错过补推窗口或用户已禁用）")
+            print(f"[调度器] {len(due_subscriptions)} 个订阅到期，推送 {len(to_push)} 个")
+            
+            push_count = 0
+            successful_pushes = 0
+            failed_pushes = 0
+            
+            for subscription in to_push:
+                try:
+                    app.logger.info(f"[调度器] 开始为订阅 {subscription.id} 推送文章 (用户: {subscription.user.email}, 推送时间: {subscription.push_time}, 频率: {subscription.push_frequency})")
+                    
+                    # 按订阅推送单个订阅
+                    result = push_service.process_single_subscription(subscription.id)
+                    push_count += 1
+                    
+                    if result and result.get('success'):
+                        articles_count = result.get('articles_found', 0)
+                        successful_pushes += 1
+                        if articles_count > 0:
+                            log_activity('INFO', 'push', f'订阅推送成功: {subscription.keywords} -> {subscription.user.email}, 文章数: {articles_count}')
+                            app.logger.info(f"[调度器] 订阅 {subscription.id} 推送成功: {articles_count} 篇文章")
+                        else:
+                            log_activity('INFO', 'push', f'订阅无新文章: {subscription.keywords} -> {subscription.user.email}')
+                            app.logger.info(f"[调度器] 订阅 {subscription.id} 无新文章推送")
+                            
+                    else:
+                        failed_pushes += 1
+                        error_msg = result.get('error', '未知错误') if result else '推送服务返回空结果'
+                        log_activity('ERROR', 'push', f'订阅推送失败: {subscription.keywords} -> {subscription.user.email}, 错误: {error_msg}')
+                        app.logger.error(f"[调度器] 订阅 {subscription.id} 推送失败: {error_msg}")
+                        print(f"[调度器] 订阅 {subscription.id} 推送失败: {error_msg}")
+                        
+                except Exception as e:
+                    failed_pushes += 1
+                    log_activity('ERROR', 'push', f'订阅推送异常: {subscription.keywords} -> {subscription.user.email}, 错误: {str(e)}')
+                    app.logger.error(f"[调度器] 订阅 {subscription.id} 推送异常: {e}")
+                    print(f"[调度器] 订阅 {subscription.id} 推送异常: {e}")
+            
+            app.logger.info(f"[调度器] 本次检查完成，处理了 {push_count} 个订阅 (成功: {successful_pushes}, 失败: {failed_pushes})")
+            print(f"[调度器] 本次检查完成，处理了 {push_count} 个订阅 (成功: {successful_pushes}, 失败: {failed_pushes})")
+            log_activity('INFO', 'scheduler', f'调度器执行完成: 到期订阅数={len(due_subscriptions)}, 触发推送={push_count}, 成功={successful_pushes}, 失败={failed_pushes}')
+                        
+        except Exception as e:
+            db.session.rollback()
+            log_activity('ERROR', 'push', f'推送检查任务失败: {str(e)}')
+            app.logger.error(f"[调度器] 推送检查任务失败: {e}")
+            print(f"[调度器] 推送检查任务失败: {e}")
 
 def should_push_now(user, current_hour, current_minute, current_weekday, current_day):
     """判断用户是否应该在当前时间推送"""
@@ -2774,6 +2985,12 @@ def load_user(user_id):
 
 # AI服务模块
 class AIService:
+    # AI检索式共享缓存（Redis，按生成输入摘要）
+    QUERY_CACHE_PREFIX = "pubmed:ai_query"
+    QUERY_CACHE_TTL = 7 * 24 * 3600  # 7天
+
+    QUERY_SYSTEM_PROMPT = "你是一个专业的医学文献检索专家。请确保生成完整的PubMed检索式，必须以完整的括号结尾。"
+
     def __init__(self):
         self.default_query_prompt = """# 任务：构建专业级PubMed文献检索式
 
@@ -2955,58 +3172,171 @@ class AIService:
     def build_pubmed_query(self, keywords):
         """使用AI生成PubMed检索式"""
         try:
-            # 检查是否启用AI检索式生成
-            if SystemSetting.get_setting('ai_query_builder_enabled', 'false') != 'true':
-                return keywords  # 未启用，返回原始关键词
+            signature = self.get_query_builder_signature()
+            if not signature:
+                return keywords  # 未启用或未配置，返回原始关键词
             
-            # 获取配置的模型
-            model = self.get_configured_model('query_builder')
-            if not model:
-                app.logger.warning("未找到或未配置检索式构建模型")
-                return keywords
-            
-            # 获取提供商
-            provider = model.provider
-            if not provider or not provider.is_active:
-                app.logger.warning("提供商未激活")
-                return keywords
+            query = self._generate_pubmed_query(keywords, signature)
+            return query or keywords
             
-            client = self.create_openai_client(provider)
-            if not client:
+        except Exception as e:
+            app.logger.error(f"AI检索式生成失败: {str(e)}")
+            return keywords  # 失败时返回原始关键词
+    
+    def get_pubmed_query(self, keywords, subscription=None):
+        """
+        获取AI检索式（优先复用已生成的结果）
+        
+        1. 订阅已保存的检索式，且关键词、提示词模板、模型均未变化时直接使用
+        2. Redis共享缓存（按标准化关键词+提示词模板+模型），交互搜索与各订阅共用
+        3. 都没有时调用AI生成，写入共享缓存，并保存到订阅上
+        
+        Args:
+            keywords: 原始关键词
+            subscription: 订阅对象，可选
+        
+        Returns:
+            str: AI检索式，未启用或生成失败时返回原始关键词
+        """
+        try:
+            signature = self.get_query_builder_signature()
+            if not signature:
                 return keywords
             
-            # 获取提示词模板
-            prompt_template = AIPromptTemplate.get_default_prompt('query_builder')
-            if not prompt_template:
-                prompt_template = self.default_query_prompt
-            
-            # 构建完整提示词
-            full_prompt = prompt_template.format(keywords=keywords)
-            
-            # 调用AI API
-            response = client.chat.completions.create(
-                model=model.model_id,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的医学文献检索专家。请确保生成完整的PubMed检索式，必须以完整的括号结尾。"},
-                    {"role": "user", "content": full_prompt}
-                ],
-                temperature=0.1  # 降低随机性，保证结果一致性
-            )
-            
-            # 提取检索式
-            query = response.choices[0].message.content.strip()
+            input_hash = self._query_input_hash(keywords, signature)
+            if subscription is not None and subscription.ai_query and subscription.ai_query_hash == input_hash:
+                app.logger.info(f"使用订阅保存的AI检索式: {keywords} -> {subscription.ai_query[:50]}...")
+                return subscription.ai_query
             
-            # 简单验证：如果包含明显解释性文字，返回原始关键词
-            if '解释' in query or '说明' in query:
-                app.logger.warning("AI返回的检索式格式不正确，使用原始关键词")
-                return keywords
+            query = self._get_shared_query(input_hash)
+            if query:
+                app.logger.info(f"使用缓存的AI检索式: {keywords} -> {query[:50]}...")
+            else:
+                query = self._generate_pubmed_query(keywords, signature)
+                if not query:
+                    return keywords
+                self._set_shared_query(input_hash, query)
             
-            app.logger.info(f"AI生成检索式成功: {keywords} -> {query}")
+            if subscription is not None:
+                self._save_subscription_query(subscription, query, input_hash, signature)
             return query
             
         except Exception as e:
-            app.logger.error(f"AI检索式生成失败: {str(e)}")
-            return keywords  # 失败时返回原始关键词
+            app.logger.error(f"获取AI检索式失败: {str(e)}")
+            return keywords
+    
+    def get_query_builder_signature(self):
+        """
+        获取当前检索式生成配置（决定已生成的检索式能否复用）
+        
+        Returns:
+            dict: {'model', 'model_key', 'prompt_template', 'prompt_version'}，未启用或未配置时返回None
+        """
+        # 检查是否启用AI检索式生成
+        if SystemSetting.get_setting('ai_query_builder_enabled', 'false') != 'true':
+            return None
+        
+        # 获取配置的模型
+        model = self.get_configured_model('query_builder')
+        if not model:
+            app.logger.warning("未找到或未配置检索式构建模型")
+            return None
+        
+        # 获取提供商
+        provider = model.provider
+        if not provider or not provider.is_active:
+            app.logger.warning("提供商未激活")
+            return None
+        
+        # 获取提示词模板
+        prompt_template = AIPromptTemplate.get_default_prompt('query_builder')
+        if not prompt_template:
+            prompt_template = self.default_query_prompt
+        
+        import hashlib
+        prompt_version = hashlib.sha256(
+            f"{self.QUERY_SYSTEM_PROMPT}\n{prompt_template}".encode('utf-8')
+        ).hexdigest()[:16]
+        
+        return {
+            'model': model,
+            'model_key': f"{provider.id}:{model.model_id}",
+            'prompt_template': prompt_template,
+            'prompt_version': prompt_version
+        }
+    
+    def _generate_pubmed_query(self, keywords, signature):
+        """调用AI生成检索式，失败或格式不正确时返回None"""
+        model = signature['model']
+        client = self.create_openai_client(model.provider)
+        if not client:
+            return None
+        
+        # 构建完整提示词
+        full_prompt = signature['prompt_template'].format(keywords=keywords)
+        
+        # 调用AI API
+        response = client.chat.completions.create(
+            model=model.model_id,
+            messages=[
+                {"role": "system", "content": self.QUERY_SYSTEM_PROMPT},
+                {"role": "user", "content": full_prompt}
+            ],
+            temperature=0.1  # 降低随机性，保证结果一致性
+        )
+        
+        # 提取检索式
+        query = response.choices[0].message.content.strip()
+        
+        # 简单验证：如果包含明显解释性文字，返回原始关键词
+        if '解释' in query or '说明' in query:
+            app.logger.warning("AI返回的检索式格式不正确，使用原始关键词")
+            return None
+        
+        if not query or query == keywords:
+            return None
+        
+        app.logger.info(f"AI生成检索式成功: {keywords} -> {query}")
+        return query
+    
+    @staticmethod
+    def _query_input_hash(keywords, signature):
+        """检索式生成输入摘要: 标准化关键词 + 提示词模板版本 + 模型"""
+        import hashlib
+        normalized = ' '.join(keywords.lower().split())
+        return hashlib.sha256(
+            f"{signature['model_key']}\n{signature['prompt_version']}\n{normalized}".encode('utf-8')
+        ).hexdigest()
+    
+    def _get_shared_query(self, input_hash):
+        """从Redis共享缓存读取检索式"""
+        try:
+            from rq_config import cache_redis_conn
+            value = cache_redis_conn.get(f"{self.QUERY_CACHE_PREFIX}:{input_hash}")
+            return value.decode('utf-8') if isinstance(value, bytes) else value
+        except Exception as e:
+            app.logger.warning(f"读取AI检索式缓存失败: {e}")
+            return None
+    
+    def _set_shared_query(self, input_hash, query):
+        """写入Redis共享缓存"""
+        try:
+            from rq_config import cache_redis_conn
+            cache_redis_conn.set(f"{self.QUERY_CACHE_PREFIX}:{input_hash}", query, ex=self.QUERY_CACHE_TTL)
+        except Exception as e:
+            app.logger.warning(f"写入AI检索式缓存失败: {e}")
+    
+    def _save_subscription_query(self, subscription, query, input_hash, signature):
+        """将检索式及其生成输入保存到订阅
+
+        只修改会话中的对象，由调用方随自己的事务提交（推送流程每个订阅一个事务）
+        """
+        subscription.ai_query = query
+        subscription.ai_query_hash = input_hash
+        subscription.ai_query_prompt_version = signature['prompt_version']
+        subscription.ai_query_model = signature['model_key']
+        subscription.ai_query_generated_at = beijing_now()
+        db.session.add(subscription)
     
     def translate_abstract(self, abstract):
         """翻译英文摘要为中文"""
@@ -3207,8 +3537,10 @@ class AIService:
             batch_delay = int(SystemSetting.get_setting('ai_translation_batch_delay', '3'))
             
             # 筛选出有摘要的文章
+            # 同一文章在分组推送中可能已被前一个订阅翻译过
             articles_with_abstract = [article for article in articles 
-                                    if hasattr(article, 'abstract') and article.abstract]
+                                    if hasattr(article, 'abstract') and article.abstract
+                                    and not getattr(article, 'abstract_cn', None)]
             
             if not articles_with_abstract:
                 app.logger.info("没有需要翻译的摘要")
@@ -3222,10 +3554,12 @@ class AIService:
                 # 使用真正的批量翻译
                 translations = self.translate_abstracts_batch(batch)
                 
-                # 将翻译结果分配给对应文章
+                # 将翻译结果分配给对应文章，并保存到abstract_cn供后续推送阶段和同组订阅复用
                 for j, article in enumerate(batch):
                     if j < len(translations) and translations[j]:
                         article.abstract_translation = translations[j]
+                        article.abstract_cn = translations[j]
+                db.session.commit()
                 
                 # 非最后一批时等待
                 if i + batch_size < len(articles_with_abstract):
@@ -4663,7 +4997,7 @@ class PubMedAPI:
         
         return quality_info
     
-    def search_articles(self, keywords, max_results=20, days_back=30, user_email=None):
+    def search_articles(self, keywords, max_results=20, days_back=30, user_email=None, subscription=None):
         """
         搜索PubMed文章
         
@@ -4672,42 +5006,15 @@ class PubMedAPI:
             max_results: 最大结果数
             days_back: 搜索过去N天的文章（固定30天）
             user_email: 用户邮箱（用于PubMed API请求标识）
+            subscription: 订阅对象（复用其保存的AI检索式），可选
         
         Returns:
             list: PMID列表
         """
-        # 首先使用AI优化关键词
+        # 首先使用AI优化关键词（复用订阅保存的或共享缓存中的检索式，避免重复调用AI）
         original_keywords = keywords
         if isinstance(keywords, str):
-            # AI查询构建器防重复调用机制
-            import time
-            current_time = time.time()
-            ai_cache_key = f'ai_query_{keywords}'
-            
-            # 检查缓存中是否有最近的结果
-            if hasattr(self, '_ai_query_cache'):
-                cache_data = self._ai_query_cache.get(ai_cache_key)
-                if cache_data and current_time - cache_data['timestamp'] < 300:  # 300秒内复用结果
-                    app.logger.info(f"使用缓存的AI检索式: {keywords} -> {cache_data['query'][:50]}...")
-                    optimized_keywords = cache_data['query']
-                else:
-                    # 缓存过期，重新生成
-                    optimized_keywords = ai_service.build_pubmed_query(keywords)
-                    if not hasattr(self, '_ai_query_cache'):
-                        self._ai_query_cache = {}
-                    self._ai_query_cache[ai_cache_key] = {
-                        'query': optimized_keywords,
-                        'timestamp': current_time
-                    }
-            else:
-                # 首次调用，初始化缓存
-                optimized_keywords = ai_service.build_pubmed_query(keywords)
-                self._ai_query_cache = {
-                    ai_cache_key: {
-                        'query': optimized_keywords,
-                        'timestamp': current_time
-                    }
-                }
+            optimized_keywords = ai_service.get_pubmed_query(keywords, subscription=subscription)
             # 如果AI优化成功（返回的不是原始关键词），直接使用优化后的完整检索式
             if optimized_keywords != keywords and optimized_keywords.strip():
                 # AI返回的是完整的检索式，但需要添加日期限制和文章类型过滤
@@ -4866,7 +5173,7 @@ class PubMedAPI:
     
     def _parse_issn_only_xml(self, xml_content):
         """
-        解析XML，只提取PMID和ISSN信息
+        解析XML，只提取PMID、ISSN和发表日期信息
         """
         try:
             root = ET.fromstring(xml_content)
@@ -4896,7 +5203,8 @@ class PubMedAPI:
                     articles.append({
                         'pmid': pmid,
                         'issn': issn,
-                        'eissn': eissn
+                        'eissn': eissn,
+                        'publish_date': self._extract_publication_date(article)
                     })
             
             return articles
@@ -5170,7 +5478,8 @@ class PubMedAPI:
         return articles
     
     def search_and_fetch_with_filter(self, keywords, max_results=20, days_back=30,
-                                   jcr_filter=None, zky_filter=None, exclude_no_issn=True, user_email=None):
+                                   jcr_filter=None, zky_filter=None, exclude_no_issn=True, user_email=None,
+                                   subscription=None):
         """
         搜索并获取文章详细信息，支持期刊质量筛选
 
@@ -5187,37 +5496,27 @@ class PubMedAPI:
             zky_filter: 中科院筛选条件，如 {'category': ['1', '2'], 'top': True}
             exclude_no_issn: 是否排除没有ISSN的文献
             user_email: 用户邮箱，用于PubMed API请求标识
+            subscription: 订阅对象（复用其保存的AI检索式），可选
 
         Returns:
             dict: 包含筛选前后数量和文章列表的字典
         """
-        # 构建筛选参数字典(用于缓存键生成)
-        filter_params = {
+        # 缓存按"关键词+天数+检索深度"保存未筛选的结果,期刊质量筛选在本地完成
+        search_depth = max_results * 2
+        cache_params = {
             'days_back': days_back,
-            'max_results': max_results,
-            'jcr_filter': jcr_filter,
-            'zky_filter': zky_filter,
-            'exclude_no_issn': exclude_no_issn
+            'max_results': search_depth
         }
 
-        # 尝试从缓存获取
-        cached_data = search_cache_service.get_cached_results(keywords, filter_params)
+        # 尝试从缓存获取(精确命中或由更宽窗口/更大深度的缓存覆盖)
+        cached_data = search_cache_service.get_cached_results(keywords, cache_params, require='articles')
 
         if cached_data:
-            # 缓存命中
-            pmids = cached_data.get('pmids', [])
-            articles = cached_data.get('articles', [])
-
-            # 如果是宽松匹配,需要二次筛选
-            if cached_data.get('requires_filtering', False):
-                app.logger.info(f"[缓存-宽松匹配] 对 {len(articles)} 篇文章进行二次筛选")
-                filtered_articles = self._apply_filters(
-                    articles, jcr_filter, zky_filter, exclude_no_issn, max_results
-                )
-            else:
-                # 精确匹配,直接使用缓存结果
-                app.logger.info(f"[缓存-精确匹配] 直接使用 {len(articles)} 篇缓存文章")
-                filtered_articles = articles[:max_results]
+            articles = cached_data.get('articles') or []
+            app.logger.info(f"[缓存命中] 对 {len(articles)} 篇缓存文章进行本地筛选")
+            filtered_articles = self._apply_filters(
+                articles, jcr_filter, zky_filter, exclude_no_issn, max_results
+            )
 
             excluded_no_issn = len(articles) - len(filtered_articles)
 
@@ -5232,10 +5531,17 @@ class PubMedAPI:
         # 缓存未命中,执行真实搜索
         app.logger.info(f"[缓存未命中] 调用PubMed API搜索: {keywords[:50]}")
 
-        # 第一步：搜索获取PMID
-        pmids = self.search_articles(keywords, max_results * 2, days_back, user_email)
+        # 第一步：搜索获取PMID（交互式统计已缓存同一主题的PMID列表时直接复用）
+        cached_pmids = search_cache_service.get_cached_results(
+            keywords, cache_params, require='pmids', record_stats=False
+        )
+        if cached_pmids:
+            pmids = cached_pmids['pmids']
+        else:
+            pmids = self.search_articles(keywords, search_depth, days_back, user_email, subscription=subscription)
 
         if not pmids:
+            search_cache_service.set_cached_results(keywords, cache_params, [], articles=[])
             return {
                 'total_found': 0,
                 'articles': [],
@@ -5258,9 +5564,9 @@ class PubMedAPI:
         try:
             search_cache_service.set_cached_results(
                 keywords=keywords,
-                filter_params=filter_params,
+                filter_params=cache_params,
                 pmids=pmids,
-                articles=articles  # 缓存完整结果供后续宽松匹配使用
+                articles=articles  # 缓存完整结果,不同筛选条件的订阅均可复用
             )
             app.logger.info(f"[缓存写入] 已缓存 {len(articles)} 篇文章")
         except Exception as e:
@@ -5274,11 +5580,52 @@ class PubMedAPI:
             'from_cache': False  # 标记来自API
         }
 
+    def _fetch_issn_map(self, pmids):
+        """
+        获取PMID→[ISSN, eISSN, 发表日期]映射（轻量级efetch，供缓存和本地筛选使用）
+        """
+        issn_map = {}
+        for article in self.get_article_issn_only(pmids):
+            publish_date = article.get('publish_date')
+            issn_map[article['pmid']] = [
+                article.get('issn', ''),
+                article.get('eissn', ''),
+                publish_date.date().isoformat() if publish_date else ''
+            ]
+        return issn_map
+
+    def refresh_search_cache(self, keywords, days_back, max_results, level='articles'):
+        """
+        后台刷新过期的搜索缓存条目（由低优先级RQ任务调用）
+
+        Args:
+            keywords: 关键词
+            days_back: 搜索天数
+            max_results: 检索深度
+            level: 需要刷新的数据层级 'pmids' | 'issn' | 'articles'
+
+        Returns:
+            int: 刷新后的PMID数量
+        """
+        cache_params = {'days_back': days_back, 'max_results': max_results}
+        pmids = self.search_articles(keywords, max_results, days_back)
+
+        if level == 'articles':
+            articles = self.get_article_details(pmids) if pmids else []
+            search_cache_service.set_cached_results(keywords, cache_params, pmids, articles=articles)
+        elif level == 'issn':
+            issn_map = self._fetch_issn_map(pmids) if pmids else {}
+            search_cache_service.set_cached_results(keywords, cache_params, pmids, issn_map=issn_map)
+        else:
+            search_cache_service.set_cached_results(keywords, cache_params, pmids)
+
+        return len(pmids)
+
     def _apply_filters(self, articles, jcr_filter, zky_filter, exclude_no_issn, max_results):
         """
         应用筛选条件到文章列表
 
-        提取为独立方法供缓存宽松匹配时复用
+        提取为独立方法供缓存命中时在本地筛选复用
 
         Args:
             articles: 文章列表
@@ -5361,11 +5708,41 @@ class PubMedAPI:
 
         Returns:
             dict: 包含筛选前后数量统计的字典
+
+        集成缓存优化:
+        - PMID列表和PMID→[ISSN, eISSN, 发表日期]映射与推送路径共享同一缓存
+        - 命中时在本地应用期刊质量筛选，无需再调用esearch/efetch
         """
-        # 第一步：搜索获取PMID
-        pmids = self.search_articles(keywords, max_results, days_back, user_email)
+        # 检查是否有实际的筛选条件
+        has_quality_filter = bool(jcr_filter or zky_filter)
+        has_issn_filter = exclude_no_issn
+        need_issn = has_quality_filter or has_issn_filter
+
+        cache_params = {
+            'days_back': days_back,
+            'max_results': max_results
+        }
+
+        # 第一步：搜索获取PMID（优先使用缓存，需要筛选时要求缓存含ISSN信息）
+        cached_data = search_cache_service.get_cached_results(
+            keywords, cache_params, require='issn' if need_issn else 'pmids'
+        )
+        if cached_data is None and need_issn:
+            # 只缓存了PMID列表时仍可省去esearch
+            cached_data = search_cache_service.get_cached_results(
+                keywords, cache_params, require='pmids', record_stats=False
+            )
+
+        if cached_data:
+            pmids = cached_data['pmids']
+            issn_map = cached_data.get('issn_map') or {}
+        else:
+            pmids = self.search_articles(keywords, max_results, days_back, user_email)
+            issn_map = {}
         
         if not pmids:
+            if not cached_data:
+                search_cache_service.set_cached_results(keywords, cache_params, [], issn_map={})
             return {
                 'total_found': 0,
                 'filtered_count': 0,
@@ -5373,12 +5750,10 @@ class PubMedAPI:
                 'max_searched': max_results
             }
         
-        # 检查是否有实际的筛选条件
-        has_quality_filter = bool(jcr_filter or zky_filter)
-        has_issn_filter = exclude_no_issn
-        
         # 如果没有任何筛选条件，直接返回搜索结果统计
-        if not has_quality_filter and not has_issn_filter:
+        if not need_issn:
+            if not cached_data:
+                search_cache_service.set_cached_results(keywords, cache_params, pmids)
             return {
                 'total_found': len(pmids),
                 'filtered_count': len(pmids),  # 无筛选时等同于总数
@@ -5387,8 +5762,16 @@ class PubMedAPI:
                 'no_filter_applied': True      # 标记无筛选条件
             }
         
-        # 第二步：只获取ISSN信息用于筛选（轻量级）
-        articles = self.get_article_issn_only(pmids)
+        # 第二步：只获取ISSN信息用于筛选（轻量级，仅补齐缓存中缺失的PMID）
+        missing_pmids = [pmid for pmid in pmids if pmid not in issn_map]
+        if missing_pmids:
+            issn_map.update(self._fetch_issn_map(missing_pmids))
+            search_cache_service.set_cached_results(keywords, cache_params, pmids, issn_map=issn_map)
+        
+        articles = [
+            {'pmid': pmid, 'issn': issn_map[pmid][0], 'eissn': issn_map[pmid][1]}
+            for pmid in pmids if pmid in issn_map
+        ]
         
         # 第三步：应用筛选条件并统计
         filtered_count = 0
@@ -6699,6 +7082,10 @@ def subscribe():
         db.session.add(subscription)
         db.session.commit()
         
+        # 生成并保存AI检索式，推送时直接复用
+        ai_service.get_pubmed_query(keywords, subscription=subscription)
+        db.session.commit()
+        
         log_activity('INFO', 'subscription', f'用户 {current_user.email} 订阅关键词: {keywords}', current_user.id, request.remote_addr)
         flash(f'成功订阅关键词: {keywords}', 'success')
         
@@ -7177,6 +7564,10 @@ def subscribe_keyword():
         except Exception as e:
             app.logger.warning(f"为订阅 {subscription.id} 创建RQ调度任务失败: {e}")
 
+        # 生成并保存AI检索式，推送时直接复用
+        ai_service.get_pubmed_query(keywords, subscription=subscription)
+        db.session.commit()
+
         log_activity('INFO', 'subscription', f'用户 {current_user.email} 订阅关键词: {keywords}', current_user.id, request.remote_addr)
         flash(f'成功订阅关键词: {keywords}', 'success')
 
@@ -9610,7 +10001,12 @@ def admin_copy_subscription(sub_id):
                         push_frequency=original_sub.push_frequency,
                         push_time=original_sub.push_time,
                         push_day=original_sub.push_day,
-                        push_month_day=original_sub.push_month_day
+                        push_month_day=original_sub.push_month_day,
+                        ai_query=original_sub.ai_query,
+                        ai_query_hash=original_sub.ai_query_hash,
+                        ai_query_prompt_version=original_sub.ai_query_prompt_version,
+                        ai_query_model=original_sub.ai_query_model,
+                        ai_query_generated_at=original_sub.ai_query_generated_at
                     )
                     db.session.add(new_sub)
                     db.session.flush()
@@ -10952,6 +11348,8 @@ def admin_system():
                 SystemSetting.set_setting('push_max_articles', request.form.get('push_max_articles', '50'), '每次推送最大文章数', 'push')
                 SystemSetting.set_setting('push_check_frequency', request.form.get('push_check_frequency', '0.0833'), 'RQ调度器扫描间隔(小时)', 'push')
                 SystemSetting.set_setting('push_enabled', request.form.get('push_enabled', 'true'), '启用自动推送', 'push')
+                SystemSetting.set_setting('push_digest_enabled', request.form.get('push_digest_enabled', 'false'), '合并同一用户的订阅推送', 'push')
+                SystemSetting.set_setting('push_digest_window', request.form.get('push_digest_window', '30'), '推送合并窗口(分钟)', 'push')
 
                 # 记录配置变更
                 new_freq = request.form.get('push_check_frequency', '0.0833')
@@ -10965,6 +11363,7 @@ def admin_system():
             elif 'system_config' in request.form:
                 SystemSetting.set_setting('system_name', request.form.get('system_name', 'PubMed Literature Push'), '系统名称', 'system')
                 SystemSetting.set_setting('log_retention_days', request.form.get('log_retention_days', '30'), '日志保留天数', 'system')
+                SystemSetting.set_setting('article_retention_days', request.form.get('article_retention_days', '180'), '推送记录保留天数', 'system')
                 SystemSetting.set_setting('max_articles_limit', request.form.get('max_articles_limit', '1000'), '文章数量上限', 'system')
                 SystemSetting.set_setting('cleanup_articles_count', request.form.get('cleanup_articles_count', '100'), '单次清理文章数量', 'system')
                 SystemSetting.set_setting('user_registration_enabled', request.form.get('user_registration_enabled', 'true'), '允许用户注册', 'system')
@@ -10991,10 +11390,13 @@ def admin_system():
         'push_max_articles': SystemSetting.get_setting('push_max_articles', '50'),
         'push_check_frequency': SystemSetting.get_setting('push_check_frequency', '1'),
         'push_enabled': SystemSetting.get_setting('push_enabled', 'true'),
+        'push_digest_enabled': SystemSetting.get_setting('push_digest_enabled', 'false'),
+        'push_digest_window': SystemSetting.get_setting('push_digest_window', '30'),
 
         # 系统配置
         'system_name': SystemSetting.get_setting('system_name', 'PubMed Literature Push'),
         'log_retention_days': SystemSetting.get_setting('log_retention_days', '30'),
+        'article_retention_days': SystemSetting.get_setting('article_retention_days', '180'),
         'max_articles_limit': SystemSetting.get_setting('max_articles_limit', '1000'),
         'cleanup_articles_count': SystemSetting.get_setting('cleanup_articles_count', '100'),
         'user_registration_enabled': SystemSetting.get_setting('user_registration_enabled', 'true'),
@@ -11142,6 +11544,22 @@ def admin_system():
                                     </div>
                                     <div class="form-text">关闭后将停止所有自动推送</div>
                                 </div>
+                                <div class="mb-3">
+                                    <div class="form-check">
+                                        <input class="form-check-input" type="checkbox" name="push_digest_enabled" value="true"
+                                               {{ 'checked' if settings.push_digest_enabled == 'true' else '' }}>
+                                        <label class="form-check-label">
+                                            合并同一用户的订阅推送
+                                        </label>
+                                    </div>
+                                    <div class="form-text">同一用户在合并窗口内到期的多个订阅只发送一封邮件，按关键词分节</div>
+                                </div>
+                                <div class="mb-3">
+                                    <label class="form-label">推送合并窗口（分钟）</label>
+                                    <input type="number" class="form-control" name="push_digest_window" 
+                                           value="{{ settings.push_digest_window }}" min="1" max="720" required>
+                                    <div class="form-text">第一个订阅到期后，等待窗口内到期的其他订阅一起发送；全部完成检索后立即发送</div>
+                                </div>
                                 <button type="submit" class="btn btn-primary">
                                     <i class="fas fa-save"></i> 保存推送配置
                                 </button>
@@ -11168,19 +11586,25 @@ def admin_system():
                                     <label class="form-label">日志保留天数</label>
                                     <input type="number" class="form-control" name="log_retention_days" 
                                            value="{{ settings.log_retention_days }}" min="1" max="365" required>
-                                    <div class="form-text">超过此天数的日志将被自动清理</div>
+                                    <div class="form-text">超过此天数的日志将被每日清理任务删除</div>
+                                </div>
+                                <div class="mb-3">
+                                    <label class="form-label">推送记录保留天数</label>
+                                    <input type="number" class="form-control" name="article_retention_days" 
+                                           value="{{ settings.article_retention_days }}" min="30" max="3650" required>
+                                    <div class="form-text">超过此天数的推送记录及不再被引用的文章将被清理（不短于订阅的最大检索天数）</div>
                                 </div>
                                 <div class="mb-3">
                                     <label class="form-label">文章存储上限</label>
                                     <input type="number" class="form-control" name="max_articles_limit" 
                                            value="{{ settings.max_articles_limit }}" min="100" max="10000" required>
-                                    <div class="form-text">超过此数量时自动清理最早的文章，建议1000-5000篇</div>
+                                    <div class="form-text">超过此数量时清理最早的未被推送记录引用的文章，建议1000-5000篇</div>
                                 </div>
                                 <div class="mb-3">
                                     <label class="form-label">单次清理数量</label>
                                     <input type="number" class="form-control" name="cleanup_articles_count" 
                                            value="{{ settings.cleanup_articles_count }}" min="10" max="500" required>
-                                    <div class="form-text">每次自动清理时删除的最早文章数量，建议50-200篇</div>
+                                    <div class="form-text">清理任务每批删除的行数，每批单独提交，建议50-200</div>
                                 </div>
                                 <div class="mb-3">
                                     <div class="form-check">
@@ -11412,10 +11836,8 @@ def clear_all_push_records():
         # 记录操作日志
         log_activity('INFO', 'admin', f'管理员 {current_user.email} 开始清除所有推送记录', current_user.id, request.remote_addr)
         
-        # 删除所有UserArticle记录
-        deleted_count = UserArticle.query.count()
-        UserArticle.query.delete()
-        db.session.commit()
+        # 分批删除所有UserArticle记录，避免长事务锁库
+        deleted_count = data_retention_service.purge_push_records()
         
         log_activity('INFO', 'admin', f'成功清除 {deleted_count} 条推送记录', current_user.id, request.remote_addr)
         flash(f'成功清除所有推送记录（共 {deleted_count} 条）', 'admin')
@@ -11446,10 +11868,8 @@ def clear_user_push_records():
         # 记录操作日志
         log_activity('INFO', 'admin', f'管理员 {current_user.email} 开始清除用户 {email} 的推送记录', current_user.id, request.remote_addr)
         
-        # 删除该用户的所有UserArticle记录
-        deleted_count = UserArticle.query.filter_by(user_id=user.id).count()
-        UserArticle.query.filter_by(user_id=user.id).delete()
-        db.session.commit()
+        # 分批删除该用户的所有UserArticle记录
+        deleted_count = data_retention_service.purge_push_records(user_id=user.id)
         
         log_activity('INFO', 'admin', f'成功清除用户 {email} 的 {deleted_count} 条推送记录', current_user.id, request.remote_addr)
         flash(f'成功清除用户 {email} 的推送记录（共 {deleted_count} 条）', 'admin')
@@ -11469,17 +11889,8 @@ def clear_all_articles():
         # 记录操作日志
         log_activity('INFO', 'admin', f'管理员 {current_user.email} 开始清理所有文章数据', current_user.id, request.remote_addr)
         
-        # 统计删除前的数据
-        article_count = Article.query.count()
-        user_article_count = UserArticle.query.count()
-        
-        # 先删除UserArticle表（外键关联）
-        UserArticle.query.delete()
-        
-        # 再删除Article表
-        Article.query.delete()
-        
-        db.session.commit()
+        # 分批删除: 先删除UserArticle表（外键关联），再删除Article表
+        article_count, user_article_count = data_retention_service.purge_articles()
         
         log_activity('INFO', 'admin', 
                    f'成功清理所有文章数据: {article_count}篇文章, {user_article_count}条推送记录', 
@@ -11694,6 +12105,11 @@ def admin_rq_cleanup_orphaned():
                     except Exception as e:
                         app.logger.warning(f"处理任务 {job_id} 失败: {e}")
 
+        # 有序集合调度中的遗留订阅
+        from push_scheduler import push_scheduler, PUSH_SCHEDULER_BACKEND
+        if PUSH_SCHEDULER_BACKEND == 'zset':
+            removed_count += push_scheduler.prune(valid_subscription_ids)
+
         log_activity('INFO', 'admin', f'已清理 {removed_count} 个遗留任务', current_user.id, request.remote_addr)
         flash(f'成功清理 {removed_count} 个已删除订阅的遗留任务', 'success')
 
@@ -11715,7 +12131,14 @@ def admin_rq_status():
             'status': 'success',
             'queue_info': queue_info,
             'failed_jobs_count': len(failed_jobs),
-            'failed_jobs': failed_jobs[:10]  # 只返回前10个失败任务
+            'failed_jobs': failed_jobs[:10],  # 只返回前10个失败任务
+            'push_waves': push_service.get_push_wave_stats(),  # 各推送波次节省的PubMed搜索次数
+            'push_stages': push_pipeline.get_stage_stats(),  # 分阶段推送最近1小时的吞吐量
+            'data_retention': data_retention_service.get_progress(),  # 最近一次数据保留清理的进度
+            'system_log_writer': system_log_writer.get_stats(),  # 日志缓冲队列长度、已写入和丢弃数量
+            'email_fragments': push_email_renderer.get_stats(),  # 邮件文章卡片片段缓存命中率
+            'smtp_pool': smtp_pool.get_stats(),  # SMTP连接复用情况
+            'push_digest': push_digest.get_stats()  # 每天合并发送的摘要邮件数和少发的邮件数
         })
         
     except Exception as e:
@@ -11832,6 +12255,8 @@ def admin_cache():
                             <div class="stat-card p-3">
                                 <div class="metric-value text-info" id="cache-count">-</div>
                                 <div class="metric-label">当前缓存数</div>
+                                <small class="text-muted">文章记录: <span id="article-count">-</span></small>
+                                <small class="text-muted d-block">磁盘层: <span id="disk-usage">-</span></small>
                             </div>
                         </div>
                     </div>
@@ -11849,7 +12274,7 @@ def admin_cache():
                             <p><strong>精确匹配命中:</strong> <span id="exact-hits" class="text-success">-</span></p>
                         </div>
                         <div class="col-md-4">
-                            <p><strong>宽松匹配命中:</strong> <span id="relaxed-hits" class="text-info">-</span></p>
+                            <p><strong>包含匹配命中:</strong> <span id="subsumption-hits" class="text-info">-</span></p>
                         </div>
                         <div class="col-md-4">
                             <p><strong>缓存未命中:</strong> <span id="total-misses" class="text-danger">-</span></p>
@@ -11857,9 +12282,64 @@ def admin_cache():
                     </div>
                     <div class="progress" style="height: 30px;">
                         <div id="exact-bar" class="progress-bar bg-success" role="progressbar" style="width: 0%">精确</div>
-                        <div id="relaxed-bar" class="progress-bar bg-info" role="progressbar" style="width: 0%">宽松</div>
+                        <div id="subsumption-bar" class="progress-bar bg-info" role="progressbar" style="width: 0%">包含</div>
                         <div id="miss-bar" class="progress-bar bg-danger" role="progressbar" style="width: 0%">未命中</div>
                     </div>
+                    <p class="text-muted small mt-2 mb-0">
+                        过期命中(返回旧结果并后台刷新): <span id="stale-hits">-</span>,
+                        已提交后台刷新: <span id="refreshes-scheduled">-</span>
+                    </p>
+                    <p class="text-muted small mb-0">
+                        L0进程内命中率: <span id="l0-hit-rate">-</span>,
+                        L1 Redis命中率(L0未命中部分): <span id="l1-hit-rate">-</span>,
+                        本进程L0: <span id="l0-usage">-</span>
+                    </p>
+                </div>
+            </div>
+
+            <!-- 延迟分布与热门检索词 -->
+            <div class="card mb-4">
+                <div class="card-header">
+                    <h5><i class="fas fa-stopwatch"></i> 延迟分布与热门检索词</h5>
+                </div>
+                <div class="card-body">
+                    <div class="row">
+                        <div class="col-md-6">
+                            <table class="table table-sm">
+                                <thead>
+                                    <tr><th>延迟(≤ms)</th><th>查询次数</th><th>写入次数</th></tr>
+                                </thead>
+                                <tbody id="latency-table"></tbody>
+                            </table>
+                        </div>
+                        <div class="col-md-6">
+                            <table class="table table-sm">
+                                <thead>
+                                    <tr><th>检索词</th><th>读取次数</th></tr>
+                                </thead>
+                                <tbody id="hot-keys-table"></tbody>
+                            </table>
+                        </div>
+                    </div>
+                </div>
+            </div>
+
+            <!-- 内存占用 -->
+            <div class="card mb-4">
+                <div class="card-header d-flex justify-content-between align-items-center">
+                    <h5><i class="fas fa-memory"></i> 内存占用(按键族抽样)</h5>
+                    <button class="btn btn-sm btn-outline-primary" onclick="loadMemoryUsage()">
+                        <i class="fas fa-search"></i> 采样
+                    </button>
+                </div>
+                <div class="card-body">
+                    <p class="text-muted small" id="memory-summary">点击"采样"统计内存占用(会扫描Redis键,建议在低峰期使用)</p>
+                    <table class="table table-sm">
+                        <thead>
+                            <tr><th>库</th><th>键族</th><th>键数量</th><th>平均大小</th><th>估算占用</th></tr>
+                        </thead>
+                        <tbody id="memory-table"></tbody>
+                    </table>
                 </div>
             </div>
 
@@ -11937,32 +12417,64 @@ def admin_cache():
                             statusBadge.textContent = '已禁用';
                         }
 
+                        // 更新磁盘层状态(Redis不可用时由磁盘层提供缓存)
+                        const disk = stats.disk || {};
+                        document.getElementById('disk-usage').textContent = disk.enabled
+                            ? `${disk.variant_count || 0}个条目 / ${formatBytes(disk.used_bytes || 0)}` +
+                              (disk.redis_available === false ? ' (Redis不可用,使用中)' : '')
+                            : '未启用';
+
                         // 更新主要指标
                         document.getElementById('hit-rate').textContent = stats.hit_rate.toFixed(1) + '%';
                         document.getElementById('total-hits').textContent = stats.total_hits;
                         document.getElementById('total-requests').textContent = stats.total_requests;
                         document.getElementById('cache-count').textContent = stats.cache_count || 0;
+                        document.getElementById('article-count').textContent = stats.article_count || 0;
 
                         // 更新命中详情
                         document.getElementById('exact-hits').textContent = stats.exact_hits;
-                        document.getElementById('relaxed-hits').textContent = stats.relaxed_hits;
+                        document.getElementById('subsumption-hits').textContent = stats.subsumption_hits || 0;
+                        document.getElementById('stale-hits').textContent = stats.stale_hits || 0;
+                        document.getElementById('refreshes-scheduled').textContent = stats.refreshes_scheduled || 0;
+                        document.getElementById('l0-hit-rate').textContent = `${stats.l0_hit_rate || 0}% (${stats.l0_hits || 0}次)`;
+                        document.getElementById('l1-hit-rate').textContent = `${stats.l1_hit_rate || 0}% (${stats.l1_hits || 0}次)`;
+                        document.getElementById('l0-usage').textContent = `${stats.l0_entries || 0}个条目 / ${((stats.l0_bytes || 0) / 1024 / 1024).toFixed(2)}MB`;
                         document.getElementById('total-misses').textContent = stats.total_misses;
 
                         // 更新进度条
                         const total = stats.total_requests || 1;
                         const exactPercent = (stats.exact_hits / total * 100).toFixed(1);
-                        const relaxedPercent = (stats.relaxed_hits / total * 100).toFixed(1);
+                        const subsumptionPercent = ((stats.subsumption_hits || 0) / total * 100).toFixed(1);
                         const missPercent = (stats.total_misses / total * 100).toFixed(1);
 
                         document.getElementById('exact-bar').style.width = exactPercent + '%';
                         document.getElementById('exact-bar').textContent = `精确 ${exactPercent}%`;
-                        document.getElementById('relaxed-bar').style.width = relaxedPercent + '%';
-                        document.getElementById('relaxed-bar').textContent = `宽松 ${relaxedPercent}%`;
+                        document.getElementById('subsumption-bar').style.width = subsumptionPercent + '%';
+                        document.getElementById('subsumption-bar').textContent = `包含 ${subsumptionPercent}%`;
                         document.getElementById('miss-bar').style.width = missPercent + '%';
                         document.getElementById('miss-bar').textContent = `未命中 ${missPercent}%`;
 
                         // 更新最后重置时间
                         document.getElementById('last-reset').textContent = stats.last_reset || '从未';
+
+                        // 更新延迟分布
+                        const latencyTable = document.getElementById('latency-table');
+                        latencyTable.innerHTML = '';
+                        (stats.latency_buckets || []).forEach((bucket, index) => {
+                            const row = latencyTable.insertRow();
+                            row.insertCell().textContent = bucket === 'le_inf' ? '> 5000' : bucket.replace('le_', '');
+                            row.insertCell().textContent = stats.lookup_latency[index];
+                            row.insertCell().textContent = stats.fill_latency[index];
+                        });
+
+                        // 更新热门检索词
+                        const hotKeysTable = document.getElementById('hot-keys-table');
+                        hotKeysTable.innerHTML = '';
+                        (stats.hot_keys || []).forEach(item => {
+                            const row = hotKeysTable.insertRow();
+                            row.insertCell().textContent = item.keywords;
+                            row.insertCell().textContent = item.reads;
+                        });
                     }
                 } catch (error) {
                     console.error('加载统计失败:', error);
@@ -12048,6 +12560,49 @@ def admin_cache():
                 }
             }
 
+            // 内存占用采样
+            function formatBytes(bytes) {
+                if (bytes >= 1024 * 1024) return (bytes / 1024 / 1024).toFixed(2) + 'MB';
+                if (bytes >= 1024) return (bytes / 1024).toFixed(1) + 'KB';
+                return bytes + 'B';
+            }
+
+            async function loadMemoryUsage() {
+                try {
+                    const response = await fetch('/admin/cache/memory');
+                    const data = await response.json();
+
+                    if (!data.success) {
+                        alert('采样失败: ' + data.error);
+                        return;
+                    }
+
+                    const usage = data.usage;
+                    if (!usage.enabled) {
+                        document.getElementById('memory-summary').textContent = usage.message;
+                        return;
+                    }
+
+                    const info = usage.info;
+                    document.getElementById('memory-summary').textContent =
+                        `Redis已用 ${formatBytes(info.used_memory)} / 上限 ${info.maxmemory ? formatBytes(info.maxmemory) : '未设置'}` +
+                        ` (淘汰策略: ${info.maxmemory_policy}),搜索缓存预算 ${formatBytes(info.cache_budget_used)} / ${formatBytes(info.cache_budget_bytes)}`;
+
+                    const memoryTable = document.getElementById('memory-table');
+                    memoryTable.innerHTML = '';
+                    usage.families.forEach(item => {
+                        const row = memoryTable.insertRow();
+                        row.insertCell().textContent = item.database;
+                        row.insertCell().textContent = item.family;
+                        row.insertCell().textContent = item.key_count + (item.truncated ? '+' : '');
+                        row.insertCell().textContent = formatBytes(item.avg_bytes);
+                        row.insertCell().textContent = formatBytes(item.estimated_bytes);
+                    });
+                } catch (error) {
+                    alert('采样失败: ' + error.message);
+                }
+            }
+
             // 页面加载时刷新统计
             refreshStats();
 
@@ -12075,6 +12630,22 @@ def admin_cache_stats():
             'error': str(e)
         }), 500
 
+@app.route('/admin/cache/memory')
+@admin_required
+def admin_cache_memory():
+    """按键族统计Redis内存占用API(抽样估算)"""
+    try:
+        usage = search_cache_service.get_memory_usage()
+        return jsonify({
+            'success': True,
+            'usage': usage
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/admin/cache/clear', methods=['POST'])
 @admin_required
 def admin_cache_clear():
@@ -12711,40 +13282,12 @@ def admin_mail_test(config_id):
         <p>如果您收到此邮件，说明邮箱配置正常工作。</p>
         """
         
-        # 临时设置邮件配置进行测试
-        from flask_mail import Message, Mail
-        
-        app.config['MAIL_SERVER'] = config.smtp_server
-        app.config['MAIL_PORT'] = config.smtp_port
-        app.config['MAIL_USERNAME'] = config.username
-        app.config['MAIL_PASSWORD'] = config.password
-        
-        # 根据端口设置正确的加密方式（与发送邮件逻辑保持一致）
-        if config.smtp_port == 465:
-            # 465端口使用SSL，不使用TLS
-            app.config['MAIL_USE_SSL'] = True
-            app.config['MAIL_USE_TLS'] = False
-        elif config.smtp_port == 587:
-            # 587端口使用TLS，不使用SSL
-            app.config['MAIL_USE_SSL'] = False
-            app.config['MAIL_USE_TLS'] = True
-        else:
-            # 其他端口按配置设置
-            app.config['MAIL_USE_TLS'] = config.use_tls
-            app.config['MAIL_USE_SSL'] = False
-        
-        mail = Mail(app)
-
         # 使用from_email字段(如果有),否则使用username
         sender_email = config.from_email or config.username
-        msg = Message(
-            subject=test_subject,
-            sender=sender_email,
-            recipients=[current_user.email]  # 发送给当前管理员
-        )
-        msg.html = test_content
+        msg = build_message(test_subject, sender_email, [current_user.email], test_content)  # 发送给当前管理员
         
-        mail.send(msg)
+        # 加密方式与发送邮件逻辑一致
+        smtp_pool.send(settings_from_config(config), msg)
         
         # 标记配置为已测试
         config.last_used = beijing_now()
@@ -13570,6 +14113,10 @@ def update_subscription(subscription_id):
         except Exception as e:
             app.logger.warning(f"为订阅 {subscription.id} 更新RQ调度任务失败: {e}")
 
+        # 提示词模板或模型变化后重新生成AI检索式（未变化时不调用AI）
+        ai_service.get_pubmed_query(subscription.keywords, subscription=subscription)
+        db.session.commit()
+
         log_activity('INFO', 'subscription', f'用户 {current_user.email} 更新订阅设置: {subscription.keywords}', current_user.id, request.remote_addr)
         flash('订阅设置更新成功！', 'success')
         
@@ -13679,7 +14226,13 @@ if __name__ == '__main__':
                     'push_frequency': 'VARCHAR(20) DEFAULT "daily"',
                     'push_time': 'VARCHAR(5) DEFAULT "09:00"',
                     'push_day': 'VARCHAR(10) DEFAULT "monday"',
-                    'push_month_day': 'INTEGER DEFAULT 1'
+                    'push_month_day': 'INTEGER DEFAULT 1',
+                    'ai_query': 'TEXT',
+                    'ai_query_hash': 'VARCHAR(64)',
+                    'ai_query_prompt_version': 'VARCHAR(16)',
+                    'ai_query_model': 'VARCHAR(120)',
+                    'ai_query_generated_at': 'DATETIME',
+                    'next_push_at': 'DATETIME'
                 }
                 
                 # 检查缺失的Subscription字段
@@ -13705,7 +14258,15 @@ if __name__ == '__main__':
                     print("Subscription表结构修复完成")
                 else:
                     print("Subscription表结构检查通过")
-                
+
+                # 到期订阅扫描依赖的索引（与migrate_database.py迁移7一致）
+                try:
+                    with db.engine.connect() as conn:
+                        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_subscription_active_next_push ON subscription (is_active, next_push_at)'))
+                        conn.commit()
+                except Exception as e:
+                    print(f"创建索引 ix_subscription_active_next_push 失败: {e}")
+
                 # 检查Article表是否缺少字段
                 article_columns = {col['name'] for col in inspector.get_columns('article')}
                 
@@ -13849,6 +14410,8 @@ if __name__ == '__main__':
                 ('push_max_articles', '50', '每次推送最大文章数', 'push'),
                 ('push_check_frequency', '0.0833', 'RQ调度器扫描间隔(小时)', 'push'),  # 默认5分钟
                 ('push_enabled', 'true', '启用自动推送', 'push'),
+                ('push_digest_enabled', 'false', '合并同一用户的订阅推送', 'push'),
+                ('push_digest_window', '30', '推送合并窗口(分钟)', 'push'),
                 ('mail_server', 'smtp.gmail.com', 'SMTP服务器地址', 'mail'),
                 ('mail_port', '587', 'SMTP端口', 'mail'),
                 ('mail_username', '', '发送邮箱', 'mail'),
@@ -13856,6 +14419,7 @@ if __name__ == '__main__':
                 ('mail_use_tls', 'true', '启用TLS加密', 'mail'),
                 ('system_name', 'PubMed Literature Push', '系统名称', 'system'),
                 ('log_retention_days', '30', '日志保留天数', 'system'),
+                ('article_retention_days', '180', '推送记录保留天数', 'system'),
                 ('user_registration_enabled', 'true', '允许用户注册', 'system'),
                 ('require_invite_code', 'false', '需要邀请码注册', 'system'),
                 ('max_articles_limit', '1000', '文章数量上限', 'system'),
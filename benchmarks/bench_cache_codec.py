@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+缓存编解码基准测试
+对比不同序列化器/压缩算法在真实规模文章数据上的编码耗时、解码耗时和存储字节数
+
+用法:
+    python benchmarks/bench_cache_codec.py [--articles 200] [--rounds 20]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache_codec
+from cache_codec import CacheCodec
+
+WORDS = (
+    "patients cohort randomized trial outcome survival tumor expression clinical "
+    "analysis treatment risk association cells mice significantly increased reduced "
+    "mortality inflammation signaling pathway therapy response biomarker prognosis "
+    "retrospective prospective meta-analysis hazard ratio confidence interval"
+).split()
+
+JOURNALS = ["Nature Medicine", "The Lancet Oncology", "JAMA", "Cell Reports", "BMJ Open", "Frontiers in Immunology"]
+
+
+def make_article(pmid, rng):
+    """构造与PubMedAPI._extract_article_data字段一致的文章数据"""
+    def sentence(n):
+        return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+    return {
+        'pmid': str(pmid),
+        'title': sentence(rng.randint(10, 20)),
+        'authors': ', '.join(f"Author{rng.randint(1, 9999)} X" for _ in range(rng.randint(3, 15))),
+        'journal': rng.choice(JOURNALS),
+        'issn': f"{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+        'eissn': f"{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+        'publish_date': datetime.now(timezone(timedelta(hours=8))) - timedelta(days=rng.randint(0, 30)),
+        'abstract': ' '.join(sentence(rng.randint(15, 30)) for _ in range(rng.randint(8, 14))),
+        'doi': f"10.{rng.randint(1000, 9999)}/{rng.randint(100000, 999999)}",
+        'pubmed_url': f'https://pubmed.ncbi.nlm.nih.gov/{pmid}/',
+        'keywords': ', '.join(rng.choice(WORDS) for _ in range(5)),
+        'url': f'https://pubmed.ncbi.nlm.nih.gov/{pmid}/',
+        'jcr_if': f"{rng.uniform(0.5, 60):.1f}",
+        'jcr_quartile': rng.choice(['Q1', 'Q2', 'Q3', 'Q4', '']),
+        'zky_category': rng.choice(['1', '2', '3', '4', '']),
+        'zky_top': rng.choice(['是', '否', '']),
+        'has_quality_data': True
+    }
+
+
+def legacy_encode(articles):
+    """旧实现: 递归清理后json.dumps"""
+    sanitized = [{k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in a.items()} for a in articles]
+    return json.dumps(sanitized, ensure_ascii=False).encode('utf-8')
+
+
+def bench(label, encode, decode, articles, rounds, size=len):
+    """测量编码/解码耗时(毫秒,取中位数)和编码后字节数"""
+    encode_times, decode_times = [], []
+    encoded = b''
+    for _ in range(rounds):
+        start = time.perf_counter()
+        encoded = encode(articles)
+        encode_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        decode(encoded)
+        decode_times.append(time.perf_counter() - start)
+
+    encode_times.sort()
+    decode_times.sort()
+    print(f"{label:<16} {encode_times[rounds // 2] * 1000:>10.2f} {decode_times[rounds // 2] * 1000:>10.2f} {size(encoded):>12,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='缓存编解码基准测试')
+    parser.add_argument('--articles', type=int, default=200, help='每次编码的文章数(默认200,即一次检索深度)')
+    parser.add_argument('--rounds', type=int, default=20, help='重复次数')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    articles = [make_article(38000000 + i, rng) for i in range(args.articles)]
+
+    print(f"文章数: {args.articles}, 重复: {args.rounds}")
+    print(f"可用依赖: orjson={cache_codec.orjson is not None}, msgpack={cache_codec.msgpack is not None}, "
+          f"zstandard={cache_codec.zstandard is not None}")
+
+    codecs = {}
+    for serializer in ('json', 'orjson', 'msgpack'):
+        for compression in ('none', 'zlib', 'zstd'):
+            codec = CacheCodec(serializer, compression)
+            codecs.setdefault(codec.name, codec)  # 依赖未安装时回退到相同实现,跳过重复项
+
+    print("\n[整批编码] 所有文章作为一个值")
+    print(f"{'编解码器':<14} {'编码(ms)':>10} {'解码(ms)':>10} {'字节数':>12}")
+    bench('legacy-json', legacy_encode, json.loads, articles, args.rounds)
+    for name, codec in codecs.items():
+        bench(name, codec.encode, codec.decode, articles, args.rounds)
+
+    # 搜索缓存按PMID分别存储文章记录,逐条编码更贴近实际
+    print("\n[逐条编码] 每篇文章一个值(搜索缓存的实际存储方式),字节数为总和")
+    print(f"{'编解码器':<14} {'编码(ms)':>10} {'解码(ms)':>10} {'字节数':>12}")
+    bench('legacy-json',
+          lambda items: [legacy_encode([a]) for a in items],
+          lambda values: [json.loads(v) for v in values],
+          articles, args.rounds, size=lambda values: sum(len(v) for v in values))
+    for name, codec in codecs.items():
+        bench(name,
+              lambda items, c=codec: [c.encode(a) for a in items],
+              lambda values, c=codec: [c.decode(v) for v in values],
+              articles, args.rounds, size=lambda values: sum(len(v) for v in values))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+数据库索引基准测试
+在填充了大量数据的SQLite库上对比迁移6(高频查询索引)前后的查询计划和耗时
+
+用法:
+    python benchmarks/bench_db_indexes.py [--rows 1000000] [--rounds 5] [--db /tmp/bench.db]
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrate_database import apply_hot_path_indexes
+
+# 与setup.py中的表结构一致(只包含参与测试的表)
+SCHEMA = """
+CREATE TABLE subscription (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    keywords VARCHAR(500) NOT NULL,
+    is_active BOOLEAN DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE user_article (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    article_id INTEGER NOT NULL,
+    subscription_id INTEGER NOT NULL,
+    push_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_read BOOLEAN DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE system_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    level VARCHAR(10) NOT NULL,
+    module VARCHAR(50) NOT NULL,
+    message VARCHAR(500) NOT NULL,
+    user_id INTEGER,
+    ip_address VARCHAR(45)
+);
+"""
+
+MODULES = ['push', 'scheduler', 'mail', 'subscription', 'system', 'admin', 'auth']
+LEVELS = ['INFO'] * 90 + ['WARNING'] * 8 + ['ERROR'] * 2
+
+
+def seed(conn, rows, rng):
+    """填充订阅、用户文章关联和系统日志"""
+    users = max(rows // 500, 10)
+    subscriptions_per_user = 5
+    articles = max(rows // 5, 100)
+    now = datetime.now()
+
+    conn.executemany(
+        "INSERT INTO subscription (user_id, keywords, is_active) VALUES (?, ?, ?)",
+        (
+            (user_id, f"keyword {user_id}-{n}", 1 if rng.random() < 0.8 else 0)
+            for user_id in range(1, users + 1) for n in range(subscriptions_per_user)
+        )
+    )
+
+    def user_articles():
+        for _ in range(rows):
+            user_id = rng.randint(1, users)
+            subscription_id = (user_id - 1) * subscriptions_per_user + rng.randint(1, subscriptions_per_user)
+            push_date = now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+            yield user_id, rng.randint(1, articles), subscription_id, push_date.strftime('%Y-%m-%d %H:%M:%S')
+
+    conn.executemany(
+        "INSERT INTO user_article (user_id, article_id, subscription_id, push_date) VALUES (?, ?, ?, ?)",
+        user_articles()
+    )
+
+    def logs():
+        for n in range(rows):
+            timestamp = now - timedelta(seconds=(rows - n) * 30)
+            yield (timestamp.strftime('%Y-%m-%d %H:%M:%S'), rng.choice(LEVELS), rng.choice(MODULES),
+                   f"log message {n}")
+
+    conn.executemany(
+        "INSERT INTO system_log (timestamp, level, module, message) VALUES (?, ?, ?, ?)",
+        logs()
+    )
+    conn.commit()
+    return users, articles
+
+
+def build_queries(users, articles, rng):
+    """与app.py中高频路径对应的查询"""
+    user_id = rng.randint(1, users)
+    subscription_id = (user_id - 1) * 5 + 1
+    article_ids = [rng.randint(1, articles) for _ in range(20)]
+    placeholders = ','.join('?' * len(article_ids))
+    month_ago = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+
+    return [
+        ('推送去重(按订阅)',
+         f"SELECT article_id FROM user_article WHERE user_id = ? AND article_id IN ({placeholders}) "
+         f"AND subscription_id = ?",
+         (user_id, *article_ids, subscription_id)),
+        ('推送去重(按用户)',
+         f"SELECT article_id FROM user_article WHERE user_id = ? AND article_id IN ({placeholders})",
+         (user_id, *article_ids)),
+        ('用户本月推送数',
+         "SELECT COUNT(*) FROM user_article WHERE user_id = ? AND push_date >= ?",
+         (user_id, month_ago)),
+        ('删除订阅的关联',
+         "SELECT COUNT(*) FROM user_article WHERE subscription_id = ?",
+         (subscription_id,)),
+        ('日志页面最近100条',
+         "SELECT * FROM system_log ORDER BY timestamp DESC LIMIT 100",
+         ()),
+        ('按级别统计日志',
+         "SELECT COUNT(*) FROM system_log WHERE level = ?",
+         ('ERROR',)),
+        ('最近推送日志',
+         "SELECT * FROM system_log WHERE module = ? ORDER BY timestamp DESC LIMIT 10",
+         ('push',)),
+        ('用户活跃订阅',
+         "SELECT * FROM subscription WHERE user_id = ? AND is_active = 1",
+         (user_id,)),
+    ]
+
+
+def measure(conn, queries, rounds):
+    """返回 {查询名: (查询计划, 中位耗时毫秒)}"""
+    results = {}
+    for name, sql, params in queries:
+        plan = ' | '.join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = (plan, timings[len(timings) // 2])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库索引基准测试')
+    parser.add_argument('--rows', type=int, default=1000000, help='用户文章关联和系统日志的行数')
+    parser.add_argument('--rounds', type=int, default=5, help='每个查询的执行轮数(取中位数)')
+    parser.add_argument('--db', default=None, help='测试库路径(默认临时文件,测试后删除)')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'bench_indexes.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    rng = random.Random(42)
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+
+    started = time.perf_counter()
+    users, articles = seed(conn, args.rows, rng)
+    print(f"填充数据: {args.rows} 行/表, {users} 个用户, 耗时 {time.perf_counter() - started:.1f}s")
+
+    queries = build_queries(users, articles, rng)
+    before = measure(conn, queries, args.rounds)
+
+    started = time.perf_counter()
+    created, removed_duplicates = apply_hot_path_indexes(conn.cursor())
+    conn.commit()
+    print(f"迁移6: 创建 {len(created)} 个索引, 删除重复关联 {removed_duplicates} 条, "
+          f"耗时 {time.perf_counter() - started:.1f}s\n")
+
+    after = measure(conn, queries, args.rounds)
+
+    print(f"{'查询':<16}{'索引前(ms)':>12}{'索引后(ms)':>12}{'加速':>10}")
+    for name, _, _ in queries:
+        before_ms, after_ms = before[name][1], after[name][1]
+        speedup = before_ms / after_ms if after_ms > 0 else float('inf')
+        print(f"{name:<16}{before_ms:>12.2f}{after_ms:>12.2f}{speedup:>9.1f}x")
+
+    print("\n查询计划:")
+    for name, _, _ in queries:
+        print(f"  {name}")
+        print(f"    索引前: {before[name][0]}")
+        print(f"    索引后: {after[name][0]}")
+
+    conn.close()
+    if not args.db:
+        os.remove(db_path)
+
+
+if __name__ == '__main__':
+    main()
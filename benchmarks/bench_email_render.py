@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+推送邮件渲染基准测试
+对比文章卡片片段缓存开启/关闭时渲染1000封邮件(HTML + 纯文本)的耗时
+
+用法:
+    python benchmarks/bench_email_render.py [--emails 1000] [--articles 10] [--pool 200] [--rounds 3]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_renderer import PushEmailRenderer
+
+
+class BenchArticle:
+    """与Article模型字段一致的测试文章"""
+
+    def __init__(self, article_id, rng):
+        self.id = article_id
+        self.pmid = str(30000000 + article_id)
+        self.title = f"Randomized trial of intervention {article_id} in patients with chronic disease"
+        self.journal = rng.choice(['Nature Medicine', 'The Lancet', 'JAMA', 'BMJ', 'Cell'])
+        self.publish_date = datetime(2024, 1, 1) + timedelta(days=article_id % 300)
+        self.issn = f"{1000 + article_id % 50:04d}-{article_id % 9999:04d}"
+        self.eissn = f"{2000 + article_id % 50:04d}-{article_id % 9999:04d}" if article_id % 2 else None
+        self.pubmed_url = f"https://pubmed.ncbi.nlm.nih.gov/{self.pmid}/"
+        self.abstract = ' '.join(['Background and methods of the study with outcomes.'] * 25)
+        self.abstract_cn = '研究背景、方法和主要结局。' * 20
+        self.brief_intro = f'本研究评估了干预措施{article_id}的疗效和安全性。'
+
+
+def journal_quality(issn):
+    return {'jcr_quartile': 'Q1', 'jcr_if': '25.4', 'zky_category': '1', 'zky_top': '是'}
+
+
+def render_emails(renderer, mailings):
+    started = time.perf_counter()
+    for keywords, articles in mailings:
+        renderer.render_html(articles, keywords)
+        renderer.render_text(articles, keywords)
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='推送邮件渲染基准测试')
+    parser.add_argument('--emails', type=int, default=1000, help='邮件数量')
+    parser.add_argument('--articles', type=int, default=10, help='每封邮件的文章数')
+    parser.add_argument('--pool', type=int, default=200, help='不同文章总数(同一文章推送给多个用户)')
+    parser.add_argument('--rounds', type=int, default=3, help='轮数(取中位数)')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    pool = [BenchArticle(article_id, rng) for article_id in range(1, args.pool + 1)]
+    mailings = [
+        (f"keyword {n % 50}", rng.sample(pool, args.articles))
+        for n in range(args.emails)
+    ]
+
+    results = {}
+    for label, max_fragments in (('无片段缓存', 0), ('片段缓存', 10000)):
+        timings = []
+        for _ in range(args.rounds):
+            # 每轮使用新的渲染器,缓存从空开始,包含首次渲染的开销
+            renderer = PushEmailRenderer(journal_quality, lambda: 1, max_fragments=max_fragments)
+            timings.append(render_emails(renderer, mailings))
+        timings.sort()
+        results[label] = (timings[len(timings) // 2], renderer.get_stats())
+
+    print(f"{args.emails} 封邮件, 每封 {args.articles} 篇文章, 文章池 {args.pool} 篇\n")
+    baseline = results['无片段缓存'][0]
+    for label, (elapsed, stats) in results.items():
+        per_1000 = elapsed / args.emails * 1000
+        print(f"{label:<8} 总耗时 {elapsed:8.1f} ms  每1000封 {per_1000:8.1f} ms  "
+              f"加速 {baseline / elapsed:5.1f}x  命中率 {stats['hit_rate']:.1%}")
+
+
+if __name__ == '__main__':
+    main()
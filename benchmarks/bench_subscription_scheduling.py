@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+订阅调度基准测试
+在fakeredis上对填充了大量订阅的临时SQLite库运行 batch_schedule_all_subscriptions:
+
+- 首次调度(Redis为空)和再次调度(每个订阅都要取消上一个任务再改期,即Worker重启后的恢复)
+- 单次取消的耗时: 订阅任务索引 vs 原先扫描全部调度注册表
+
+用法:
+    python benchmarks/bench_subscription_scheduling.py [--subscriptions 10000,100000] [--backend rq]
+
+依赖: pip install fakeredis lupa
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+import fakeredis
+
+# 在导入应用前把所有Redis连接替换为同一个内存实例
+_server = fakeredis.FakeServer()
+redis.from_url = lambda url, **kwargs: fakeredis.FakeRedis(server=_server)
+
+FREQUENCIES = ['daily'] * 7 + ['weekly'] * 2 + ['monthly']
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def seed(db, subscriptions, rng):
+    """填充用户和订阅(每个用户3个订阅)"""
+    users = max(subscriptions // 3, 1)
+    db.session.execute(
+        db.text("INSERT INTO user (id, email, is_admin, is_active) VALUES (:id, :email, 0, 1)"),
+        [{'id': user_id, 'email': f"user{user_id}@example.com"} for user_id in range(1, users + 1)]
+    )
+    db.session.execute(
+        db.text(
+            "INSERT INTO subscription (id, user_id, keywords, is_active, push_frequency, push_time, "
+            "push_day, push_month_day) VALUES (:id, :user_id, :keywords, 1, :frequency, :time, :day, :month_day)"
+        ),
+        [
+            {
+                'id': n, 'user_id': (n - 1) % users + 1, 'keywords': f"keyword {n}",
+                'frequency': rng.choice(FREQUENCIES),
+                'time': f"{rng.randint(0, 23):02d}:{rng.choice([0, 15, 30, 45]):02d}",
+                'day': rng.choice(WEEKDAYS), 'month_day': rng.randint(1, 28)
+            }
+            for n in range(1, subscriptions + 1)
+        ]
+    )
+    db.session.commit()
+
+
+def legacy_cancel(subscription_id, queues):
+    """原 cancel_subscription_jobs 的查找部分: 扫描三个队列的调度和延迟注册表"""
+    from rq.registry import ScheduledJobRegistry
+    prefix = f'push_subscription_{subscription_id}_'
+    matched = []
+    for queue in queues:
+        matched += [job_id for job_id in ScheduledJobRegistry(queue=queue).get_job_ids() if job_id.startswith(prefix)]
+    for queue in queues:
+        matched += [job_id for job_id in queue.deferred_job_registry.get_job_ids() if job_id.startswith(prefix)]
+    return matched
+
+
+def measure_cancel(sample_ids, cancel):
+    durations = []
+    for subscription_id in sample_ids:
+        started = time.perf_counter()
+        cancel(subscription_id)
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
+
+
+def run(count, backend, rng):
+    import push_scheduler
+    import rq_config
+    from app import app, db
+    from tasks import batch_schedule_all_subscriptions
+
+    push_scheduler.PUSH_SCHEDULER_BACKEND = backend
+    rq_config.redis_conn.flushall()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        seed(db, count, rng)
+        print(f"\n[{backend}] 填充 {count} 个订阅, 耗时 {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    first = batch_schedule_all_subscriptions()
+    first_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    second = batch_schedule_all_subscriptions()
+    second_seconds = time.perf_counter() - started
+
+    print(f"  首次调度: {first.get('scheduled')}/{first.get('total')} 个, {first_seconds:.1f}s "
+          f"({first_seconds / count * 1e6:.0f}us/个)")
+    print(f"  再次调度: {second.get('scheduled')}/{second.get('total')} 个, {second_seconds:.1f}s "
+          f"({second_seconds / count * 1e6:.0f}us/个)")
+
+    if backend == 'rq':
+        queues = [rq_config.high_priority_queue, rq_config.default_queue, rq_config.low_priority_queue]
+        sample_ids = rng.sample(range(1, count + 1), min(20, count))
+        legacy_ms = measure_cancel(sample_ids, lambda subscription_id: legacy_cancel(subscription_id, queues))
+        indexed_ms = measure_cancel(sample_ids, rq_config.cancel_subscription_jobs)
+        print(f"  单次取消(中位数): 扫描注册表 {legacy_ms:.2f}ms, 订阅任务索引 {indexed_ms:.3f}ms")
+        print(f"  按扫描注册表估算再次调度耗时: {legacy_ms * count / 1000:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='订阅调度基准测试')
+    parser.add_argument('--subscriptions', default='10000,100000', help='订阅数量,逗号分隔')
+    parser.add_argument('--backend', default='rq', help='调度后端 rq / zset,逗号分隔')
+    parser.add_argument('--db', default=None, help='测试库路径(默认临时文件)')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'bench_scheduling.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    rng = random.Random(42)
+
+    for backend in args.backend.split(','):
+        for count in [int(value) for value in args.subscriptions.split(',')]:
+            run(count, backend.strip(), rng)
+
+
+if __name__ == '__main__':
+    main()
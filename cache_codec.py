@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+缓存序列化编解码模块
+为搜索缓存和大体积任务数据提供紧凑的二进制序列化(orjson/msgpack + zstd/zlib)
+
+编码格式: [格式版本字节][编解码器字节][负载]
+- 格式版本字节固定为FORMAT_VERSION,不会与JSON文本的首字符冲突
+- 编解码器字节高4位为序列化器ID,低4位为压缩算法ID
+- 未带版本头的旧数据按JSON文本解码,升级后无需清空缓存
+"""
+
+import os
+import json
+import zlib
+import logging
+from datetime import datetime, date
+from typing import Any
+
+# 可选依赖: 不可用时自动回退到标准库实现
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+FORMAT_VERSION = 1
+
+# 序列化器ID
+SERIALIZER_JSON = 1
+SERIALIZER_ORJSON = 2
+SERIALIZER_MSGPACK = 3
+
+# 压缩算法ID
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+
+SERIALIZER_NAMES = {'json': SERIALIZER_JSON, 'orjson': SERIALIZER_ORJSON, 'msgpack': SERIALIZER_MSGPACK}
+COMPRESSION_NAMES = {'none': COMPRESSION_NONE, 'zlib': COMPRESSION_ZLIB, 'zstd': COMPRESSION_ZSTD}
+
+# 小于该字节数的负载不压缩(压缩头开销大于收益)
+COMPRESS_MIN_BYTES = 512
+
+ZLIB_LEVEL = 3
+ZSTD_LEVEL = 3
+
+
+def _default(obj: Any) -> Any:
+    """序列化不支持的类型: 日期转为ISO字符串,自定义对象转为字典"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if hasattr(obj, '__dict__'):
+        return obj.__dict__
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+class CacheCodec:
+    """
+    可插拔的缓存编解码器
+
+    序列化器和压缩算法可通过环境变量CACHE_CODEC_SERIALIZER /
+    CACHE_CODEC_COMPRESSION指定(auto表示选择已安装的最快实现)。
+    解码时根据数据头自动识别格式,与编码配置无关
+    """
+
+    def __init__(self, serializer: str = 'auto', compression: str = 'auto',
+                 compress_min_bytes: int = COMPRESS_MIN_BYTES):
+        self.serializer = self._resolve_serializer(serializer)
+        self.compression = self._resolve_compression(compression)
+        self.compress_min_bytes = compress_min_bytes
+
+        if zstandard is not None:
+            self._zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            self._zstd_decompressor = zstandard.ZstdDecompressor()
+
+    @property
+    def name(self) -> str:
+        """编解码器名称,如 orjson+zstd"""
+        serializer = {v: k for k, v in SERIALIZER_NAMES.items()}[self.serializer]
+        compression = {v: k for k, v in COMPRESSION_NAMES.items()}[self.compression]
+        return f"{serializer}+{compression}"
+
+    def encode(self, data: Any) -> bytes:
+        """
+        编码数据
+
+        Args:
+            data: 可序列化的数据(dict/list/基本类型,datetime自动转为ISO字符串)
+
+        Returns:
+            bytes: 带格式头的编码结果
+        """
+        payload = self._serialize(data, self.serializer)
+
+        compression = self.compression
+        if len(payload) < self.compress_min_bytes:
+            compression = COMPRESSION_NONE
+        payload = self._compress(payload, compression)
+
+        header = bytes((FORMAT_VERSION, (self.serializer << 4) | compression))
+        return header + payload
+
+    def decode(self, raw: Any) -> Any:
+        """
+        解码数据,兼容未带格式头的旧JSON数据
+
+        Args:
+            raw: Redis返回的bytes或str
+
+        Returns:
+            解码后的数据
+
+        Raises:
+            ValueError: 数据格式无法识别或缺少对应的解码库
+        """
+        if isinstance(raw, str):
+            return json.loads(raw)
+        if not raw:
+            raise ValueError("空数据无法解码")
+
+        if raw[0] != FORMAT_VERSION:
+            # 旧版本直接写入的JSON文本
+            return json.loads(raw)
+
+        serializer = raw[1] >> 4
+        compression = raw[1] & 0x0F
+        try:
+            payload = self._decompress(bytes(raw[2:]), compression)
+            return self._deserialize(payload, serializer)
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"缓存数据解码失败: {e}") from e
+
+    # ==================== 私有辅助方法 ====================
+
+    @staticmethod
+    def _resolve_serializer(name: str) -> int:
+        """解析序列化器配置"""
+        name = (name or 'auto').lower()
+        if name == 'auto':
+            if orjson is not None:
+                return SERIALIZER_ORJSON
+            if msgpack is not None:
+                return SERIALIZER_MSGPACK
+            return SERIALIZER_JSON
+
+        serializer = SERIALIZER_NAMES.get(name)
+        if serializer == SERIALIZER_ORJSON and orjson is None:
+            logging.warning("orjson未安装,缓存序列化回退到json")
+            return SERIALIZER_JSON
+        if serializer == SERIALIZER_MSGPACK and msgpack is None:
+            logging.warning("msgpack未安装,缓存序列化回退到json")
+            return SERIALIZER_JSON
+        if serializer is None:
+            logging.warning(f"未知的缓存序列化器: {name},使用json")
+            return SERIALIZER_JSON
+        return serializer
+
+    @staticmethod
+    def _resolve_compression(name: str) -> int:
+        """解析压缩算法配置"""
+        name = (name or 'auto').lower()
+        if name == 'auto':
+            return COMPRESSION_ZSTD if zstandard is not None else COMPRESSION_ZLIB
+
+        compression = COMPRESSION_NAMES.get(name)
+        if compression == COMPRESSION_ZSTD and zstandard is None:
+            logging.warning("zstandard未安装,缓存压缩回退到zlib")
+            return COMPRESSION_ZLIB
+        if compression is None:
+            logging.warning(f"未知的缓存压缩算法: {name},使用zlib")
+            return COMPRESSION_ZLIB
+        return compression
+
+    @staticmethod
+    def _serialize(data: Any, serializer: int) -> bytes:
+        """序列化"""
+        if serializer == SERIALIZER_ORJSON:
+            return orjson.dumps(data, default=_default)
+        if serializer == SERIALIZER_MSGPACK:
+            return msgpack.packb(data, default=_default, use_bin_type=True)
+        return json.dumps(data, ensure_ascii=False, default=_default, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def _deserialize(payload: bytes, serializer: int) -> Any:
+        """反序列化"""
+        if serializer == SERIALIZER_ORJSON:
+            # orjson输出是标准JSON,未安装orjson的进程也能用json解码
+            return orjson.loads(payload) if orjson is not None else json.loads(payload)
+        if serializer == SERIALIZER_MSGPACK:
+            if msgpack is None:
+                raise ValueError("数据使用msgpack编码,但msgpack未安装")
+            return msgpack.unpackb(payload, raw=False)
+        if serializer == SERIALIZER_JSON:
+            return json.loads(payload)
+        raise ValueError(f"未知的序列化器ID: {serializer}")
+
+    def _compress(self, payload: bytes, compression: int) -> bytes:
+        """压缩"""
+        if compression == COMPRESSION_ZSTD:
+            return self._zstd_compressor.compress(payload)
+        if compression == COMPRESSION_ZLIB:
+            return zlib.compress(payload, ZLIB_LEVEL)
+        return payload
+
+    def _decompress(self, payload: bytes, compression: int) -> bytes:
+        """解压"""
+        if compression == COMPRESSION_ZSTD:
+            if zstandard is None:
+                raise ValueError("数据使用zstd压缩,但zstandard未安装")
+            return self._zstd_decompressor.decompress(payload)
+        if compression == COMPRESSION_ZLIB:
+            return zlib.decompress(payload)
+        if compression == COMPRESSION_NONE:
+            return payload
+        raise ValueError(f"未知的压缩算法ID: {compression}")
+
+
+# 全局编解码器实例
+cache_codec = CacheCodec(
+    serializer=os.environ.get('CACHE_CODEC_SERIALIZER', 'auto'),
+    compression=os.environ.get('CACHE_CODEC_COMPRESSION', 'auto')
+)
+
+
+# 便捷函数(供外部直接调用)
+def encode(data: Any) -> bytes:
+    """编码数据(便捷函数)"""
+    return cache_codec.encode(data)
+
+
+def decode(raw: Any) -> Any:
+    """解码数据(便捷函数)"""
+    return cache_codec.decode(raw)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+搜索缓存本地磁盘层
+基于SQLite的键值文件,在Redis未配置或不可用时继续提供缓存的搜索结果,
+避免Redis故障期间PubMed请求量成倍增加
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Optional, Dict, List, Any
+
+from cache_codec import cache_codec
+
+
+DEFAULT_DISK_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'search_cache.db')
+
+
+class DiskCacheStore:
+    """
+    SQLite磁盘缓存存储
+
+    与Redis层使用相同的数据结构: 检索词摘要下的多个条目(变体) + 按PMID共享的文章记录。
+    每行记录硬过期时间、字节数和最近访问时间;写入后超出容量时先删除过期行,
+    再按最近访问时间淘汰(LRU)。
+
+    读取不写库: 条目和文章的访问时间先记在进程内,随下一次写入(或积累到ACCESS_FLUSH_MAX条)
+    批量更新;已用字节数由触发器维护在usage表中,写入时不再全表汇总
+    """
+
+    # 超出容量时淘汰到容量的比例,避免每次写入都触发淘汰
+    EVICT_TARGET_RATIO = 0.9
+    # 进程内积累的访问时间条数达到上限时在读取路径上写回一次
+    ACCESS_FLUSH_MAX = 1000
+
+    def __init__(self, path: str = DEFAULT_DISK_CACHE_PATH, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._variant_access: Dict[str, float] = {}
+        self._article_access: Dict[str, float] = {}
+
+    # ==================== 条目 ====================
+
+    def load_variants(self, digest: str, include_expired: bool = False) -> Dict[str, Dict[str, Any]]:
+        """读取检索词下的全部条目"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                "SELECT field, data, expires_at FROM variants WHERE digest = ?", (digest,)
+            ).fetchall()
+            if rows:
+                self._variant_access[digest] = now
+                self._maybe_flush_access(conn)
+
+        variants = {}
+        for field, data, expires_at in rows:
+            if not include_expired and expires_at <= now:
+                continue
+            try:
+                variants[field] = cache_codec.decode(data)
+            except ValueError:
+                continue
+        return variants
+
+    def save_variant(
+        self,
+        digest: str,
+        field: str,
+        variant: Dict[str, Any],
+        remove_fields: List[str],
+        articles: Optional[List[Dict[str, Any]]] = None
+    ) -> None:
+        """
+        写入条目(含PMID列表)及其文章记录,并删除被覆盖的旧条目
+
+        Args:
+            digest: 检索词摘要
+            field: 条目字段名
+            variant: 条目数据
+            remove_fields: 需要删除的旧条目字段名
+            articles: 文章记录,可选
+        """
+        now = time.time()
+        expires_at = variant['expires_at']
+        data = cache_codec.encode(variant)
+
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                self._write_access(conn)
+                if remove_fields:
+                    conn.executemany(
+                        "DELETE FROM variants WHERE digest = ? AND field = ?",
+                        [(digest, name) for name in remove_fields]
+                    )
+                # 使用UPSERT而不是INSERT OR REPLACE,使字节数触发器按UPDATE计算差值
+                conn.execute(
+                    "INSERT INTO variants (digest, field, data, expires_at, size, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(digest, field) DO UPDATE SET data = excluded.data, "
+                    "expires_at = excluded.expires_at, size = excluded.size, last_access = excluded.last_access",
+                    (digest, field, data, expires_at, len(data), now)
+                )
+                if articles:
+                    rows = []
+                    for article in articles:
+                        encoded = cache_codec.encode(article)
+                        rows.append((str(article.get('pmid')), encoded, expires_at, len(encoded), now))
+                    # 已存在的文章记录只延长有效期
+                    conn.executemany(
+                        "INSERT INTO articles (pmid, data, expires_at, size, last_access) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(pmid) DO UPDATE SET expires_at = MAX(expires_at, excluded.expires_at), "
+                        "last_access = excluded.last_access",
+                        rows
+                    )
+            self._evict_if_needed(conn)
+
+    def get_articles(self, pmids: List[str]) -> Optional[List[Dict[str, Any]]]:
+        """按PMID读取文章记录,任一记录缺失或过期时返回None"""
+        if not pmids:
+            return []
+
+        now = time.time()
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            # SQLite单条语句的参数数量有限,分批查询
+            for start in range(0, len(pmids), 500):
+                batch = pmids[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                for pmid, data in conn.execute(
+                    f"SELECT pmid, data FROM articles WHERE pmid IN ({placeholders}) AND expires_at > ?",
+                    (*batch, now)
+                ):
+                    found[pmid] = data
+            for pmid in found:
+                self._article_access[pmid] = now
+            self._maybe_flush_access(conn)
+
+        if len(found) < len(set(pmids)):
+            return None
+        return [cache_codec.decode(found[pmid]) for pmid in pmids]
+
+    def delete_variants(self, digest: str, fields: Optional[List[str]] = None) -> int:
+        """删除检索词的指定条目(fields为None时删除全部)"""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                if fields is None:
+                    cursor = conn.execute("DELETE FROM variants WHERE digest = ?", (digest,))
+                else:
+                    cursor = conn.executemany(
+                        "DELETE FROM variants WHERE digest = ? AND field = ?",
+                        [(digest, name) for name in fields]
+                    )
+            return cursor.rowcount
+
+    def clear(self) -> int:
+        """清空磁盘缓存"""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                deleted = conn.execute("DELETE FROM variants").rowcount
+                deleted += conn.execute("DELETE FROM articles").rowcount
+            return deleted
+
+    def get_stats(self) -> Dict[str, Any]:
+        """磁盘缓存统计"""
+        with self._lock:
+            conn = self._connection()
+            variant_count = conn.execute("SELECT COUNT(*) FROM variants").fetchone()[0]
+            article_count = conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+            used = self._used_bytes(conn)
+        return {
+            'path': self.path,
+            'variant_count': variant_count,
+            'article_count': article_count,
+            'used_bytes': used,
+            'max_bytes': self.max_bytes
+        }
+
+    # ==================== 私有辅助方法 ====================
+
+    def _connection(self) -> sqlite3.Connection:
+        """获取当前进程的数据库连接(fork后的子进程重新连接,调用方需持有锁)"""
+        pid = os.getpid()
+        if self._conn is not None and self._conn_pid == pid:
+            return self._conn
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS variants (
+                digest TEXT NOT NULL,
+                field TEXT NOT NULL,
+                data BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (digest, field)
+            );
+            CREATE TABLE IF NOT EXISTS articles (
+                pmid TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_variants_last_access ON variants (last_access);
+            CREATE INDEX IF NOT EXISTS idx_variants_expires_at ON variants (expires_at);
+            CREATE INDEX IF NOT EXISTS idx_articles_last_access ON articles (last_access);
+            CREATE INDEX IF NOT EXISTS idx_articles_expires_at ON articles (expires_at);
+
+            -- 两张表的总字节数,由触发器随增删改维护(首次创建时按现有数据汇总一次)
+            CREATE TABLE IF NOT EXISTS usage (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                bytes INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO usage (id, bytes) SELECT 1,
+                (SELECT COALESCE(SUM(size), 0) FROM variants) + (SELECT COALESCE(SUM(size), 0) FROM articles);
+            CREATE TRIGGER IF NOT EXISTS variants_usage_insert AFTER INSERT ON variants
+                BEGIN UPDATE usage SET bytes = bytes + NEW.size WHERE id = 1; END;
+            CREATE TRIGGER IF NOT EXISTS variants_usage_delete AFTER DELETE ON variants
+                BEGIN UPDATE usage SET bytes = bytes - OLD.size WHERE id = 1; END;
+            CREATE TRIGGER IF NOT EXISTS variants_usage_update AFTER UPDATE OF size ON variants
+                BEGIN UPDATE usage SET bytes = bytes + NEW.size - OLD.size WHERE id = 1; END;
+            CREATE TRIGGER IF NOT EXISTS articles_usage_insert AFTER INSERT ON articles
+                BEGIN UPDATE usage SET bytes = bytes + NEW.size WHERE id = 1; END;
+            CREATE TRIGGER IF NOT EXISTS articles_usage_delete AFTER DELETE ON articles
+                BEGIN UPDATE usage SET bytes = bytes - OLD.size WHERE id = 1; END;
+            CREATE TRIGGER IF NOT EXISTS articles_usage_update AFTER UPDATE OF size ON articles
+                BEGIN UPDATE usage SET bytes = bytes + NEW.size - OLD.size WHERE id = 1; END;
+        """)
+        self._conn = conn
+        self._conn_pid = pid
+        self._variant_access = {}
+        self._article_access = {}
+        return conn
+
+    @staticmethod
+    def _used_bytes(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT bytes FROM usage WHERE id = 1").fetchone()[0]
+
+    def _write_access(self, conn: sqlite3.Connection) -> None:
+        """批量写回进程内记录的访问时间(调用方需持有锁并在事务中调用)"""
+        if self._variant_access:
+            conn.executemany(
+                "UPDATE variants SET last_access = MAX(last_access, ?) WHERE digest = ?",
+                [(accessed, digest) for digest, accessed in self._variant_access.items()]
+            )
+            self._variant_access = {}
+        if self._article_access:
+            conn.executemany(
+                "UPDATE articles SET last_access = MAX(last_access, ?) WHERE pmid = ?",
+                [(accessed, pmid) for pmid, accessed in self._article_access.items()]
+            )
+            self._article_access = {}
+
+    def _maybe_flush_access(self, conn: sqlite3.Connection) -> None:
+        """访问时间积累过多时写回(调用方需持有锁)"""
+        if len(self._variant_access) + len(self._article_access) < self.ACCESS_FLUSH_MAX:
+            return
+        try:
+            with conn:
+                self._write_access(conn)
+        except sqlite3.Error as e:
+            # 写锁被其他进程占用时留到下一次写入
+            logging.warning(f"[磁盘缓存] 写回访问时间失败: {e}")
+
+    def _evict_if_needed(self, conn: sqlite3.Connection) -> None:
+        """超出容量时删除过期行,仍超出则按最近访问时间淘汰(调用方需持有锁)"""
+        used = self._used_bytes(conn)
+        if used <= self.max_bytes:
+            return
+
+        now = time.time()
+        with conn:
+            conn.execute("DELETE FROM variants WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM articles WHERE expires_at <= ?", (now,))
+
+            target = int(self.max_bytes * self.EVICT_TARGET_RATIO)
+            used = self._used_bytes(conn)
+            evicted = 0
+            while used > target:
+                # 每轮淘汰两张表中最久未访问的一批行
+                batch = conn.execute(
+                    "SELECT 'variants', rowid, size, last_access FROM variants "
+                    "UNION ALL SELECT 'articles', rowid, size, last_access FROM articles "
+                    "ORDER BY last_access LIMIT 200"
+                ).fetchall()
+                if not batch:
+                    break
+                for table, rowid, size, _ in batch:
+                    conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (rowid,))
+                    used -= size
+                    evicted += 1
+                    if used <= target:
+                        break
+
+        logging.info(f"[磁盘缓存淘汰] 删除 {evicted} 行,当前约 {used} 字节")
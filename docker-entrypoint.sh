@@ -108,7 +108,7 @@ rm -rf /app/instance
 if [ "$RQ_MODE" = "enabled" ]; then
     log_info "RQ任务队列模式已启用"
     log_info "Worker名称: ${RQ_WORKER_NAME:-default-worker}"
-    log_info "监听队列: ${RQ_QUEUES:-high,default,low}"
+    log_info "监听队列: ${RQ_QUEUES:-high,push_send,push_render,push_enrich,push_fetch,default,low}"
 
     # 容器启动时总是清理调度标记(确保重启后自动恢复订阅)
     RQ_SCHEDULE_FLAG="/app/data/rq_schedule_init_done"
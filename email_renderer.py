@@ -0,0 +1,553 @@
+# -*- coding: utf-8 -*-
+"""
+推送邮件渲染
+邮件布局和文章卡片使用预编译的Jinja模板,文章卡片(HTML/纯文本/速览条目)
+按文章缓存渲染结果,同一篇文章推送给多个用户时只渲染一次;
+每封邮件只渲染收件人相关的头部、问候语和底部
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from jinja2 import Environment
+
+
+# 文章序号在不同邮件中不同,缓存的片段中使用占位符,拼接时替换
+INDEX_PLACEHOLDER = '\x00ARTICLE_INDEX\x00'
+
+EMAIL_LAYOUT_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>PubMed文献推送</title>
+    <style>
+        /* 基础样式 */
+        * { box-sizing: border-box; }
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif;
+            margin: 0;
+            padding: 15px;
+            background-color: #f8f9fa;
+            line-height: 1.5;
+            color: #212529;
+        }
+
+        /* 容器样式 */
+        .container {
+            max-width: 800px;
+            margin: 0 auto;
+            background-color: white;
+            border-radius: 12px;
+            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+            overflow: hidden;
+        }
+
+        /* 头部样式 */
+        .header {
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            padding: 30px 20px;
+            text-align: center;
+        }
+        .header h1 {
+            margin: 0 0 10px 0;
+            font-size: 28px;
+            font-weight: 600;
+        }
+        .header p {
+            margin: 0;
+            font-size: 16px;
+            opacity: 0.9;
+        }
+
+        /* 内容区域 */
+        .content {
+            padding: 30px 20px;
+        }
+        .greeting {
+            font-size: 16px;
+            margin-bottom: 25px;
+            color: #495057;
+        }
+
+        /* 简介汇总样式 */
+        .brief-summary {
+            background: linear-gradient(135deg, #fff3cd 0%, #ffeaa7 100%);
+            border: 1px solid #ffeaa7;
+            border-radius: 12px;
+            padding: 20px;
+            margin-bottom: 30px;
+            box-shadow: 0 3px 6px rgba(255, 193, 7, 0.1);
+        }
+        .summary-title {
+            font-size: 18px;
+            font-weight: 600;
+            color: #856404;
+            margin-bottom: 15px;
+            text-align: center;
+        }
+        .summary-content {
+            font-size: 14px;
+            line-height: 1.8;
+            color: #6c5f00;
+            text-align: left;
+        }
+
+        /* 文章样式 */
+        .article {
+            border: 1px solid #e9ecef;
+            border-radius: 8px;
+            padding: 20px;
+            margin-bottom: 20px;
+            background-color: #fff;
+            box-shadow: 0 2px 4px rgba(0, 0, 0, 0.05);
+        }
+        .article:last-child {
+            margin-bottom: 0;
+        }
+
+        /* 序号和标题 */
+        .article-header {
+            display: flex;
+            align-items: flex-start;
+            margin-bottom: 15px;
+        }
+        .article-number {
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            font-weight: bold;
+            padding: 8px 12px;
+            border-radius: 20px;
+            min-width: 35px;
+            text-align: center;
+            margin-right: 15px;
+            flex-shrink: 0;
+            font-size: 14px;
+        }
+        .title {
+            font-size: 18px;
+            font-weight: 600;
+            color: #2c3e50;
+            margin: 0;
+            line-height: 1.4;
+        }
+        .title a {
+            color: #2c3e50;
+            text-decoration: none;
+        }
+        .title a:hover {
+            color: #667eea;
+        }
+
+        /* 期刊信息 */
+        .journal-info {
+            margin: 15px 0;
+            padding: 15px;
+            background-color: #f8f9fa;
+            border-radius: 6px;
+        }
+        .journal-name {
+            font-weight: 600;
+            color: #495057;
+            font-size: 15px;
+            margin-bottom: 8px;
+        }
+
+        /* 质量标签 */
+        .quality-badges {
+            margin: 10px 0;
+        }
+        .quality-badge {
+            display: inline-block;
+            padding: 6px 12px;
+            border-radius: 20px;
+            font-size: 12px;
+            font-weight: 600;
+            margin: 2px 5px 2px 0;
+            white-space: nowrap;
+        }
+        .jcr-quartile {
+            background-color: #e3f2fd;
+            color: #1565c0;
+        }
+        .impact-factor {
+            background-color: #f3e5f5;
+            color: #7b1fa2;
+        }
+        .cas-category {
+            background-color: #e8f5e8;
+            color: #2e7d32;
+        }
+        .top-journal {
+            background-color: #fff3e0;
+            color: #f57c00;
+            border: 1px solid #ffcc02;
+        }
+
+        /* 摘要样式 */
+        .abstract-section {
+            margin: 20px 0;
+        }
+        .abstract-title {
+            font-weight: 600;
+            color: #495057;
+            font-size: 14px;
+            margin-bottom: 8px;
+            border-left: 4px solid #667eea;
+            padding-left: 10px;
+        }
+        .abstract-content {
+            color: #6c757d;
+            font-size: 14px;
+            line-height: 1.6;
+            padding: 12px;
+            background-color: #f8f9fa;
+            border-radius: 6px;
+            border: 1px solid #e9ecef;
+        }
+        .chinese-abstract {
+            background-color: #fff8e1;
+            border: 1px solid #ffecb3;
+        }
+
+        /* 底部样式 */
+        .footer {
+            text-align: center;
+            padding: 30px 20px;
+            background-color: #f8f9fa;
+            color: #6c757d;
+            font-size: 13px;
+            line-height: 1.5;
+        }
+        .footer p {
+            margin: 5px 0;
+        }
+
+        /* 移动端适配 */
+        @media only screen and (max-width: 600px) {
+            body { padding: 10px; }
+            .container { border-radius: 8px; }
+            .header { padding: 20px 15px; }
+            .header h1 { font-size: 24px; }
+            .content { padding: 20px 15px; }
+            .brief-summary { padding: 15px; margin-bottom: 20px; }
+            .summary-title { font-size: 16px; }
+            .summary-content { font-size: 13px; line-height: 1.6; }
+            .article { padding: 15px; }
+            .article-header { flex-direction: column; align-items: flex-start; }
+            .article-number { margin-bottom: 10px; margin-right: 0; }
+            .title { font-size: 16px; }
+            .quality-badge { margin: 2px 3px 2px 0; font-size: 11px; padding: 4px 8px; }
+            .abstract-content { font-size: 13px; padding: 10px; }
+        }
+
+        /* 超小屏幕适配 */
+        @media only screen and (max-width: 480px) {
+            body { padding: 5px; }
+            .header { padding: 15px 10px; }
+            .header h1 { font-size: 22px; }
+            .content { padding: 15px 10px; }
+            .article { padding: 12px; }
+            .title { font-size: 15px; }
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>📚 PubMed 文献推送</h1>
+            <p>为您推送 {{ count }} 篇最新文献</p>
+        </div>
+
+        <div class="content">
+            <div class="greeting">
+                <p>亲爱的用户，</p>
+                <p>{% if keywords %}您设置的<strong>{{ keywords }}</strong>主题词，{% endif %}我们为您找到了以下最新的学术文献：</p>
+            </div>
+{% if briefs %}
+            <div class="brief-summary">
+                <div class="summary-title">📋 文献速览（按序号查看下方详情）</div>
+                <div class="summary-content">
+                    {{ briefs }}
+                </div>
+            </div>
+{% endif %}
+{{ cards }}
+        </div>
+
+        <div class="footer">
+            <p><strong>此邮件由 PubMed Literature Push 自动发送，请勿回复。</strong></p>
+            <p>如需修改推送设置，请登录系统管理后台</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+ARTICLE_CARD_HTML = """
+            <div class="article" id="article-{{ index }}">
+                <div class="article-header">
+                    <div class="article-number">第{{ index }}篇</div>
+                    <h3 class="title">
+                        <a href="{{ article.pubmed_url or '#' }}" target="_blank">
+                            {{ article.title or '未知标题' }}
+                        </a>
+                    </h3>
+                </div>
+
+                <div class="journal-info">
+                    <div class="journal-name">
+                        📖 {{ article.journal or '未知期刊' }}
+                    </div>
+{% if publish_date %}
+                    <div style="color: #6c757d; font-size: 13px; margin-top: 5px;">📅 发表日期: {{ publish_date }}</div>
+{% endif %}
+{% if issn_parts %}
+                    <div style="color: #6c757d; font-size: 13px; margin-top: 5px;">📝 {{ issn_parts | join(' • ') }}</div>
+{% endif %}
+{% if quality.jcr_quartile or quality.jcr_if or quality.zky_category %}
+                    <div class="quality-badges">
+{%- if quality.jcr_quartile %}<span class="quality-badge jcr-quartile">JCR {{ quality.jcr_quartile }}</span>{% endif %}
+{%- if quality.jcr_if %}<span class="quality-badge impact-factor">IF {{ quality.jcr_if }}</span>{% endif %}
+{%- if quality.zky_category %}
+{%- if quality.zky_top == '是' %}<span class="quality-badge top-journal">{{ quality.zky_category }}区 Top</span>
+{%- else %}<span class="quality-badge cas-category">中科院 {{ quality.zky_category }}区</span>{% endif %}
+{%- endif -%}
+                    </div>
+{% endif %}
+                </div>
+{% if article.abstract %}
+                <div class="abstract-section">
+                    <div class="abstract-title">📄 英文摘要</div>
+                    <div class="abstract-content">{{ article.abstract }}</div>
+                </div>
+{% if translation %}
+                <div class="abstract-section">
+                    <div class="abstract-title">📝 中文摘要</div>
+                    <div class="abstract-content chinese-abstract">{{ translation }}</div>
+                </div>
+{% endif %}
+{% endif %}
+            </div>
+"""
+
+BRIEF_ITEM_HTML = """
+                    <div style="padding: 12px 0; border-bottom: 1px solid #ffeaa7;">
+                        <div style="margin-bottom: 8px;">
+                            <span style="display: inline-block; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; font-weight: bold; padding: 4px 12px; border-radius: 6px; margin-right: 10px; font-size: 14px; min-width: 30px; text-align: center;">第{{ index }}篇</span>
+                            <span style="color: #2c3e50; font-size: 14px; font-weight: 600;">{{ article.title or '未知标题' }}</span>
+                        </div>
+                        <div style="color: #495057; font-size: 15px; line-height: 1.6; margin-left: 0px; padding-left: 0px;">
+                            {{ article.brief_intro }}
+                        </div>
+                    </div>
+"""
+
+# 摘要邮件中每个订阅关键词的分节标题
+SECTION_HEADER_HTML = """
+            <div class="section-header" style="margin: 30px 0 15px; padding: 10px 15px; border-left: 4px solid #667eea; background-color: #f8f9fa; font-size: 18px; font-weight: 600; color: #2c3e50;">
+                🔍 {{ keywords }}（{{ count }} 篇）
+            </div>
+"""
+
+SECTION_HEADER_TEXT = """【{{ keywords }}】{{ count }} 篇
+----------------------------------------
+"""
+
+EMAIL_LAYOUT_TEXT = """PubMed 文献推送
+
+{% if keywords %}您设置的{{ keywords }}主题词，{% endif %}我们为您找到了以下最新的学术文献：
+
+{% if briefs %}📋 今日推送文献简介
+========================================
+{{ briefs }}========================================
+
+{% endif %}{{ cards }}此邮件由 PubMed Literature Push 自动发送，请勿回复。
+"""
+
+ARTICLE_CARD_TEXT = """{{ index }}. {{ article.title or '未知标题' }}
+   期刊: {{ article.journal or '未知期刊' }}{% if publish_date %} • {{ publish_date }}{% endif %}
+{% if issn_parts %}   {{ issn_parts | join(' • ') }}
+{% endif %}{% if quality_info %}   期刊质量: {{ quality_info | join(' | ') }}
+{% endif %}   链接: {{ article.pubmed_url or '#' }}
+{% if article.abstract %}   英文摘要: {{ article.abstract }}
+{% if translation %}   中文摘要: {{ translation }}
+{% endif %}{% endif %}
+"""
+
+BRIEF_ITEM_TEXT = """{{ index }}、{{ article.title or '未知标题' }}：{{ article.brief_intro }}
+
+"""
+
+
+class PushEmailRenderer:
+    """
+    推送邮件渲染器
+
+    文章卡片片段按 (格式, 文章ID, 期刊数据版本, ISSN, AI字段摘要) 缓存,
+    AI翻译/简介生成或期刊数据重新加载后自动失效;超出容量时淘汰最久未使用的片段
+    """
+
+    def __init__(
+        self,
+        journal_quality: Callable[[str], Dict[str, Any]],
+        journal_version: Callable[[], Any],
+        max_fragments: int = 5000
+    ):
+        """
+        Args:
+            journal_quality: 按ISSN查询期刊质量信息的函数
+            journal_version: 返回期刊数据版本(重新加载后变化)的函数
+            max_fragments: 片段缓存容量,为0时不缓存
+        """
+        self.journal_quality = journal_quality
+        self.journal_version = journal_version
+        self.max_fragments = max_fragments
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        # 邮件内容沿用原有拼接方式,不做HTML转义(标题和摘要中的PubMed标记原样输出)
+        env = Environment(autoescape=False, keep_trailing_newline=True)
+        self._templates = {
+            'layout_html': env.from_string(EMAIL_LAYOUT_HTML),
+            'card_html': env.from_string(ARTICLE_CARD_HTML),
+            'brief_html': env.from_string(BRIEF_ITEM_HTML),
+            'layout_text': env.from_string(EMAIL_LAYOUT_TEXT),
+            'card_text': env.from_string(ARTICLE_CARD_TEXT),
+            'brief_text': env.from_string(BRIEF_ITEM_TEXT),
+            'section_html': env.from_string(SECTION_HEADER_HTML),
+            'section_text': env.from_string(SECTION_HEADER_TEXT),
+        }
+
+    def render_html(self, articles: List[Any], keywords: Optional[str] = None,
+                    sections: Optional[List[Tuple[str, List[Any]]]] = None) -> str:
+        """渲染HTML邮件,sections为 [(关键词, 文章列表), ...] 时按关键词分节(摘要邮件)"""
+        return self._render('html', articles, keywords, sections)
+
+    def render_text(self, articles: List[Any], keywords: Optional[str] = None,
+                    sections: Optional[List[Tuple[str, List[Any]]]] = None) -> str:
+        """渲染纯文本邮件,sections含义同render_html"""
+        return self._render('text', articles, keywords, sections)
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'fragments': len(self._fragments),
+            'max_fragments': self.max_fragments,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._fragments.clear()
+
+    # ==================== 私有辅助方法 ====================
+
+    def _render(self, fmt: str, articles: List[Any], keywords: Optional[str],
+                sections: Optional[List[Tuple[str, List[Any]]]] = None) -> str:
+        briefs = []
+        cards = []
+        # 分节时文章序号跨分节连续,与文献速览中的序号对应
+        index = 0
+        for section_keywords, section_articles in sections or [(None, articles)]:
+            if section_keywords is not None:
+                cards.append(self._templates['section_' + fmt].render(
+                    keywords=section_keywords, count=len(section_articles)
+                ))
+            for article in section_articles:
+                index += 1
+                if getattr(article, 'brief_intro', None):
+                    briefs.append(self._fragment('brief_' + fmt, article).replace(INDEX_PLACEHOLDER, str(index)))
+                cards.append(self._fragment('card_' + fmt, article).replace(INDEX_PLACEHOLDER, str(index)))
+
+        return self._templates['layout_' + fmt].render(
+            count=index,
+            keywords=keywords,
+            briefs=''.join(briefs),
+            cards=''.join(cards)
+        )
+
+    def _fragment(self, kind: str, article: Any) -> str:
+        """读取或渲染文章片段"""
+        key = self._fragment_key(kind, article)
+        if key is not None:
+            with self._lock:
+                fragment = self._fragments.get(key)
+                if fragment is not None:
+                    self._fragments.move_to_end(key)
+                    self.hits += 1
+                    return fragment
+
+        fragment = self._templates[kind].render(self._card_context(kind, article))
+
+        if key is not None and self.max_fragments > 0:
+            with self._lock:
+                self.misses += 1
+                self._fragments[key] = fragment
+                while len(self._fragments) > self.max_fragments:
+                    self._fragments.popitem(last=False)
+        return fragment
+
+    def _fragment_key(self, kind: str, article: Any):
+        """未入库的文章(没有ID)不缓存"""
+        article_id = getattr(article, 'id', None)
+        if article_id is None or self.max_fragments <= 0:
+            return None
+        ai_state = hashlib.md5(
+            f"{self._translation(article) or ''}\x00{getattr(article, 'brief_intro', None) or ''}".encode('utf-8')
+        ).hexdigest()
+        return (
+            kind, article_id, self.journal_version(),
+            getattr(article, 'issn', None), getattr(article, 'eissn', None), ai_state
+        )
+
+    def _card_context(self, kind: str, article: Any) -> Dict[str, Any]:
+        context = {'index': INDEX_PLACEHOLDER, 'article': article}
+        if kind.startswith('brief'):
+            return context
+
+        issn = getattr(article, 'issn', '') or getattr(article, 'eissn', '')
+        quality = self.journal_quality(issn) if issn else {}
+
+        quality_info = []
+        if quality.get('jcr_quartile'):
+            quality_info.append(f"JCR {quality['jcr_quartile']}")
+        if quality.get('jcr_if'):
+            quality_info.append(f"IF {quality['jcr_if']}")
+        if quality.get('zky_category'):
+            if quality.get('zky_top') == '是':
+                quality_info.append(f"中科院 {quality['zky_category']}区 Top")
+            else:
+                quality_info.append(f"中科院 {quality['zky_category']}区")
+
+        publish_date = getattr(article, 'publish_date', None)
+        if publish_date:
+            publish_date = publish_date.strftime('%Y-%m-%d')
+        else:
+            publish_date = getattr(article, 'pub_date', None)
+
+        context.update({
+            'quality': quality,
+            'quality_info': quality_info,
+            'publish_date': publish_date,
+            'issn_parts': [
+                part for part in (
+                    f"ISSN: {article.issn}" if getattr(article, 'issn', None) else None,
+                    f"eISSN: {article.eissn}" if getattr(article, 'eissn', None) else None
+                ) if part
+            ],
+            'translation': self._translation(article)
+        })
+        return context
+
+    @staticmethod
+    def _translation(article: Any) -> Optional[str]:
+        return getattr(article, 'abstract_translation', None) or getattr(article, 'abstract_cn', None)
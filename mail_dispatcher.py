@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+邮件配额调度器
+各发件邮箱的今日发送量和最后使用时间保存在Redis哈希中,通过Lua脚本原子地预占配额,
+多个Worker并发发送时不会超出每日限制,也不再为每封邮件查询并提交MailConfig。
+
+一批邮件按各邮箱剩余配额加权分配,每个邮箱在独立线程中通过SMTP连接池的同一会话发送;
+Redis中的计数定期(PERSIST_INTERVAL)写回数据库,用于后台展示和Redis数据丢失后的恢复
+"""
+
+import random
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from smtp_pool import smtp_pool, build_message, settings_from_config
+
+
+# 一个可用的发件邮箱: sent_today 为数据库中记录的今日发送量,仅用于当天首次使用时初始化Redis计数
+MailAccount = namedtuple('MailAccount', ['config_id', 'name', 'sender', 'daily_limit', 'sent_today', 'settings'])
+
+# 一封待发送邮件
+OutgoingMail = namedtuple('OutgoingMail', ['to_email', 'subject', 'html_body', 'text_body'])
+
+# 发送结果: account 为实际使用的邮箱名称,未分配到邮箱时为None
+DispatchResult = namedtuple('DispatchResult', ['success', 'account', 'error'])
+
+
+def account_from_config(config, sent_today: int) -> MailAccount:
+    """根据MailConfig生成发件邮箱(在请求线程中读取ORM属性,发送线程只使用普通对象)"""
+    return MailAccount(
+        config.id, config.name, config.from_email or config.username,
+        config.daily_limit or 0, sent_today, settings_from_config(config)
+    )
+
+
+class MailQuotaDispatcher:
+    """按剩余配额在多个发件邮箱之间并行分发邮件"""
+
+    QUOTA_PREFIX = "pubmed:mail_quota"             # 按日期的哈希: 配置ID -> 今日已发送数量
+    LAST_USED_KEY = "pubmed:mail_quota:last_used"  # 哈希: 配置ID -> 最后使用时间
+    PERSIST_LOCK_KEY = "pubmed:mail_quota:persist_lock"
+    QUOTA_TTL = 3 * 24 * 3600
+
+    # 当天首次使用时用数据库计数初始化,再在不超过每日限制的前提下预占最多ARGV[3]个名额,返回实际预占数
+    RESERVE_SCRIPT = """
+    redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[5])
+    local used = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+    local granted = math.min(tonumber(ARGV[3]), tonumber(ARGV[2]) - used)
+    if granted <= 0 then
+        return 0
+    end
+    redis.call('HINCRBY', KEYS[1], ARGV[1], granted)
+    redis.call('EXPIRE', KEYS[1], ARGV[6])
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[4])
+    return granted
+    """
+
+    def __init__(
+        self,
+        redis_connection,
+        clock: Callable[[], datetime] = datetime.now,
+        max_parallel: int = 4,
+        persist_interval: int = 60
+    ):
+        self.redis = redis_connection
+        self.clock = clock
+        self.max_parallel = max_parallel
+        self.persist_interval = persist_interval
+        self._reserve_script = redis_connection.register_script(self.RESERVE_SCRIPT)
+
+    def dispatch(self, accounts: List[MailAccount], mails: List[OutgoingMail],
+                 sender_name: Optional[str] = None) -> List[DispatchResult]:
+        """
+        发送一批邮件
+
+        先按剩余配额为每个邮箱分配份额并原子预占,再按邮箱并行发送;
+        发送失败的邮件退回预占的配额
+
+        Returns:
+            与mails一一对应的发送结果
+
+        Raises:
+            redis异常: 无法读取或预占配额时由调用方降级处理
+        """
+        if not mails:
+            return []
+        if not accounts:
+            return [DispatchResult(False, None, '没有可用的邮件配置')] * len(mails)
+
+        assignments = self._reserve(accounts, len(mails))
+
+        # 按分配顺序切分邮件,未分到配额的邮件直接失败
+        batches: List[Tuple[MailAccount, List[int]]] = []
+        results: List[Optional[DispatchResult]] = [None] * len(mails)
+        cursor = 0
+        for account, count in assignments:
+            batches.append((account, list(range(cursor, cursor + count))))
+            cursor += count
+        for index in range(cursor, len(mails)):
+            results[index] = DispatchResult(False, None, '所有邮箱今日发送量已达上限')
+
+        def send_batch(batch):
+            account, indexes = batch
+            messages = [
+                build_message(mails[i].subject, account.sender, [mails[i].to_email],
+                              mails[i].html_body, mails[i].text_body, sender_name=sender_name)
+                for i in indexes
+            ]
+            return account, indexes, smtp_pool.send_many(account.settings, messages)
+
+        if len(batches) == 1:
+            outcomes = [send_batch(batches[0])]
+        elif batches:
+            with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(batches))) as executor:
+                outcomes = list(executor.map(send_batch, batches))
+        else:
+            outcomes = []
+
+        for account, indexes, errors in outcomes:
+            failed = 0
+            for index, error in zip(indexes, errors):
+                if error is None:
+                    results[index] = DispatchResult(True, account.name, None)
+                else:
+                    failed += 1
+                    results[index] = DispatchResult(False, account.name, str(error))
+            if failed:
+                self._refund(account, failed)
+        return results
+
+    def get_counts(self, accounts: List[MailAccount]) -> Dict[int, int]:
+        """各邮箱今日已发送数量(Redis中没有记录时使用数据库计数)"""
+        raw = self.redis.hmget(self._quota_key(), [account.config_id for account in accounts])
+        return {
+            account.config_id: int(value) if value is not None else account.sent_today
+            for account, value in zip(accounts, raw)
+        }
+
+    def maybe_persist(self, persist: Callable[[Dict[int, int], Dict[int, datetime]], None]) -> bool:
+        """
+        距上次写回超过PERSIST_INTERVAL时把计数写回数据库
+
+        多个Worker之间通过SET NX锁保证每个间隔只写回一次
+
+        Args:
+            persist: 接收 {配置ID: 今日发送量} 和 {配置ID: 最后使用时间} 的写回函数
+        """
+        try:
+            if not self.redis.set(self.PERSIST_LOCK_KEY, 1, nx=True, ex=self.persist_interval):
+                return False
+            counts = self._decode_hash(self.redis.hgetall(self._quota_key()))
+            last_used = {
+                config_id: datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+                for config_id, value in self._decode_hash(self.redis.hgetall(self.LAST_USED_KEY), int_values=False).items()
+            }
+            if counts or last_used:
+                persist({key: int(value) for key, value in counts.items()}, last_used)
+            return True
+        except Exception as e:
+            logging.warning(f"[邮件配额] 写回发送计数失败: {e}")
+            return False
+
+    # ==================== 私有辅助方法 ====================
+
+    def _quota_key(self) -> str:
+        return f"{self.QUOTA_PREFIX}:{self.clock().strftime('%Y%m%d')}"
+
+    def _reserve(self, accounts: List[MailAccount], total: int) -> List[Tuple[MailAccount, int]]:
+        """按剩余配额加权分配total封邮件并原子预占,预占不足(被其他Worker抢先)时把差额分给其他邮箱"""
+        counts = self.get_counts(accounts)
+        remaining = {
+            account.config_id: max(0, account.daily_limit - counts[account.config_id])
+            for account in accounts
+        }
+        granted: Dict[int, int] = {}
+        pending = total
+        # 第一轮按份额预占,第二轮把差额按剩余配额补到其他邮箱
+        for _ in range(2):
+            candidates = [account for account in accounts if remaining[account.config_id] > 0]
+            if pending <= 0 or not candidates:
+                break
+            shares = self._allocate(candidates, remaining, pending)
+            for account in candidates:
+                wanted = shares.get(account.config_id, 0)
+                if wanted <= 0:
+                    continue
+                got = int(self._reserve_script(
+                    keys=[self._quota_key(), self.LAST_USED_KEY],
+                    args=[account.config_id, account.daily_limit, wanted,
+                          self.clock().strftime('%Y-%m-%d %H:%M:%S'), account.sent_today, self.QUOTA_TTL]
+                ))
+                granted[account.config_id] = granted.get(account.config_id, 0) + got
+                pending -= got
+                remaining[account.config_id] = remaining[account.config_id] - wanted if got == wanted else 0
+
+        return [(account, granted[account.config_id]) for account in accounts if granted.get(account.config_id)]
+
+    @staticmethod
+    def _allocate(accounts: List[MailAccount], remaining: Dict[int, int], total: int) -> Dict[int, int]:
+        """按剩余配额比例分配,取整后的零头按剩余配额加权随机分配,单封邮件也会分散到各邮箱"""
+        capacity = sum(remaining[account.config_id] for account in accounts)
+        total = min(total, capacity)
+        shares = {
+            account.config_id: total * remaining[account.config_id] // capacity
+            for account in accounts
+        }
+        leftover = total - sum(shares.values())
+        while leftover > 0:
+            spare = [account for account in accounts if remaining[account.config_id] > shares[account.config_id]]
+            chosen = random.choices(spare, weights=[remaining[a.config_id] - shares[a.config_id] for a in spare])[0]
+            shares[chosen.config_id] += 1
+            leftover -= 1
+        return shares
+
+    def _refund(self, account: MailAccount, count: int) -> None:
+        """退回发送失败邮件预占的配额"""
+        try:
+            self.redis.hincrby(self._quota_key(), account.config_id, -count)
+        except Exception as e:
+            logging.warning(f"[邮件配额] 退回 {account.name} 的 {count} 个名额失败: {e}")
+
+    @staticmethod
+    def _decode_hash(raw, int_values: bool = True) -> Dict[int, str]:
+        decoded = {}
+        for name, value in raw.items():
+            name = name.decode('utf-8') if isinstance(name, bytes) else name
+            value = value.decode('utf-8') if isinstance(value, bytes) else value
+            decoded[int(name)] = int(value) if int_values else value
+        return decoded
+
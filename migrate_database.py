@@ -6,6 +6,9 @@
 2. 更新 user 表的 allowed_frequencies 字段（从 'weekly' 更新为 'daily,weekly,monthly'）
 3. 添加邀请码功能表（invite_code 和 invite_code_usage）
 4. 为 mail_config 表添加 from_email 字段
+5. 为 subscription 表添加AI检索式字段
+6. 为 subscription 表添加下次推送时间字段（调度检查按索引查询到期订阅）
+7. 为高频查询添加复合索引，为用户文章关联添加去重唯一索引
 """
 
 import sqlite3
@@ -17,6 +20,67 @@ if sys.platform == 'win32':
     import io
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
+# 高频查询索引: (索引名, 表名, 字段, 是否唯一)
+HOT_PATH_INDEXES = [
+    # 推送去重: 按用户+文章+订阅判断是否已推送，唯一索引防止并发推送重复写入
+    ('uq_user_article_user_article_subscription', 'user_article', ('user_id', 'article_id', 'subscription_id'), True),
+    # 用户首页统计和文章列表: 按用户过滤、按推送时间排序/范围查询
+    ('ix_user_article_user_push_date', 'user_article', ('user_id', 'push_date'), False),
+    # 文章清理和删除订阅时按文章/订阅删除关联
+    ('ix_user_article_article_id', 'user_article', ('article_id',), False),
+    ('ix_user_article_subscription_id', 'user_article', ('subscription_id',), False),
+    # 日志页面按时间倒序、按级别计数、按模块取最近记录，日志清理按时间范围删除
+    ('ix_system_log_timestamp', 'system_log', ('timestamp',), False),
+    ('ix_system_log_level_timestamp', 'system_log', ('level', 'timestamp'), False),
+    ('ix_system_log_module_timestamp', 'system_log', ('module', 'timestamp'), False),
+    # 推送时加载用户的活跃订阅
+    ('ix_subscription_user_active', 'subscription', ('user_id', 'is_active'), False),
+    # 调度检查只取出到期的活跃订阅
+    ('ix_subscription_active_next_push', 'subscription', ('is_active', 'next_push_at'), False),
+]
+
+
+def apply_hot_path_indexes(cursor):
+    """
+    创建高频查询索引（已存在的跳过）
+
+    创建唯一索引前先删除重复的用户文章关联（保留最早的一条）。
+    subscription_id为NULL的旧推送记录不参与去重：唯一索引视NULL为互不相同，这些记录不会冲突
+
+    Returns:
+        tuple: (新建的索引名列表, 删除的重复关联数)
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='index'")
+    existing = {row[0] for row in cursor.fetchall()}
+
+    removed_duplicates = 0
+    if 'uq_user_article_user_article_subscription' not in existing:
+        cursor.execute("""
+            DELETE FROM user_article
+            WHERE subscription_id IS NOT NULL AND id NOT IN (
+                SELECT MIN(id) FROM user_article
+                WHERE subscription_id IS NOT NULL
+                GROUP BY user_id, article_id, subscription_id
+            )
+        """)
+        removed_duplicates = cursor.rowcount
+
+    created = []
+    for name, table, columns, unique in HOT_PATH_INDEXES:
+        if name in existing:
+            continue
+        cursor.execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+        )
+        created.append(name)
+
+    if created:
+        # 更新统计信息，使查询规划器选用新索引
+        cursor.execute("ANALYZE")
+
+    return created, removed_duplicates
+
+
 def migrate_database():
     """执行数据库迁移"""
     # 支持Docker和本地环境
@@ -161,6 +225,50 @@ def migrate_database():
         else:
             print("  [OK] from_email 字段已存在")
 
+        # ==================== 迁移 5: 添加订阅AI检索式字段 ====================
+        print("\n【迁移 5】检查 subscription 表AI检索式字段...")
+
+        cursor.execute("PRAGMA table_info(subscription)")
+        columns = [col[1] for col in cursor.fetchall()]
+
+        ai_query_fields = {
+            'ai_query': 'TEXT',
+            'ai_query_hash': 'VARCHAR(64)',
+            'ai_query_prompt_version': 'VARCHAR(16)',
+            'ai_query_model': 'VARCHAR(120)',
+            'ai_query_generated_at': 'DATETIME'
+        }
+        for field_name, field_def in ai_query_fields.items():
+            if field_name not in columns:
+                print(f"  添加 {field_name} 字段...")
+                cursor.execute(f"ALTER TABLE subscription ADD COLUMN {field_name} {field_def}")
+                print(f"  [OK] {field_name} 字段已添加")
+            else:
+                print(f"  [OK] {field_name} 字段已存在")
+        print("  说明: 现有订阅的AI检索式将在下次推送时生成并保存")
+
+        # ==================== 迁移 6: 添加订阅下次推送时间字段 ====================
+        print("\n【迁移 6】检查 subscription 表下次推送时间字段...")
+
+        if 'next_push_at' not in columns:
+            print("  添加 next_push_at 字段...")
+            cursor.execute("ALTER TABLE subscription ADD COLUMN next_push_at DATETIME")
+            print("  [OK] next_push_at 字段已添加")
+            print("  说明: 现有订阅的下次推送时间将在调度器首次检查时计算")
+        else:
+            print("  [OK] next_push_at 字段已存在")
+
+        # ==================== 迁移 7: 高频查询索引和去重唯一索引 ====================
+        print("\n【迁移 7】检查高频查询索引...")
+
+        created, removed_duplicates = apply_hot_path_indexes(cursor)
+        if removed_duplicates:
+            print(f"  [OK] 删除重复的用户文章关联 {removed_duplicates} 条")
+        for name in created:
+            print(f"  [OK] {name} 索引已创建")
+        if not created:
+            print("  [OK] 索引已存在")
+
         # 提交所有更改
         conn.commit()
 
@@ -173,6 +281,14 @@ def migrate_database():
         print(f"  subscription 表字段数: {len(columns)}")
         print(f"  包含 filter_config: {'filter_config' in columns}")
         print(f"  包含 use_advanced_filter: {'use_advanced_filter' in columns}")
+        print(f"  包含 ai_query: {'ai_query' in columns}")
+        print(f"  包含 next_push_at: {'next_push_at' in columns}")
+
+        # 验证索引
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        index_names = {row[0] for row in cursor.fetchall()}
+        missing_indexes = [name for name, _, _, _ in HOT_PATH_INDEXES if name not in index_names]
+        print(f"  高频查询索引: {len(HOT_PATH_INDEXES) - len(missing_indexes)}/{len(HOT_PATH_INDEXES)}")
 
         # 验证用户推送频率分布
         cursor.execute("""
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+推送摘要合并
+同一用户在合并窗口内到期的多个订阅只发送一封邮件,每个订阅的新文章作为邮件中的一个关键词分节:
+
+- 第一个到期订阅打开摘要,记录窗口内预计到期的其他订阅,并在窗口结束时安排合并发送
+- 之后每个订阅检索完成(无论有无新文章)都向摘要报到,全部报到后立即合并发送,不必等到窗口结束
+- 合并发送时原子地取出并清空摘要,重复的合并任务不会重复发送
+"""
+
+import time
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from cache_codec import cache_codec
+from rq_config import redis_conn
+
+
+class PushDigest:
+    """按用户收集窗口内的订阅推送,合并为一封邮件"""
+
+    ENTRIES_PREFIX = "pubmed:push_digest:entries"    # 列表: 已检索完成、有新文章的订阅分节
+    EXPECTED_PREFIX = "pubmed:push_digest:expected"  # 集合: 尚未报到的订阅ID
+    OPENED_PREFIX = "pubmed:push_digest:opened"      # 摘要打开时间,存在即表示摘要进行中
+    STATS_PREFIX = "pubmed:push_digest:stats"
+    STATS_TTL = 7 * 24 * 3600
+    GRACE_SECONDS = 600                              # 合并任务延迟执行时,摘要数据额外保留的时间
+    LOOKBACK_SECONDS = 300                           # 到期后排队、检索耗时内的订阅仍视为窗口内到期
+
+    # 返回 [是否新打开, 剩余未报到数量]
+    ADD_SCRIPT = """
+    local opened = 0
+    if redis.call('EXISTS', KEYS[3]) == 0 then
+        redis.call('SET', KEYS[3], ARGV[2], 'EX', ARGV[3])
+        redis.call('DEL', KEYS[1], KEYS[2])
+        for i = 5, #ARGV do
+            redis.call('SADD', KEYS[2], ARGV[i])
+        end
+        redis.call('EXPIRE', KEYS[2], ARGV[3])
+        opened = 1
+    end
+    redis.call('SREM', KEYS[2], ARGV[1])
+    if ARGV[4] ~= '' then
+        redis.call('RPUSH', KEYS[1], ARGV[4])
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+    end
+    return {opened, redis.call('SCARD', KEYS[2])}
+    """
+
+    def __init__(self, redis_connection):
+        self.redis = redis_connection
+        self._add_script = redis_connection.register_script(self.ADD_SCRIPT)
+
+    def add(self, user_id: int, subscription_id: int, section: Optional[Dict[str, Any]],
+            expected_ids: List[int], window_seconds: int) -> Dict[str, Any]:
+        """
+        订阅检索完成后向用户摘要报到
+
+        Args:
+            user_id: 用户ID
+            subscription_id: 报到的订阅ID
+            section: 新文章分节 {'subscription_id', 'keywords', 'article_ids'},无新文章时为None
+            expected_ids: 摘要打开时窗口内预计到期的订阅ID(摘要已打开时忽略)
+            window_seconds: 合并窗口长度
+
+        Returns:
+            {'opened': 是否由本次报到打开摘要, 'complete': 预计到期的订阅是否已全部报到}
+        """
+        keys = self._keys(user_id)
+        encoded = cache_codec.encode(section) if section else ''
+        opened, pending = self._add_script(
+            keys=keys,
+            args=[subscription_id, time.time(), window_seconds + self.GRACE_SECONDS, encoded,
+                  *[sid for sid in expected_ids if sid != subscription_id]]
+        )
+        if section:
+            self._record('sections')
+        return {'opened': bool(opened), 'complete': int(pending) == 0}
+
+    def take(self, user_id: int) -> List[Dict[str, Any]]:
+        """取出并清空用户摘要中的全部分节"""
+        keys = self._keys(user_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(keys[0], 0, -1)
+        pipe.delete(*keys)
+        raw_sections, _ = pipe.execute()
+        return [cache_codec.decode(raw) for raw in raw_sections]
+
+    @staticmethod
+    def merge(sections: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """合并同一关键词的分节,同一篇文章只保留在第一次出现的分节中"""
+        merged: Dict[str, Dict[str, Any]] = {}
+        seen = set()
+        for section in sections:
+            article_ids = [article_id for article_id in section['article_ids'] if article_id not in seen]
+            seen.update(article_ids)
+            if not article_ids:
+                continue
+            target = merged.setdefault(section['keywords'], {
+                'subscription_id': section['subscription_id'],
+                'keywords': section['keywords'],
+                'article_ids': []
+            })
+            target['article_ids'].extend(article_ids)
+        return list(merged.values())
+
+    def record_sent(self, sections: int) -> None:
+        """记录一次合并发送,sections为合并前的订阅分节数"""
+        self._record('digests')
+        self._record('merged_sections', sections)
+
+    def get_stats(self, days: int = 7) -> List[Dict[str, Any]]:
+        """最近N天每天收集的订阅分节数、发送的摘要邮件数和因此少发的邮件数"""
+        today = datetime.now()
+        dates = [datetime.fromtimestamp(today.timestamp() - 86400 * offset).strftime('%Y%m%d') for offset in range(days)]
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for date in dates:
+                pipe.hgetall(f"{self.STATS_PREFIX}:{date}")
+            stats = []
+            for date, raw in zip(dates, pipe.execute()):
+                counters = {
+                    (name.decode('utf-8') if isinstance(name, bytes) else name): int(value)
+                    for name, value in raw.items()
+                }
+                digests = counters.get('digests', 0)
+                merged = counters.get('merged_sections', 0)
+                stats.append({
+                    'date': date,
+                    'sections': counters.get('sections', 0),
+                    'digests': digests,
+                    'saved_emails': merged - digests
+                })
+            return stats
+        except Exception as e:
+            logging.warning(f"[推送摘要] 读取统计失败: {e}")
+            return []
+
+    # ==================== 私有辅助方法 ====================
+
+    def _keys(self, user_id: int) -> List[str]:
+        return [
+            f"{self.ENTRIES_PREFIX}:{user_id}",
+            f"{self.EXPECTED_PREFIX}:{user_id}",
+            f"{self.OPENED_PREFIX}:{user_id}"
+        ]
+
+    def _record(self, name: str, amount: int = 1) -> None:
+        """累计当天的摘要计数,统计失败不影响推送"""
+        try:
+            key = f"{self.STATS_PREFIX}:{datetime.now().strftime('%Y%m%d')}"
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hincrby(key, name, amount)
+            pipe.expire(key, self.STATS_TTL)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"[推送摘要] 记录统计失败: {e}")
+
+
+# 全局推送摘要实例
+push_digest = PushDigest(redis_conn)
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+分阶段推送流水线
+把一次订阅推送拆成 检索(fetch) → AI增强(enrich) → 邮件渲染(render) → 邮件发送(send)
+四个RQ任务,分别运行在独立队列上:
+
+- 每个阶段通过Redis信号量限制并发,PubMed、AI接口和SMTP各自按容量饱和,互不阻塞;
+  信号量已满时任务进入该阶段的等待列表(先进先出),持有者释放名额时直接把名额转交给
+  列表头部的任务并将其入队,不会反复创建延后任务
+- 阶段之间的中间结果经cache_codec编码后保存在Redis中,任务只传递run_id;
+  某个阶段失败时中间结果保留,重新排队失败任务即可从该阶段继续
+- 每个阶段按分钟记录完成/失败/延后次数和耗时,用于观察各阶段吞吐量
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import logging
+from datetime import datetime
+from typing import Optional, Dict, List, Any, Callable
+
+from cache_codec import cache_codec
+from rq_config import redis_conn, enqueue_job, enqueue_in, get_queue
+
+
+PUSH_PIPELINE_ENABLED = os.environ.get('PUSH_PIPELINE_ENABLED', 'true').lower() == 'true'
+
+
+class PushPipeline:
+    """分阶段推送的信号量、中间结果交接和吞吐量统计"""
+
+    STAGES = ('fetch', 'enrich', 'render', 'send')
+
+    # 各阶段默认并发上限: PubMed未配置API Key时限速3次/秒,AI和SMTP按服务商限流保守设置
+    DEFAULT_CONCURRENCY = {'fetch': 3, 'enrich': 2, 'render': 4, 'send': 2}
+    # 各阶段任务超时(秒): AI增强包含分批请求和批次间等待,耗时最长
+    JOB_TIMEOUT = {'fetch': 300, 'enrich': 1800, 'render': 120, 'send': 300}
+
+    HANDOFF_PREFIX = "pubmed:push_handoff"
+    HANDOFF_TTL = 2 * 24 * 3600       # 中间结果保留2天，足够人工重新排队失败任务
+    SEMAPHORE_PREFIX = "pubmed:push_stage_sem"
+    STATS_PREFIX = "pubmed:push_stage_stats"
+    STATS_TTL = 2 * 24 * 3600
+    PENDING_PREFIX = "pubmed:push_stage_pending"   # List: 等待名额的阶段任务("名额ID|JSON")
+    RETRY_DELAY = 15                  # 看门狗首次检查等待列表的秒数,之后指数退避
+    MAX_RETRY_DELAY = 300
+    MAX_DEFERRALS = 10                # 名额预留过期后重新等待的次数上限,超出时任务失败(中间结果保留)
+
+    # 先清理租约过期的持有者(Worker被强制终止时未释放);持有预留名额时续期,
+    # 否则在未满时占用一个名额;已满时加入等待列表(预留过期的任务放回头部),ARGV[6]为空时不加入
+    ACQUIRE_SCRIPT = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[2]) - tonumber(ARGV[3]))
+    if ARGV[5] == '1' and redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+        redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+        return 1
+    end
+    if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[4]) then
+        redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+        return 1
+    end
+    if ARGV[6] ~= '' then
+        if ARGV[5] == '1' then
+            redis.call('LPUSH', KEYS[2], ARGV[6])
+        else
+            redis.call('RPUSH', KEYS[2], ARGV[6])
+        end
+    end
+    return 0
+    """
+
+    # 释放名额(ARGV[1]为空时只回收过期租约),再把空出的名额按顺序预留给等待列表中的任务,返回这些任务
+    RELEASE_SCRIPT = """
+    if ARGV[1] ~= '' then
+        redis.call('ZREM', KEYS[1], ARGV[1])
+    end
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[2]) - tonumber(ARGV[3]))
+    local granted = {}
+    while redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[4]) do
+        local item = redis.call('LPOP', KEYS[2])
+        if not item then
+            break
+        end
+        redis.call('ZADD', KEYS[1], ARGV[2], string.match(item, '^[^|]+'))
+        table.insert(granted, item)
+    end
+    return granted
+    """
+
+    def __init__(self, redis_connection):
+        self.redis = redis_connection
+        self.concurrency = {
+            stage: int(os.environ.get(f'PUSH_STAGE_CONCURRENCY_{stage.upper()}', default))
+            for stage, default in self.DEFAULT_CONCURRENCY.items()
+        }
+        self._acquire_script = redis_connection.register_script(self.ACQUIRE_SCRIPT)
+        self._release_script = redis_connection.register_script(self.RELEASE_SCRIPT)
+
+    # ==================== 阶段调度 ====================
+
+    def enqueue_stage(self, stage: str, *args, **kwargs):
+        """把阶段任务加入对应的队列"""
+        return enqueue_job(
+            f'tasks.push_stage_{stage}', *args,
+            priority=f'push_{stage}', job_timeout=self.JOB_TIMEOUT[stage], **kwargs
+        )
+
+    def start(self, payload: Dict[str, Any]) -> str:
+        """保存检索阶段的结果并启动AI增强阶段,返回run_id"""
+        run_id = uuid.uuid4().hex
+        self.advance(run_id, 'enrich', payload)
+        return run_id
+
+    def advance(self, run_id: str, next_stage: str, payload: Dict[str, Any]) -> None:
+        """保存中间结果并把run_id交给下一阶段"""
+        self.save_handoff(run_id, payload)
+        self.enqueue_stage(next_stage, run_id)
+
+    def run_stage(self, stage: str, run_id: Any, func: Callable[[], Any], slot: Optional[str] = None,
+                  deferrals: int = 0, **task_kwargs) -> Any:
+        """
+        在阶段信号量内执行func
+
+        信号量已满时不占用Worker等待,而是加入该阶段的等待列表,由释放名额的任务转交名额后重新入队
+
+        Args:
+            stage: 阶段名称
+            run_id: 传给阶段任务的参数(检索阶段为订阅ID,其余阶段为run_id)
+            func: 阶段处理函数
+            slot: 释放者为本任务预留的名额ID
+            deferrals: 预留名额过期后重新等待的次数
+            task_kwargs: 重新入队时原样传回阶段任务的其他参数
+
+        Returns:
+            func的返回值,或加入等待列表时的 {'status': 'deferred'}
+        """
+        token = slot or f"{run_id}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        if slot is not None:
+            deferrals += 1
+        item = ''
+        if deferrals <= self.MAX_DEFERRALS:
+            item = f"{uuid.uuid4().hex}|" + json.dumps({'arg': run_id, 'deferrals': deferrals, 'kwargs': task_kwargs})
+        if not self._acquire(stage, token, slot is not None, item):
+            if not item:
+                self._record(stage, 'failed')
+                raise RuntimeError(f"{stage} 阶段 {run_id} 等待名额超过 {self.MAX_DEFERRALS} 次")
+            self._record(stage, 'deferred')
+            self._arm_watchdog(stage)
+            logging.info(f"[分阶段推送] {stage} 阶段并发已满({self.concurrency[stage]}), {run_id} 进入等待列表")
+            return {'status': 'deferred', 'stage': stage}
+
+        started = time.time()
+        try:
+            result = func()
+            self._record(stage, 'completed', time.time() - started)
+            return result
+        except Exception:
+            self._record(stage, 'failed', time.time() - started)
+            raise
+        finally:
+            self._release(stage, token)
+
+    def drain(self, stage: str) -> int:
+        """回收过期租约后把空出的名额转交给等待中的任务,返回转交的数量"""
+        granted = self._release_script(
+            keys=[f"{self.SEMAPHORE_PREFIX}:{stage}", f"{self.PENDING_PREFIX}:{stage}"],
+            args=['', time.time(), self._lease(stage), self.concurrency[stage]]
+        )
+        self._enqueue_granted(stage, granted)
+        return len(granted)
+
+    def run_watchdog(self, stage: str, rounds: int = 0) -> int:
+        """
+        看门狗: 持有者被强制终止时没有人释放名额,等待列表由看门狗在租约过期后转交;
+        列表仍不为空时按指数退避(带抖动)再次检查,有进展时退避重新开始
+        """
+        self.redis.delete(self._watchdog_key(stage))
+        granted = self.drain(stage)
+        if self.redis.llen(f"{self.PENDING_PREFIX}:{stage}"):
+            self._arm_watchdog(stage, 0 if granted else rounds + 1)
+        return granted
+
+    # ==================== 中间结果 ====================
+
+    def save_handoff(self, run_id: str, payload: Dict[str, Any]) -> None:
+        self.redis.set(f"{self.HANDOFF_PREFIX}:{run_id}", cache_codec.encode(payload), ex=self.HANDOFF_TTL)
+
+    def load_handoff(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """读取中间结果,不存在(已完成或已过期)时返回None"""
+        raw = self.redis.get(f"{self.HANDOFF_PREFIX}:{run_id}")
+        if raw is None:
+            return None
+        return cache_codec.decode(raw)
+
+    def finish(self, run_id: str) -> None:
+        """推送完成后删除中间结果"""
+        self.redis.delete(f"{self.HANDOFF_PREFIX}:{run_id}")
+
+    # ==================== 吞吐量统计 ====================
+
+    def get_stage_stats(self, minutes: int = 60) -> Dict[str, Dict[str, Any]]:
+        """最近N分钟各阶段的完成数、吞吐量、平均耗时、当前并发和队列长度"""
+        now = time.time()
+        buckets = [datetime.fromtimestamp(now - 60 * offset).strftime('%Y%m%d%H%M') for offset in range(minutes)]
+
+        pipe = self.redis.pipeline(transaction=False)
+        for stage in self.STAGES:
+            for bucket in buckets:
+                pipe.hgetall(f"{self.STATS_PREFIX}:{stage}:{bucket}")
+            pipe.zcount(f"{self.SEMAPHORE_PREFIX}:{stage}", now - self._lease(stage), '+inf')
+            pipe.llen(f"{self.PENDING_PREFIX}:{stage}")
+        replies = pipe.execute()
+
+        stats = {}
+        step = minutes + 2
+        for index, stage in enumerate(self.STAGES):
+            totals = {'completed': 0, 'failed': 0, 'deferred': 0, 'duration_ms': 0}
+            for raw in replies[index * step:index * step + minutes]:
+                for name, value in raw.items():
+                    name = name.decode('utf-8') if isinstance(name, bytes) else name
+                    if name in totals:
+                        totals[name] += int(value)
+            finished = totals['completed'] + totals['failed']
+            stats[stage] = {
+                'completed': totals['completed'],
+                'failed': totals['failed'],
+                'deferred': totals['deferred'],
+                'throughput_per_min': round(totals['completed'] / minutes, 2),
+                'avg_duration_ms': round(totals['duration_ms'] / finished, 1) if finished else 0,
+                'in_flight': replies[index * step + minutes],
+                'pending': replies[index * step + minutes + 1],
+                'concurrency': self.concurrency[stage],
+                'queued': len(get_queue(f'push_{stage}'))
+            }
+        return stats
+
+    # ==================== 私有辅助方法 ====================
+
+    def _lease(self, stage: str) -> int:
+        """信号量租约: 任务超时后RQ会终止任务,租约再多留一分钟"""
+        return self.JOB_TIMEOUT[stage] + 60
+
+    def _acquire(self, stage: str, token: str, reserved: bool, item: str) -> bool:
+        return bool(self._acquire_script(
+            keys=[f"{self.SEMAPHORE_PREFIX}:{stage}", f"{self.PENDING_PREFIX}:{stage}"],
+            args=[token, time.time(), self._lease(stage), self.concurrency[stage], '1' if reserved else '0', item]
+        ))
+
+    def _release(self, stage: str, token: str) -> None:
+        try:
+            granted = self._release_script(
+                keys=[f"{self.SEMAPHORE_PREFIX}:{stage}", f"{self.PENDING_PREFIX}:{stage}"],
+                args=[token, time.time(), self._lease(stage), self.concurrency[stage]]
+            )
+            self._enqueue_granted(stage, granted)
+        except Exception as e:
+            # 释放失败时由租约到期自动回收,等待列表由看门狗转交
+            logging.warning(f"[分阶段推送] 释放 {stage} 阶段信号量失败: {e}")
+
+    def _enqueue_granted(self, stage: str, granted: List[Any]) -> None:
+        """把预留了名额的等待任务重新入队"""
+        for item in granted:
+            item = item.decode('utf-8') if isinstance(item, bytes) else item
+            slot, encoded = item.split('|', 1)
+            entry = json.loads(encoded)
+            self.enqueue_stage(stage, entry['arg'], slot=slot, stage_deferrals=entry['deferrals'], **entry['kwargs'])
+
+    def _watchdog_key(self, stage: str) -> str:
+        return f"{self.PENDING_PREFIX}:{stage}:watchdog"
+
+    def _arm_watchdog(self, stage: str, rounds: int = 0) -> None:
+        """每个阶段最多一个看门狗任务在排队"""
+        delay = min(self.RETRY_DELAY * 2 ** rounds, self.MAX_RETRY_DELAY) * random.uniform(0.5, 1.5)
+        try:
+            if self.redis.set(self._watchdog_key(stage), 1, nx=True, ex=self.MAX_RETRY_DELAY * 2):
+                enqueue_in('tasks.push_stage_watchdog', int(delay) + 1, stage, rounds, priority=f'push_{stage}')
+        except Exception as e:
+            logging.warning(f"[分阶段推送] 启动 {stage} 阶段看门狗失败: {e}")
+
+    def _record(self, stage: str, status: str, duration: float = 0) -> None:
+        """累计当前分钟的阶段计数,统计失败不影响推送"""
+        try:
+            key = f"{self.STATS_PREFIX}:{stage}:{datetime.now().strftime('%Y%m%d%H%M')}"
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hincrby(key, status, 1)
+            if status != 'deferred':
+                pipe.hincrby(key, 'duration_ms', int(duration * 1000))
+            pipe.expire(key, self.STATS_TTL)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"[分阶段推送] 记录 {stage} 阶段统计失败: {e}")
+
+
+# 全局流水线实例
+push_pipeline = PushPipeline(redis_conn)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+订阅推送调度器
+用一个Redis有序集合(订阅ID -> 下次推送时间戳)代替每个订阅一个RQ定时任务:
+
+- 调度/改期只是一次ZADD(O(log N)),重复调度同一订阅只会覆盖时间,天然幂等;取消是一次ZREM
+- 分发循环按批原子地取出到期订阅,批量加入推送队列;多个Worker同时运行分发循环也不会重复分发
+- 取出的订阅先移入处理中集合,入队成功后再确认;分发进程在两步之间退出时,
+  超过 INFLIGHT_TIMEOUT 的订阅会被放回调度集合重新分发
+- 确认时同时写入按分发时间计算的下次推送时间(不覆盖推送任务或用户改期写入的时间),
+  推送任务被强制终止或丢失时订阅也不会从调度中消失
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pytz
+from rq import Queue
+
+from rq_config import redis_conn, get_queue
+
+
+PUSH_SCHEDULER_BACKEND = os.environ.get('PUSH_SCHEDULER_BACKEND', 'zset').lower()
+
+# 时区配置（与app.py一致），任务ID和下次推送时间按应用时区显示，不依赖容器本地时区
+DEFAULT_TIMEZONE = 'Asia/Shanghai'
+try:
+    APP_TIMEZONE = pytz.timezone(os.environ.get('TZ', DEFAULT_TIMEZONE))
+except Exception:
+    APP_TIMEZONE = pytz.timezone(DEFAULT_TIMEZONE)
+
+
+class PushScheduler:
+    """基于有序集合的订阅推送调度"""
+
+    SCHEDULE_KEY = "pubmed:push_schedule"
+    INFLIGHT_KEY = "pubmed:push_schedule:inflight"
+    DISPATCHED_KEY = "pubmed:push_schedule:dispatched"
+    PUSH_TASK = 'tasks.process_subscription_push'
+    PUSH_JOB_TIMEOUT = 600
+    INFLIGHT_TIMEOUT = 300          # 处理中超过该秒数仍未确认的订阅重新分发
+    RECOVER_INTERVAL = 60
+
+    # 取出到期订阅并移入处理中集合(分数为取出时间),返回 [订阅ID, 到期时间戳, ...]
+    POP_DUE_SCRIPT = """
+    local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[2]))
+    for i = 1, #due, 2 do
+        redis.call('ZREM', KEYS[1], due[i])
+        redis.call('ZADD', KEYS[2], ARGV[1], due[i])
+    end
+    return due
+    """
+
+    # 超时未确认的订阅放回调度集合立即到期(已被重新调度的保留新的时间)
+    RECOVER_SCRIPT = """
+    local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+    for i = 1, #stale do
+        redis.call('ZADD', KEYS[1], 'NX', ARGV[1], stale[i])
+        redis.call('ZREM', KEYS[2], stale[i])
+    end
+    return #stale
+    """
+
+    # 确认已入队的订阅: 移出处理中集合,并在调度集合中没有该订阅时写入下次推送时间
+    # ARGV为(订阅ID, 下次推送时间戳)对,时间戳为空时只移出处理中集合
+    ACK_SCRIPT = """
+    for i = 1, #ARGV, 2 do
+        redis.call('ZREM', KEYS[2], ARGV[i])
+        if ARGV[i + 1] ~= '' then
+            redis.call('ZADD', KEYS[1], 'NX', ARGV[i + 1], ARGV[i])
+        end
+    end
+    return #ARGV / 2
+    """
+
+    def __init__(self, redis_connection, batch_size: int = 500, poll_interval: float = 1.0):
+        self.redis = redis_connection
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._pop_due_script = redis_connection.register_script(self.POP_DUE_SCRIPT)
+        self._recover_script = redis_connection.register_script(self.RECOVER_SCRIPT)
+        self._ack_script = redis_connection.register_script(self.ACK_SCRIPT)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ==================== 调度 ====================
+
+    def schedule(self, subscription_id: int, run_at: datetime) -> None:
+        """调度或改期订阅推送"""
+        self.redis.zadd(self.SCHEDULE_KEY, {str(subscription_id): run_at.timestamp()})
+
+    def schedule_many(self, items: Iterable[Tuple[int, datetime]], pipeline=None) -> None:
+        """批量调度,传入pipeline时只把ZADD加入该pipeline"""
+        mapping = {str(subscription_id): run_at.timestamp() for subscription_id, run_at in items}
+        if mapping:
+            (pipeline if pipeline is not None else self.redis).zadd(self.SCHEDULE_KEY, mapping)
+
+    def cancel(self, subscription_id: int) -> int:
+        """取消订阅的待推送,返回移除的条目数"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrem(self.SCHEDULE_KEY, str(subscription_id))
+        pipe.zrem(self.INFLIGHT_KEY, str(subscription_id))
+        return sum(pipe.execute())
+
+    def prune(self, valid_ids: Iterable[int]) -> int:
+        """移除不在valid_ids中的订阅(已删除订阅的遗留调度),返回移除数量"""
+        valid = {str(subscription_id) for subscription_id in valid_ids}
+        members = [
+            member.decode('utf-8') if isinstance(member, bytes) else member
+            for member in self.redis.zrange(self.SCHEDULE_KEY, 0, -1)
+        ]
+        orphaned = [member for member in members if member not in valid]
+        if not orphaned:
+            return 0
+        return self.redis.zrem(self.SCHEDULE_KEY, *orphaned)
+
+    def get_next_run(self, subscription_id: int) -> Optional[datetime]:
+        score = self.redis.zscore(self.SCHEDULE_KEY, str(subscription_id))
+        return datetime.fromtimestamp(score, APP_TIMEZONE) if score is not None else None
+
+    def count(self) -> int:
+        """已调度的订阅数(含处理中)"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcard(self.SCHEDULE_KEY)
+        pipe.zcard(self.INFLIGHT_KEY)
+        return sum(pipe.execute())
+
+    # ==================== 分发 ====================
+
+    def dispatch_due(self, now: Optional[float] = None) -> int:
+        """取出一批到期订阅并加入推送队列,返回分发数量"""
+        now = now if now is not None else time.time()
+        raw = self._pop_due_script(keys=[self.SCHEDULE_KEY, self.INFLIGHT_KEY], args=[now, self.batch_size])
+        if not raw:
+            return 0
+        due = [
+            (int(raw[i].decode('utf-8') if isinstance(raw[i], bytes) else raw[i]), float(raw[i + 1]))
+            for i in range(0, len(raw), 2)
+        ]
+        next_runs = self._next_runs([subscription_id for subscription_id, _ in due])
+        self._enqueue(due)
+
+        args = []
+        for subscription_id, _ in due:
+            next_run = next_runs.get(subscription_id)
+            args += [subscription_id, next_run.timestamp() if next_run else '']
+        pipe = self.redis.pipeline(transaction=False)
+        self._ack_script(keys=[self.SCHEDULE_KEY, self.INFLIGHT_KEY], args=args, client=pipe)
+        pipe.incrby(self.DISPATCHED_KEY, len(due))
+        pipe.execute()
+        return len(due)
+
+    def recover_stale(self, now: Optional[float] = None) -> int:
+        """把处理中超时的订阅放回调度集合"""
+        now = now if now is not None else time.time()
+        recovered = int(self._recover_script(
+            keys=[self.SCHEDULE_KEY, self.INFLIGHT_KEY], args=[now, now - self.INFLIGHT_TIMEOUT]
+        ))
+        if recovered:
+            logging.warning(f"[推送调度] {recovered} 个订阅分发后未确认，已放回调度集合")
+        return recovered
+
+    def run(self, stop_event: Optional[threading.Event] = None) -> None:
+        """分发循环: 有积压时连续分发,否则每 poll_interval 秒检查一次"""
+        stop_event = stop_event or self._stop
+        last_recover = 0.0
+        logging.info(f"[推送调度] 分发循环启动 (批量 {self.batch_size}, 间隔 {self.poll_interval}秒)")
+        while not stop_event.is_set():
+            dispatched = 0
+            try:
+                if time.time() - last_recover >= self.RECOVER_INTERVAL:
+                    self.recover_stale()
+                    last_recover = time.time()
+                dispatched = self.dispatch_due()
+                if dispatched:
+                    logging.info(f"[推送调度] 已分发 {dispatched} 个到期订阅")
+            except Exception as e:
+                logging.error(f"[推送调度] 分发失败: {e}")
+            if dispatched < self.batch_size:
+                stop_event.wait(self.poll_interval)
+
+    def start(self) -> threading.Thread:
+        """在后台线程中运行分发循环"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='push-scheduler', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def get_stats(self) -> Dict[str, object]:
+        """调度集合大小、处理中数量、最早到期时间和累计分发数"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcard(self.SCHEDULE_KEY)
+        pipe.zcard(self.INFLIGHT_KEY)
+        pipe.zrange(self.SCHEDULE_KEY, 0, 0, withscores=True)
+        pipe.zcount(self.SCHEDULE_KEY, '-inf', time.time())
+        pipe.get(self.DISPATCHED_KEY)
+        scheduled, inflight, first, overdue, dispatched = pipe.execute()
+        return {
+            'backend': PUSH_SCHEDULER_BACKEND,
+            'scheduled': scheduled,
+            'inflight': inflight,
+            'overdue': overdue,
+            'next_due': datetime.fromtimestamp(first[0][1], APP_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S') if first else None,
+            'dispatched_total': int(dispatched or 0)
+        }
+
+    # ==================== 私有辅助方法 ====================
+
+    def _next_runs(self, subscription_ids: List[int]) -> Dict[int, datetime]:
+        """按当前时间计算活跃订阅的下次推送时间;计算失败时返回空字典,由推送任务自行调度"""
+        try:
+            # 延迟导入避免循环依赖
+            from app import app, Subscription, User, calculate_next_push_time
+            with app.app_context():
+                subscriptions = Subscription.query.join(User).filter(
+                    Subscription.id.in_(subscription_ids),
+                    Subscription.is_active == True,
+                    User.is_active == True
+                ).all()
+                return {
+                    subscription.id: next_run for subscription in subscriptions
+                    for next_run in [calculate_next_push_time(subscription)] if next_run
+                }
+        except Exception as e:
+            logging.warning(f"[推送调度] 计算下次推送时间失败，由推送任务调度: {e}")
+            return {}
+
+    def _enqueue(self, due: Iterable[Tuple[int, float]]) -> None:
+        """通过一个pipeline批量创建推送任务"""
+        queue = get_queue('default')
+        jobs = [
+            Queue.prepare_data(
+                self.PUSH_TASK, args=(subscription_id,), kwargs={'due_at': due_at}, timeout=self.PUSH_JOB_TIMEOUT,
+                job_id=f"push_subscription_{subscription_id}_{datetime.fromtimestamp(due_at, APP_TIMEZONE).strftime('%Y%m%d_%H%M')}"
+            )
+            for subscription_id, due_at in due
+        ]
+        with self.redis.pipeline() as pipe:
+            queue.enqueue_many(jobs, pipeline=pipe)
+            pipe.execute()
+
+
+# 全局推送调度器实例
+push_scheduler = PushScheduler(
+    redis_conn,
+    batch_size=int(os.environ.get('PUSH_SCHEDULER_BATCH_SIZE', 500)),
+    poll_interval=float(os.environ.get('PUSH_SCHEDULER_POLL_INTERVAL', 1))
+)
@@ -8,21 +8,50 @@ RQ (Redis Queue) 配置和任务队列管理
 import os
 import redis
 from rq import Queue, Worker, Connection
-from rq.job import Job
+from rq.job import Job, JobStatus
+from rq.exceptions import NoSuchJobError
 from rq.registry import ScheduledJobRegistry
+import time
 import datetime
 import logging
-from typing import Optional, List
+from typing import Optional, List, Tuple, Iterable
+from urllib.parse import urlparse, urlunparse
 
 # Redis连接配置
 REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 redis_conn = redis.from_url(REDIS_URL)
 
+
+def _redis_url_with_db(url: str, db: int) -> str:
+    """替换Redis URL中的逻辑库编号"""
+    parsed = urlparse(url)
+    return urlunparse(parsed._replace(path=f'/{db}'))
+
+
+# 搜索缓存使用独立的逻辑库和连接池,与队列、调度注册表等RQ数据隔离
+SEARCH_CACHE_REDIS_URL = os.environ.get('SEARCH_CACHE_REDIS_URL') or _redis_url_with_db(
+    REDIS_URL, int(os.environ.get('SEARCH_CACHE_REDIS_DB', 1))
+)
+# 设置超时: Redis不可达时缓存读写快速失败,由搜索缓存回退到本地磁盘层
+SEARCH_CACHE_REDIS_TIMEOUT = float(os.environ.get('SEARCH_CACHE_REDIS_TIMEOUT', 2))
+cache_redis_conn = redis.from_url(
+    SEARCH_CACHE_REDIS_URL,
+    socket_connect_timeout=SEARCH_CACHE_REDIS_TIMEOUT,
+    socket_timeout=SEARCH_CACHE_REDIS_TIMEOUT
+)
+
 # 创建不同优先级的队列
 high_priority_queue = Queue('high', connection=redis_conn)  # 高优先级：立即推送
 default_queue = Queue('default', connection=redis_conn)     # 默认：定时推送
 low_priority_queue = Queue('low', connection=redis_conn)    # 低优先级：统计分析
 
+# 分阶段推送队列：检索、AI增强、邮件渲染、邮件发送各自独立，慢SMTP或LLM不占用检索Worker
+push_fetch_queue = Queue('push_fetch', connection=redis_conn)
+push_enrich_queue = Queue('push_enrich', connection=redis_conn)
+push_render_queue = Queue('push_render', connection=redis_conn)
+push_send_queue = Queue('push_send', connection=redis_conn)
+push_stage_queues = [push_fetch_queue, push_enrich_queue, push_render_queue, push_send_queue]
+
 # 获取调度任务注册表
 scheduled_registry = ScheduledJobRegistry(queue=default_queue)
 
@@ -37,7 +66,11 @@ def get_queue(priority='default'):
     queues = {
         'high': high_priority_queue,
         'default': default_queue,
-        'low': low_priority_queue
+        'low': low_priority_queue,
+        'push_fetch': push_fetch_queue,
+        'push_enrich': push_enrich_queue,
+        'push_render': push_render_queue,
+        'push_send': push_send_queue
     }
     return queues.get(priority, default_queue)
 
@@ -54,10 +87,22 @@ def enqueue_at(func, run_at: datetime.datetime, *args, priority='default', **kwa
 def enqueue_in(func, delay: int, *args, priority='default', **kwargs):
     """延迟指定秒数后执行任务"""
     queue = get_queue(priority)
-    return queue.enqueue_in(delay, func, *args, **kwargs)
+    # RQ的enqueue_in需要timedelta
+    return queue.enqueue_in(datetime.timedelta(seconds=delay), func, *args, **kwargs)
+
+# 订阅ID -> 当前推送任务ID 的索引,取消和改期只操作索引指向的一个任务,不再扫描全部注册表
+SUBSCRIPTION_JOB_INDEX_KEY = 'pubmed:subscription_push_jobs'
+
+# 仍在等待执行、可以取消的任务状态
+PENDING_JOB_STATUSES = ('scheduled', 'deferred', 'queued')
 
 def schedule_subscription_push(subscription_id: int, run_at: datetime.datetime):
-    """调度订阅推送任务"""
+    """调度订阅推送任务（默认写入推送调度有序集合，PUSH_SCHEDULER_BACKEND=rq 时使用RQ定时任务）"""
+    from push_scheduler import push_scheduler, PUSH_SCHEDULER_BACKEND
+    if PUSH_SCHEDULER_BACKEND == 'zset':
+        push_scheduler.schedule(subscription_id, run_at)
+        return None
+    
     # 动态导入避免循环依赖
     def _import_task():
         from tasks import process_subscription_push
@@ -65,52 +110,241 @@ def schedule_subscription_push(subscription_id: int, run_at: datetime.datetime):
     
     job_id = f'push_subscription_{subscription_id}_{run_at.strftime("%Y%m%d_%H%M")}'
     
-    # 先取消已有的同类任务
+    # 先取消索引中记录的上一个任务
     cancel_subscription_jobs(subscription_id)
     
-    # 调度新任务
+    # 调度新任务并更新索引
     task_func = _import_task()
-    return enqueue_at(task_func, run_at, subscription_id, job_id=job_id)
+    job = enqueue_at(task_func, run_at, subscription_id, job_id=job_id, due_at=run_at.timestamp())
+    redis_conn.hset(SUBSCRIPTION_JOB_INDEX_KEY, subscription_id, job_id)
+    return job
 
 def cancel_subscription_jobs(subscription_id: int):
-    """取消订阅的所有待执行任务（使用RQ原生Registry）"""
-    cancelled_count = 0
+    """取消订阅的待执行任务（有序集合调度时为一次ZREM，否则取消索引中记录的任务）"""
+    from push_scheduler import push_scheduler, PUSH_SCHEDULER_BACKEND
+    if PUSH_SCHEDULER_BACKEND == 'zset':
+        try:
+            return push_scheduler.cancel(subscription_id)
+        except Exception as e:
+            logging.error(f"取消订阅 {subscription_id} 的推送调度时发生异常: {e}")
+            return 0
 
     try:
-        # 1. 取消scheduled_job_registry中的调度任务
-        for queue in [high_priority_queue, default_queue, low_priority_queue]:
-            registry = ScheduledJobRegistry(queue=queue)
-            for job_id in list(registry.get_job_ids()):
-                if job_id.startswith(f'push_subscription_{subscription_id}_'):
-                    try:
-                        job = Job.fetch(job_id, connection=redis_conn)
-                        job.cancel()
-                        registry.remove(job_id)  # 修复：传递job_id而不是job对象
-                        cancelled_count += 1
-                        logging.info(f"已取消调度任务: {job_id}")
-                    except Exception as e:
-                        logging.warning(f"取消调度任务 {job_id} 失败: {e}")
-
-        # 2. 取消队列中的延迟任务
-        for queue in [high_priority_queue, default_queue, low_priority_queue]:
-            # 获取延迟任务注册表
-            registry = queue.deferred_job_registry
-            for job_id in list(registry.get_job_ids()):
-                if job_id.startswith(f'push_subscription_{subscription_id}_'):
-                    try:
-                        job = Job.fetch(job_id, connection=redis_conn)
-                        job.cancel()
-                        cancelled_count += 1
-                        logging.info(f"已取消延迟任务: {job_id}")
-                    except Exception as e:
-                        logging.warning(f"取消延迟任务 {job_id} 失败: {e}")
-
-        logging.info(f"订阅 {subscription_id} 共取消 {cancelled_count} 个任务")
-        return cancelled_count
+        job_id = redis_conn.hget(SUBSCRIPTION_JOB_INDEX_KEY, subscription_id)
+        if job_id is None:
+            return 0
+        job_id = job_id.decode('utf-8') if isinstance(job_id, bytes) else job_id
+        cancelled = _cancel_pending_job(job_id)
+        redis_conn.hdel(SUBSCRIPTION_JOB_INDEX_KEY, subscription_id)
+        if cancelled:
+            logging.info(f"已取消订阅 {subscription_id} 的调度任务: {job_id}")
+        return cancelled
 
     except Exception as e:
         logging.error(f"取消订阅 {subscription_id} 的任务时发生异常: {e}")
-        return cancelled_count
+        return 0
+
+def _cancel_pending_job(job_id: str) -> int:
+    """取消一个尚未执行的任务并移出调度注册表，任务已执行或已过期时返回0"""
+    try:
+        job = Job.fetch(job_id, connection=redis_conn)
+    except NoSuchJobError:
+        return 0
+    if job.get_status(refresh=False) not in PENDING_JOB_STATUSES:
+        return 0
+    job.cancel()
+    ScheduledJobRegistry(job.origin, connection=redis_conn).remove(job_id)
+    return 1
+
+def rebuild_subscription_job_index():
+    """
+    扫描一次调度注册表重建订阅任务索引（索引上线前调度的任务、索引丢失后恢复）
+
+    同一订阅存在多个调度任务时只保留最晚的一个，其余取消
+
+    Returns:
+        dict: {'indexed': 索引的订阅数, 'cancelled': 取消的重复任务数}
+    """
+    latest = {}
+    duplicates = []
+    for queue in [high_priority_queue, default_queue, low_priority_queue]:
+        for job_id in ScheduledJobRegistry(queue=queue).get_job_ids():
+            if not job_id.startswith('push_subscription_'):
+                continue
+            try:
+                subscription_id = int(job_id.split('_')[2])
+            except (IndexError, ValueError):
+                continue
+            current = latest.get(subscription_id)
+            if current is None or job_id > current:
+                if current is not None:
+                    duplicates.append(current)
+                latest[subscription_id] = job_id
+            else:
+                duplicates.append(job_id)
+
+    cancelled = 0
+    for job_id in duplicates:
+        try:
+            cancelled += _cancel_pending_job(job_id)
+        except Exception as e:
+            logging.warning(f"取消重复调度任务 {job_id} 失败: {e}")
+
+    pipe = redis_conn.pipeline()
+    pipe.delete(SUBSCRIPTION_JOB_INDEX_KEY)
+    if latest:
+        pipe.hset(SUBSCRIPTION_JOB_INDEX_KEY, mapping=latest)
+    pipe.execute()
+    logging.info(f"订阅任务索引已重建: {len(latest)} 个订阅, 取消 {cancelled} 个重复任务")
+    return {'indexed': len(latest), 'cancelled': cancelled}
+
+# 批量调度: 每块的任务、注册表、索引和进度在一个pipeline事务中写入,进度用于中断后继续
+BULK_SCHEDULE_CHUNK_SIZE = int(os.environ.get('BULK_SCHEDULE_CHUNK_SIZE', 1000))
+BULK_SCHEDULE_PROGRESS_KEY = 'pubmed:bulk_schedule:progress'
+BULK_SCHEDULE_PROGRESS_TTL = 3600   # 超过该时间未完成的进度作废,下次从头调度
+BULK_SCHEDULE_STALL_SECONDS = 120   # 进度超过该时间未更新视为调度进程已中断
+
+# 删除仍在调度注册表中的旧任务: 只有从注册表移除成功才删除任务数据,已入队或执行中的任务不受影响
+DROP_SCHEDULED_JOBS_SCRIPT = """
+local dropped = 0
+for i = 1, #ARGV do
+    for k = 1, #KEYS do
+        if redis.call('ZREM', KEYS[k], ARGV[i]) == 1 then
+            redis.call('DEL', 'rq:job:' .. ARGV[i])
+            dropped = dropped + 1
+            break
+        end
+    end
+end
+return dropped
+"""
+_drop_scheduled_jobs = redis_conn.register_script(DROP_SCHEDULED_JOBS_SCRIPT)
+
+def bulk_schedule_subscription_pushes(schedule: Iterable[Tuple[int, datetime.datetime]],
+                                      chunk_size: int = BULK_SCHEDULE_CHUNK_SIZE):
+    """
+    批量调度订阅推送
+
+    按订阅ID顺序分块写入,每块一个pipeline事务(含进度);调度进程中途退出后重新调用时
+    从上次完成的订阅之后继续,不会从头重新调度
+
+    Args:
+        schedule: [(订阅ID, 下次推送时间)]
+
+    Returns:
+        dict: {'scheduled': 本次调度数, 'resumed_from': 继续调度的起点订阅ID(从头调度时为None)}
+    """
+    from push_scheduler import push_scheduler, PUSH_SCHEDULER_BACKEND
+
+    schedule = sorted(schedule, key=lambda item: item[0])
+    progress = get_bulk_schedule_progress()
+    resumed_from = progress['last_id'] if progress else None
+    if resumed_from is not None:
+        schedule = [item for item in schedule if item[0] > resumed_from]
+        logging.info(f"批量调度从订阅 {resumed_from} 之后继续，剩余 {len(schedule)} 个")
+
+    total = len(schedule) + (progress['done'] if progress else 0)
+    done = progress['done'] if progress else 0
+    for start in range(0, len(schedule), chunk_size):
+        chunk = schedule[start:start + chunk_size]
+        pipe = redis_conn.pipeline()
+        if PUSH_SCHEDULER_BACKEND == 'zset':
+            push_scheduler.schedule_many(chunk, pipeline=pipe)
+        else:
+            _schedule_push_jobs(chunk, pipe)
+        done += len(chunk)
+        pipe.hset(BULK_SCHEDULE_PROGRESS_KEY, mapping={
+            'last_id': chunk[-1][0], 'done': done, 'total': total, 'updated_at': int(time.time())
+        })
+        pipe.expire(BULK_SCHEDULE_PROGRESS_KEY, BULK_SCHEDULE_PROGRESS_TTL)
+        pipe.execute()
+
+    redis_conn.delete(BULK_SCHEDULE_PROGRESS_KEY)
+    return {'scheduled': len(schedule), 'resumed_from': resumed_from}
+
+def get_bulk_schedule_progress():
+    """未完成的批量调度进度 {'last_id', 'done', 'total', 'updated_at'},没有时返回None"""
+    raw = redis_conn.hgetall(BULK_SCHEDULE_PROGRESS_KEY)
+    if not raw:
+        return None
+    return {
+        (name.decode('utf-8') if isinstance(name, bytes) else name): int(value)
+        for name, value in raw.items()
+    }
+
+def bulk_schedule_running():
+    """是否有批量调度正在进行(进度最近仍在更新)"""
+    progress = get_bulk_schedule_progress()
+    return bool(progress) and time.time() - progress.get('updated_at', 0) < BULK_SCHEDULE_STALL_SECONDS
+
+def _schedule_push_jobs(chunk: List[Tuple[int, datetime.datetime]], pipe):
+    """把一块订阅的RQ定时任务、调度注册表和订阅任务索引写入pipeline,并删除索引中的旧任务"""
+    subscription_ids = [subscription_id for subscription_id, _ in chunk]
+    job_ids = [
+        f'push_subscription_{subscription_id}_{run_at.strftime("%Y%m%d_%H%M")}'
+        for subscription_id, run_at in chunk
+    ]
+    previous = [
+        job_id.decode('utf-8') if isinstance(job_id, bytes) else job_id
+        for job_id in redis_conn.hmget(SUBSCRIPTION_JOB_INDEX_KEY, subscription_ids)
+        if job_id is not None
+    ]
+    if previous:
+        registry_keys = [
+            ScheduledJobRegistry(queue=queue).key
+            for queue in [high_priority_queue, default_queue, low_priority_queue]
+        ]
+        _drop_scheduled_jobs(keys=registry_keys, args=previous, client=pipe)
+
+    # 与 Queue.schedule_job 写入的数据相同,注册表改为每块一次ZADD
+    # (RQ 1.15 的 ScheduledJobRegistry.schedule 不使用传入的pipeline)
+    pipe.sadd(default_queue.redis_queues_keys, default_queue.key)
+    for (subscription_id, run_at), job_id in zip(chunk, job_ids):
+        job = default_queue.create_job(
+            'tasks.process_subscription_push', args=(subscription_id,), kwargs={'due_at': run_at.timestamp()},
+            job_id=job_id, status=JobStatus.SCHEDULED
+        )
+        job.save(pipeline=pipe)
+    pipe.zadd(
+        ScheduledJobRegistry(queue=default_queue).key,
+        {job_id: int(run_at.timestamp()) for job_id, (_, run_at) in zip(job_ids, chunk)}
+    )
+    pipe.hset(SUBSCRIPTION_JOB_INDEX_KEY, mapping=dict(zip(subscription_ids, job_ids)))
+
+def purge_legacy_subscription_jobs():
+    """
+    删除RQ定时任务形式的订阅推送任务（切换到有序集合调度后执行一次，避免同一推送被触发两次）
+
+    Returns:
+        int: 删除的任务数
+    """
+    removed = 0
+    for queue in [high_priority_queue, default_queue, low_priority_queue]:
+        registry = ScheduledJobRegistry(queue=queue)
+        for job_id in list(registry.get_job_ids()):
+            if not job_id.startswith('push_subscription_'):
+                continue
+            try:
+                registry.remove(job_id, delete_job=True)
+                removed += 1
+            except Exception as e:
+                logging.warning(f"删除旧调度任务 {job_id} 失败: {e}")
+    redis_conn.delete(SUBSCRIPTION_JOB_INDEX_KEY)
+    if removed:
+        logging.info(f"已删除 {removed} 个RQ定时推送任务（改用有序集合调度）")
+    return removed
+
+def count_scheduled_subscriptions():
+    """已调度推送的订阅数，用于监控调度任务是否丢失"""
+    from push_scheduler import push_scheduler, PUSH_SCHEDULER_BACKEND
+    if PUSH_SCHEDULER_BACKEND == 'zset':
+        return push_scheduler.count()
+    return sum(
+        1
+        for queue in [high_priority_queue, default_queue, low_priority_queue]
+        for job_id in ScheduledJobRegistry(queue=queue).get_job_ids()
+        if job_id.startswith('push_subscription_')
+    )
 
 def get_queue_info():
     """获取队列状态信息（使用RQ原生Registry）"""
@@ -142,13 +376,31 @@ def get_queue_info():
             'failed': len(low_priority_queue.failed_job_registry),
             'finished': len(low_priority_queue.finished_job_registry)
         },
-        'total_scheduled': scheduled_count
+        'push_stages': {
+            queue.name: {
+                'length': len(queue),
+                'scheduled': len(ScheduledJobRegistry(queue=queue)),
+                'started': len(queue.started_job_registry),
+                'failed': len(queue.failed_job_registry)
+            }
+            for queue in push_stage_queues
+        },
+        'total_scheduled': scheduled_count,
+        'push_schedule': _push_schedule_info()
     }
 
+def _push_schedule_info():
+    """推送调度有序集合状态（Redis异常时返回错误信息，不影响队列状态查询）"""
+    try:
+        from push_scheduler import push_scheduler
+        return push_scheduler.get_stats()
+    except Exception as e:
+        return {'error': str(e)}
+
 def get_failed_jobs():
     """获取失败的任务"""
     failed_jobs = []
-    for queue in [high_priority_queue, default_queue, low_priority_queue]:
+    for queue in [high_priority_queue, default_queue, low_priority_queue] + push_stage_queues:
         registry = queue.failed_job_registry
         for job_id in registry.get_job_ids():
             try:
@@ -198,7 +450,7 @@ def clear_failed_jobs():
     """清空失败任务（删除而不是重新排队）"""
     cleared_count = 0
     try:
-        for queue in [high_priority_queue, default_queue, low_priority_queue]:
+        for queue in [high_priority_queue, default_queue, low_priority_queue] + push_stage_queues:
             registry = queue.failed_job_registry
             job_ids = list(registry.get_job_ids())
 
@@ -223,7 +475,8 @@ def clear_failed_jobs():
 class RQConfig:
     """RQ配置类"""
     REDIS_URL = REDIS_URL
-    QUEUES = ['high', 'default', 'low']
+    # 推送阶段队列排在default之前，优先排空已开始的推送
+    QUEUES = ['high', 'push_send', 'push_render', 'push_enrich', 'push_fetch', 'default', 'low']
 
     # Worker配置
     WORKER_CONNECTION_KWARGS = {'decode_responses': True}
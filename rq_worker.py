@@ -10,7 +10,10 @@ import sys
 import signal
 import logging
 from rq import Worker, Queue, Connection
-from rq_config import redis_conn, high_priority_queue, default_queue, low_priority_queue
+from rq_config import (
+    redis_conn, high_priority_queue, default_queue, low_priority_queue,
+    push_fetch_queue, push_enrich_queue, push_render_queue, push_send_queue
+)
 
 # 全局变量用于优雅关闭
 shutdown_requested = False
@@ -20,6 +23,25 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
+class PubMedWorker(Worker):
+    """任务执行后写入缓冲的系统日志、缓存遥测和磁盘缓存（任务子进程通过os._exit退出，不会执行atexit）"""
+
+    def perform_job(self, job, queue):
+        try:
+            return super().perform_job(job, queue)
+        finally:
+            app_module = sys.modules.get('app')
+            if app_module is not None:
+                try:
+                    app_module.system_log_writer.flush()
+                except Exception as e:
+                    logging.getLogger(__name__).warning(f"写入任务日志失败: {e}")
+            cache_module = sys.modules.get('search_cache_service')
+            if cache_module is not None:
+                # flush内部已捕获Redis异常；排队的磁盘缓存写入也在任务进程退出前写完
+                cache_module.search_cache_service.telemetry.flush()
+                cache_module.search_cache_service.flush_disk_writes()
+
 def signal_handler(signum, frame):
     """处理关闭信号"""
     global shutdown_requested
@@ -48,7 +70,7 @@ def main():
 
     # 获取工作进程参数
     worker_name = os.environ.get('RQ_WORKER_NAME', 'pubmed-worker')
-    queues_to_listen = os.environ.get('RQ_QUEUES', 'high,default,low').split(',')
+    queues_to_listen = os.environ.get('RQ_QUEUES', 'high,push_send,push_render,push_enrich,push_fetch,default,low').split(',')
     
     logger.info(f"启动RQ Worker: {worker_name}")
     logger.info(f"监听队列: {queues_to_listen}")
@@ -58,7 +80,11 @@ def main():
     queue_map = {
         'high': high_priority_queue,
         'default': default_queue,
-        'low': low_priority_queue
+        'low': low_priority_queue,
+        'push_fetch': push_fetch_queue,
+        'push_enrich': push_enrich_queue,
+        'push_render': push_render_queue,
+        'push_send': push_send_queue
     }
     
     for queue_name in queues_to_listen:
@@ -99,9 +125,15 @@ def main():
 
         # 创建Worker
         with Connection(redis_conn):
-            worker = Worker(queues, name=worker_name)
+            worker = PubMedWorker(queues, name=worker_name)
             logger.info(f"Worker {worker_name} 启动成功")
 
+            # 订阅推送调度使用有序集合时,由Worker进程运行分发循环(多个Worker同时运行不会重复分发)
+            from push_scheduler import push_scheduler, PUSH_SCHEDULER_BACKEND
+            if PUSH_SCHEDULER_BACKEND == 'zset' and os.environ.get('PUSH_SCHEDULER_DISPATCHER', 'true').lower() == 'true':
+                push_scheduler.start()
+                logger.info("推送调度分发循环已启动")
+
             # 开始工作循环
             worker.work(with_scheduler=True)
 
@@ -2,22 +2,500 @@
 """
 搜索结果缓存服务
 用于优化相同主题词多用户订阅的PubMed API调用
-支持精确匹配和宽松匹配两级缓存策略
+按检索词缓存,支持精确命中和包含命中(更宽窗口/更大深度的缓存覆盖本次请求)
+两级缓存: 进程内LRU(L0) → Redis(L1),L0通过Redis发布订阅保持一致
+Redis未配置或不可用时回退到本地SQLite磁盘层
 """
 
+import os
+import queue
+import atexit
 import hashlib
-import json
+import struct
 import time
 import logging
-from typing import Optional, Dict, List, Tuple, Any
-from datetime import datetime, timedelta
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Iterable, List, Tuple, Any
+from datetime import datetime, date, timedelta
+
+from cache_codec import cache_codec
+from disk_cache import DiskCacheStore, DEFAULT_DISK_CACHE_PATH
 
 # 延迟导入避免循环依赖
 try:
-    from rq_config import redis_conn
+    from rq_config import redis_conn, cache_redis_conn
 except ImportError:
     redis_conn = None
-    logging.warning("Redis连接未初始化,缓存服务将降级为无缓存模式")
+    cache_redis_conn = None
+    logging.warning("Redis连接未初始化,缓存服务将仅使用本地磁盘层")
+
+# Redis不可达类异常(触发回退到磁盘层),其他异常仍按缓存读写失败处理
+try:
+    from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+    REDIS_UNAVAILABLE_ERRORS = (RedisConnectionError, RedisTimeoutError, OSError)
+except ImportError:
+    REDIS_UNAVAILABLE_ERRORS = (ConnectionError, TimeoutError, OSError)
+
+
+class LocalLRUCache:
+    """
+    进程内LRU缓存(按字节数限制容量)
+
+    条目大小按Redis原始值字节数估算,超出容量时淘汰最久未使用的条目;
+    max_age为兜底时效,防止发布订阅异常时长期持有旧数据
+    """
+
+    def __init__(self, max_bytes: int, max_age: int = 300):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        """获取条目,不存在或超过max_age时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, stored_at = entry
+            if time.time() - stored_at > self.max_age:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, size: int) -> None:
+        """写入条目(单个条目超过总容量时不缓存)"""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, size, time.time())
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def discard(self, key: str) -> None:
+        """删除条目"""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: str) -> None:
+        """删除条目(调用方需持有锁)"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+
+class CacheTelemetry:
+    """
+    缓存遥测
+
+    计数、延迟直方图、条目读取次数和热门检索词先在进程内累计,由后台线程
+    定期(或事件数达到上限时)通过一次pipeline写入Redis(HINCRBY/ZINCRBY),读路径上不增加Redis往返;
+    多进程并发累加也不会丢失计数。RQ任务子进程通过os._exit退出,由rq_worker在每个任务结束后调用flush
+    """
+
+    COUNTERS_KEY = "pubmed:cache_stats:counters"
+    LATENCY_KEY_PREFIX = "pubmed:cache_stats:latency"
+    HOT_KEYS_KEY = "pubmed:cache_stats:hot"
+    LAST_RESET_KEY = "pubmed:cache_stats:last_reset"
+
+    # 延迟直方图桶上限(毫秒),超出最后一个桶计入"+Inf"
+    LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+    FLUSH_INTERVAL = 5       # 秒
+    FLUSH_MAX_EVENTS = 500   # 累计事件数达到上限时立即写入
+    HOT_KEYS_LIMIT = 200     # 热门检索词最多保留数量
+
+    # 仅在条目仍存在时累加读取次数,避免为已过期的检索词重新创建没有TTL的Hash
+    READS_SCRIPT = """
+    if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+        return redis.call('HINCRBY', KEYS[1], ARGV[1] .. ARGV[2], ARGV[3])
+    end
+    return 0
+    """
+
+    def __init__(self, redis_connection, reads_suffix: str):
+        self.redis = redis_connection
+        self.reads_suffix = reads_suffix
+        self._lock = threading.Lock()
+        self._reset_buffers()
+        self._reset_thread()
+        self._reads_script = redis_connection.register_script(self.READS_SCRIPT) if redis_connection else None
+
+        # 进程正常退出时写入剩余计数
+        atexit.register(self.flush)
+        # fork出的子进程不继承父进程未写入的计数,避免重复累加
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        """累加计数器"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+            self._events += 1
+        self._maybe_flush()
+
+    def observe(self, histogram: str, seconds: float) -> None:
+        """记录一次延迟"""
+        elapsed_ms = seconds * 1000
+        bucket = next((f"le_{bound}" for bound in self.LATENCY_BUCKETS_MS if elapsed_ms <= bound), 'le_inf')
+        with self._lock:
+            buckets = self._histograms.setdefault(histogram, {})
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+            self._events += 1
+        self._maybe_flush()
+
+    def record_read(self, cache_key: str, field: str, label: str) -> None:
+        """记录条目读取(写入条目Hash的读取次数字段,并累加热门检索词)"""
+        with self._lock:
+            read_key = (cache_key, field)
+            self._reads[read_key] = self._reads.get(read_key, 0) + 1
+            self._events += 1
+        self.zincr(self.HOT_KEYS_KEY, label)
+
+    def zincr(self, key: str, member: str, amount: int = 1) -> None:
+        """累加有序集合成员分值"""
+        with self._lock:
+            members = self._zsets.setdefault(key, {})
+            members[member] = members.get(member, 0) + amount
+            self._events += 1
+        self._maybe_flush()
+
+    def flush(self) -> None:
+        """将本进程累计的遥测数据写入Redis"""
+        if self.redis is None:
+            return
+
+        with self._lock:
+            counters, histograms = self._counters, self._histograms
+            reads, zsets = self._reads, self._zsets
+            self._reset_buffers()
+
+        if not (counters or histograms or reads or zsets):
+            return
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for name, amount in counters.items():
+                pipe.hincrby(self.COUNTERS_KEY, name, amount)
+            for histogram, buckets in histograms.items():
+                for bucket, amount in buckets.items():
+                    pipe.hincrby(f"{self.LATENCY_KEY_PREFIX}:{histogram}", bucket, amount)
+            for (cache_key, field), amount in reads.items():
+                self._reads_script(keys=[cache_key], args=[field, self.reads_suffix, amount], client=pipe)
+            for key, members in zsets.items():
+                for member, amount in members.items():
+                    pipe.zincrby(key, amount, member)
+            if self.HOT_KEYS_KEY in zsets:
+                pipe.zremrangebyrank(self.HOT_KEYS_KEY, 0, -(self.HOT_KEYS_LIMIT + 1))
+            pipe.execute()
+        except Exception as e:
+            logging.error(f"写入缓存遥测失败: {e}")
+
+    def snapshot(self, top_n: int = 20) -> Dict[str, Any]:
+        """读取汇总后的遥测数据(先写入本进程的缓冲数据)"""
+        self.flush()
+
+        def decode_hash(raw: Dict[Any, Any]) -> Dict[str, int]:
+            return {
+                (name.decode('utf-8') if isinstance(name, bytes) else name): int(value)
+                for name, value in raw.items()
+            }
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(self.COUNTERS_KEY)
+        pipe.hgetall(f"{self.LATENCY_KEY_PREFIX}:lookup")
+        pipe.hgetall(f"{self.LATENCY_KEY_PREFIX}:fill")
+        pipe.zrevrange(self.HOT_KEYS_KEY, 0, top_n - 1, withscores=True)
+        pipe.get(self.LAST_RESET_KEY)
+        counters, lookup_latency, fill_latency, hot_keys, last_reset = pipe.execute()
+
+        bucket_names = [f"le_{bound}" for bound in self.LATENCY_BUCKETS_MS] + ['le_inf']
+        lookup_latency = decode_hash(lookup_latency)
+        fill_latency = decode_hash(fill_latency)
+
+        return {
+            'counters': decode_hash(counters),
+            'last_reset': last_reset.decode('utf-8') if isinstance(last_reset, bytes) else last_reset,
+            'latency_buckets': bucket_names,
+            'lookup_latency': [lookup_latency.get(name, 0) for name in bucket_names],
+            'fill_latency': [fill_latency.get(name, 0) for name in bucket_names],
+            'hot_keys': [
+                {
+                    'keywords': label.decode('utf-8') if isinstance(label, bytes) else label,
+                    'reads': int(score)
+                }
+                for label, score in hot_keys
+            ]
+        }
+
+    def reset(self) -> None:
+        """清空遥测数据"""
+        with self._lock:
+            self._reset_buffers()
+        self.redis.delete(
+            self.COUNTERS_KEY,
+            f"{self.LATENCY_KEY_PREFIX}:lookup",
+            f"{self.LATENCY_KEY_PREFIX}:fill",
+            self.HOT_KEYS_KEY
+        )
+        self.redis.set(self.LAST_RESET_KEY, datetime.now().isoformat())
+
+    def _reset_buffers(self) -> None:
+        """清空进程内缓冲(调用方需持有锁或在初始化时调用)"""
+        self._counters = {}
+        self._histograms = {}
+        self._reads = {}
+        self._zsets = {}
+        self._events = 0
+
+    def _reset_thread(self) -> None:
+        self._thread = None
+        self._pid = os.getpid()
+        self._wakeup = threading.Event()
+        self._thread_lock = threading.Lock()
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._reset_buffers()
+        self._reset_thread()
+
+    def _maybe_flush(self) -> None:
+        """确保后台写入线程在运行,事件数达到上限时唤醒它立即写入(不在调用方线程中访问Redis)"""
+        if self.redis is None:
+            return
+        if self._thread is None or self._pid != os.getpid():
+            with self._thread_lock:
+                if self._pid != os.getpid():
+                    self._after_fork()
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='cache-telemetry', daemon=True)
+                    self._thread.start()
+        if self._events >= self.FLUSH_MAX_EVENTS:
+            self._wakeup.set()
+
+    def _run(self) -> None:
+        # 事件数达到上限时被唤醒,否则每隔FLUSH_INTERVAL写入一次
+        while True:
+            self._wakeup.wait(self.FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"缓存遥测写入线程异常: {e}")
+
+
+class CacheBudget:
+    """
+    搜索缓存字节预算
+
+    检索词条目Hash按检索词记账;文章记录由多个检索词共享,单独记账并按引用计数管理:
+    每个检索词记录自己引用过的文章键,文章在第一个引用它的检索词写入时计入已用字节数,
+    最后一个引用它的检索词被释放时扣减字节数并删除该文章记录(记账为近似值)。
+    超出预算时采用近似TinyLFU准入: 随机抽样若干已缓存检索词,优先回收已过期的记账,
+    否则比较访问频率,新检索词的频率高于抽样中最低者才淘汰后者并写入,
+    否则拒绝写入。访问频率定期减半(老化),使过去的热点逐渐让位。
+    淘汰只删除搜索缓存自己的键,不会影响RQ队列数据;记账的读取和更新在Lua脚本中原子完成,
+    并在老化周期内按检索词和文章记账重新汇总已用字节数
+    """
+
+    SIZES_KEY = "pubmed:search_cache:budget:sizes"      # Hash: 检索词摘要 → 字节数
+    USED_KEY = "pubmed:search_cache:budget:used"        # 已用字节数
+    FREQ_KEY = "pubmed:search_cache:budget:freq"        # ZSET: 检索词摘要 → 访问频率
+    ARTICLE_REFS_KEY = "pubmed:search_cache:budget:article_refs"    # Hash: 文章键 → 引用的检索词数
+    ARTICLE_SIZES_KEY = "pubmed:search_cache:budget:article_sizes"  # Hash: 文章键 → 字节数
+    DIGEST_ARTICLES_PREFIX = "pubmed:search_cache:budget:articles"  # Set: 检索词引用的文章键
+    AGING_LOCK_KEY = "pubmed:search_cache:budget:aging"
+
+    SAMPLE_SIZE = 16
+    MAX_EVICTIONS = 32
+    AGING_INTERVAL = 3600  # 每小时访问频率减半
+
+    # 写入检索词记账并按差值调整已用字节数;ARGV[3..]为(文章键, 字节数)对,
+    # 检索词首次引用的文章增加引用计数,没有其他引用的文章计入已用字节数。返回调整后的已用字节数
+    RECORD_SCRIPT = """
+    local previous = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    local delta = tonumber(ARGV[2]) - previous
+    for i = 3, #ARGV, 2 do
+        if redis.call('SADD', KEYS[5], ARGV[i]) == 1 then
+            if redis.call('HINCRBY', KEYS[3], ARGV[i], 1) == 1 then
+                redis.call('HSET', KEYS[4], ARGV[i], ARGV[i + 1])
+                delta = delta + tonumber(ARGV[i + 1])
+            end
+        end
+    end
+    return redis.call('INCRBY', KEYS[2], delta)
+    """
+
+    # 删除检索词记账并释放它引用的文章,不再被引用的文章记录随之删除;返回释放的字节数
+    RELEASE_SCRIPT = """
+    local freed = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    for _, article_key in ipairs(redis.call('SMEMBERS', KEYS[5])) do
+        if redis.call('HINCRBY', KEYS[3], article_key, -1) <= 0 then
+            freed = freed + tonumber(redis.call('HGET', KEYS[4], article_key) or '0')
+            redis.call('HDEL', KEYS[3], article_key)
+            redis.call('HDEL', KEYS[4], article_key)
+            redis.call('DEL', article_key)
+        end
+    end
+    redis.call('DEL', KEYS[5])
+    if freed > 0 then
+        redis.call('DECRBY', KEYS[2], freed)
+    end
+    return freed
+    """
+
+    # 按检索词和文章记账重新汇总已用字节数
+    RECONCILE_SCRIPT = """
+    local total = 0
+    for _, size in ipairs(redis.call('HVALS', KEYS[1])) do
+        total = total + tonumber(size)
+    end
+    for _, size in ipairs(redis.call('HVALS', KEYS[3])) do
+        total = total + tonumber(size)
+    end
+    redis.call('SET', KEYS[2], total)
+    return total
+    """
+
+    def __init__(self, service: 'SearchCacheService', max_bytes: int):
+        self.service = service
+        self.redis = service.redis
+        self.max_bytes = max_bytes
+        if self.redis is not None:
+            self._record_script = self.redis.register_script(self.RECORD_SCRIPT)
+            self._release_script = self.redis.register_script(self.RELEASE_SCRIPT)
+            self._reconcile_script = self.redis.register_script(self.RECONCILE_SCRIPT)
+
+    def record_access(self, digest: str) -> None:
+        """记录检索词访问(经遥测缓冲批量写入)"""
+        self.service.telemetry.zincr(self.FREQ_KEY, digest)
+
+    def admit(self, digest: str, new_bytes: int) -> bool:
+        """
+        判断能否写入new_bytes字节,必要时淘汰低频检索词腾出空间
+
+        Returns:
+            bool: 是否准入
+        """
+        self._maybe_age()
+
+        if new_bytes > self.max_bytes:
+            return False
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(self.USED_KEY)
+        pipe.hget(self.SIZES_KEY, digest)
+        pipe.zscore(self.FREQ_KEY, digest)
+        used, current, candidate_freq = pipe.execute()
+
+        overflow = int(used or 0) - int(current or 0) + new_bytes - self.max_bytes
+        if overflow <= 0:
+            return True
+
+        candidate_freq = float(candidate_freq or 0)
+        for _ in range(self.MAX_EVICTIONS):
+            sample = [
+                (name.decode('utf-8') if isinstance(name, bytes) else name, int(size))
+                for name, size in self._sample_pairs()
+            ]
+            sample = [(name, size) for name, size in sample if name != digest]
+            if not sample:
+                return False
+
+            pipe = self.redis.pipeline(transaction=False)
+            for name, _ in sample:
+                pipe.exists(self.service.query_key_for_digest(name))
+            exists = pipe.execute()
+
+            # 已过期的检索词只需回收记账(连同只被它引用的文章)
+            expired = [name for (name, _), alive in zip(sample, exists) if not alive]
+            if expired:
+                for name in expired:
+                    overflow -= self.release(name)
+            else:
+                freqs = self.redis.zmscore(self.FREQ_KEY, [name for name, _ in sample])
+                victim, victim_freq = min(
+                    ((name, float(freq or 0)) for (name, _), freq in zip(sample, freqs)),
+                    key=lambda item: item[1]
+                )
+                if candidate_freq <= victim_freq:
+                    self.service.telemetry.incr('admission_rejected')
+                    return False
+                overflow -= self.service.evict_digest(victim)
+                self.service.telemetry.incr('evictions')
+
+            if overflow <= 0:
+                return True
+
+        return False
+
+    def record(self, digest: str, size: int, article_sizes: Iterable[Tuple[str, int]] = (), client=None) -> None:
+        """
+        记录检索词条目占用的字节数(原子地替换旧记账)及其引用的文章记录
+
+        Args:
+            digest: 检索词摘要
+            size: 条目Hash的字节数
+            article_sizes: (文章键, 字节数)列表,已被引用的文章不重复计入
+            client: 管道,传入时随管道执行
+        """
+        args = [digest, size]
+        for article_key, article_size in article_sizes:
+            args += [article_key, article_size]
+        self._record_script(keys=self._keys(digest), args=args, client=client)
+
+    def release(self, digest: str) -> int:
+        """释放检索词的记账和它对文章的引用(并发释放同一检索词只扣减一次),返回释放的字节数"""
+        return int(self._release_script(keys=self._keys(digest), args=[digest]) or 0)
+
+    def unreferenced_articles(self, article_keys: List[str]) -> List[bool]:
+        """文章记录是否尚未被任何检索词引用(写入时需要新计入预算)"""
+        if not article_keys:
+            return []
+        return [refs is None for refs in self.redis.hmget(self.ARTICLE_REFS_KEY, article_keys)]
+
+    def used_bytes(self) -> int:
+        """已记账的字节数"""
+        return int(self.redis.get(self.USED_KEY) or 0)
+
+    def _sample_pairs(self) -> List[Tuple[Any, Any]]:
+        """随机抽样已记账的检索词及其字节数"""
+        flat = self.redis.hrandfield(self.SIZES_KEY, self.SAMPLE_SIZE, withvalues=True) or []
+        return list(zip(flat[::2], flat[1::2]))
+
+    def _maybe_age(self) -> None:
+        """访问频率老化: 每个周期由一个进程将全部频率减半并删除接近0的成员"""
+        try:
+            if not self.redis.set(self.AGING_LOCK_KEY, 1, nx=True, ex=self.AGING_INTERVAL):
+                return
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.zunionstore(self.FREQ_KEY, {self.FREQ_KEY: 0.5})
+            pipe.zremrangebyscore(self.FREQ_KEY, '-inf', '(0.5')
+            pipe.execute()
+            self._reconcile_script(keys=[self.SIZES_KEY, self.USED_KEY, self.ARTICLE_SIZES_KEY])
+        except Exception as e:
+            logging.error(f"缓存访问频率老化失败: {e}")
+
+    def _keys(self, digest: str) -> List[str]:
+        return [self.SIZES_KEY, self.USED_KEY, self.ARTICLE_REFS_KEY, self.ARTICLE_SIZES_KEY,
+                f"{self.DIGEST_ARTICLES_PREFIX}:{digest}"]
 
 
 class SearchCacheService:
@@ -26,127 +504,201 @@ class SearchCacheService:
 
     设计原则:
     1. 零侵入: 在PubMedAPI层透明接入,业务逻辑无感知
-    2. 智能降级: Redis不可用时自动回退到直接搜索
-    3. 多级策略: 精确匹配 → 宽松匹配 → 直接搜索
+    2. 智能降级: Redis不可用时回退到本地磁盘层,磁盘层也未命中时直接搜索
+    3. 多级策略: 精确命中 → 包含命中 → 直接搜索
+    4. 本地筛选: 缓存未经期刊质量筛选的结果,筛选由调用方在本地完成
+    5. 两级缓存: 进程内L0只在失效订阅正常运行时使用,保证不返回已删除的数据
     """
 
     # 缓存键前缀
     CACHE_PREFIX = "pubmed:search_cache"
 
     # 缓存配置
-    DEFAULT_TTL = 3600  # 默认1小时
-    MAX_TTL = 86400     # 最大24小时
-    MIN_TTL = 1800      # 最小30分钟
+    # 软TTL内结果视为新鲜;软TTL之后到硬TTL之前仍直接返回,同时在后台刷新
+    SOFT_TTL = int(os.environ.get('SEARCH_CACHE_SOFT_TTL', 3600))      # 默认1小时
+    HARD_TTL = int(os.environ.get('SEARCH_CACHE_HARD_TTL', 6 * 3600))  # 默认6小时
+    REFRESH_LOCK_TTL = 600  # 后台刷新锁10分钟,避免同一条目重复刷新
+
+    # 检索词缓存前缀(Hash: 字段为"截止日期:天数:深度",值为该条目元数据)
+    QUERY_PREFIX = f"{CACHE_PREFIX}:q"
+
+    # 条目PMID列表字段后缀(值为大端uint32打包的PMID序列)
+    PMIDS_FIELD_SUFFIX = "#pmids"
+
+    # 条目读取次数字段后缀(决定过期后是否值得后台刷新)
+    READS_FIELD_SUFFIX = "#reads"
+
+    # 后台刷新锁前缀
+    REFRESH_LOCK_PREFIX = f"{CACHE_PREFIX}:refresh_lock"
+
+    # 文章记录前缀(PMID → 文章详情,各检索词共享)
+    ARTICLE_PREFIX = f"{CACHE_PREFIX}:article"
 
-    # 统计键
-    STATS_KEY = "pubmed:cache_stats"
+    # 缓存字节预算(只统计搜索缓存自身,默认128MB)
+    MAX_BYTES = int(os.environ.get('SEARCH_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+
+    # 进程内L0缓存配置
+    L0_ENABLED = os.environ.get('SEARCH_CACHE_L0_ENABLED', 'true').lower() == 'true'
+    L0_MAX_BYTES = int(os.environ.get('SEARCH_CACHE_L0_MAX_BYTES', 16 * 1024 * 1024))  # 默认16MB
+    L0_MAX_AGE = 300  # L0条目最长保留5分钟
+
+    # L0失效广播频道(消息为检索词缓存键,"*"表示清空全部)
+    INVALIDATION_CHANNEL = f"{CACHE_PREFIX}:invalidate"
+
+    # 本地磁盘层配置(Redis正常时由后台线程写入,Redis不可用时同步写入并读取)
+    DISK_ENABLED = os.environ.get('SEARCH_CACHE_DISK_ENABLED', 'true').lower() == 'true'
+    DISK_PATH = os.environ.get('SEARCH_CACHE_DISK_PATH', DEFAULT_DISK_CACHE_PATH)
+    DISK_MAX_BYTES = int(os.environ.get('SEARCH_CACHE_DISK_MAX_BYTES', 256 * 1024 * 1024))  # 默认256MB
+    DISK_WRITE_QUEUE_MAX = 256  # 等待后台写入磁盘层的条目上限,超出时丢弃
+
+    # Redis读写失败后暂停使用Redis的秒数,期间直接使用磁盘层,避免每次请求都等待连接超时
+    REDIS_RETRY_INTERVAL = 30
+
+    # 数据层级(高层级包含低层级的全部信息)
+    LEVELS = {'pmids': 0, 'issn': 1, 'articles': 2}
+
+    # 旧版统计键(JSON字符串,重置统计时删除)
+    LEGACY_STATS_KEY = "pubmed:cache_stats"
 
     def __init__(self, redis_connection=None):
         """
         初始化缓存服务
 
         Args:
-            redis_connection: Redis连接实例,默认使用rq_config中的连接
+            redis_connection: Redis连接实例,默认使用rq_config中的搜索缓存专用连接
         """
-        self.redis = redis_connection or redis_conn
+        self.redis = redis_connection or cache_redis_conn
+        self.queue_redis = redis_conn
         self.enabled = self.redis is not None
 
+        # L0缓存: 检索词缓存键 → (条目字典, 本进程已计入读取次数的字段集合);
+        # 文章记录键 → 文章详情
+        self.l0 = LocalLRUCache(self.L0_MAX_BYTES, self.L0_MAX_AGE)
+        self._subscriber_thread = None
+        self._subscriber_pid = None
+        self._subscriber_lock = threading.Lock()
+
+        self.telemetry = CacheTelemetry(self.redis, self.READS_FIELD_SUFFIX)
+        self.budget = CacheBudget(self, self.MAX_BYTES)
+
+        self.disk = DiskCacheStore(self.DISK_PATH, self.DISK_MAX_BYTES) if self.DISK_ENABLED else None
+        self._redis_down_until = 0
+        self._reset_disk_writer()
+
+        # 进程正常退出时写完排队的磁盘层写入;fork出的子进程不继承父进程的写入队列
+        atexit.register(self.flush_disk_writes)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_disk_writer)
+
         if not self.enabled:
-            logging.warning("SearchCacheService: Redis未配置,缓存功能已禁用")
+            if self.disk is not None:
+                logging.warning(f"SearchCacheService: Redis未配置,仅使用本地磁盘缓存: {self.DISK_PATH}")
+            else:
+                logging.warning("SearchCacheService: Redis未配置,缓存功能已禁用")
         else:
             logging.info("SearchCacheService: 初始化成功,缓存功能已启用")
 
-    def generate_cache_key(
-        self,
-        keywords: str,
-        filter_params: Dict[str, Any],
-        include_filters: bool = True
-    ) -> str:
+    def generate_cache_key(self, keywords: str) -> str:
         """
         生成缓存键
 
+        缓存键只由标准化后的检索词决定;搜索天数和检索深度作为条目属性
+        保存在同一个Hash的不同字段中,期刊质量筛选由调用方在本地完成
+
         Args:
             keywords: 搜索关键词
-            filter_params: 筛选参数字典
-            include_filters: 是否包含筛选参数(False用于宽松匹配)
 
         Returns:
-            str: 缓存键的哈希值
-        """
-        # 标准化关键词(去除多余空格,转小写)
-        normalized_keywords = ' '.join(keywords.lower().strip().split())
-
-        # 构建缓存键组成部分
-        key_parts = [normalized_keywords]
-
-        if include_filters and filter_params:
-            # 提取核心筛选参数(影响搜索结果的参数)
-            core_params = {
-                'days_back': filter_params.get('days_back', 30),
-                'max_results': filter_params.get('max_results', 10000),
-                'jcr_filter': filter_params.get('jcr_filter'),
-                'zky_filter': filter_params.get('zky_filter'),
-                'exclude_no_issn': filter_params.get('exclude_no_issn', True)
-            }
-
-            # 序列化为稳定的JSON字符串
-            params_json = json.dumps(core_params, sort_keys=True, ensure_ascii=False)
-            key_parts.append(params_json)
-
-        # 生成MD5哈希
-        key_string = '|'.join(key_parts)
-        hash_digest = hashlib.md5(key_string.encode('utf-8')).hexdigest()
+            str: 缓存键
+        """
+        return self.query_key_for_digest(self._keywords_digest(keywords))
 
-        return f"{self.CACHE_PREFIX}:{hash_digest}"
+    def query_key_for_digest(self, digest: str) -> str:
+        """由检索词摘要得到缓存键"""
+        return f"{self.QUERY_PREFIX}:{digest}"
 
     def get_cached_results(
         self,
         keywords: str,
-        filter_params: Dict[str, Any]
+        filter_params: Dict[str, Any],
+        require: str = 'articles',
+        record_stats: bool = True
     ) -> Optional[Dict[str, Any]]:
         """
         获取缓存的搜索结果
 
-        尝试顺序:
-        1. 精确匹配(包含所有筛选参数)
-        2. 宽松匹配(仅关键词,忽略筛选参数)
+        从该检索词的所有缓存条目中选择能覆盖本次请求的条目:
+        1. 精确命中: 时间窗口和检索深度完全相同
+        2. 包含命中: 同一窗口但缓存深度更大(取前N个),
+           或缓存窗口更宽且已是完整结果(按发表日期本地过滤后取前N个)
+
+        超过软TTL(或跨天)的条目仍直接返回并标记stale,若该条目此前被读取过,
+        则提交低优先级任务在后台刷新;从未被读取的条目任其到硬TTL后过期
 
         Args:
             keywords: 搜索关键词
-            filter_params: 筛选参数
+            filter_params: 筛选参数,仅使用其中的days_back和max_results
+            require: 需要的数据层级 'pmids' | 'issn' | 'articles'
+            record_stats: 是否计入命中统计
 
         Returns:
-            Optional[Dict]: 缓存数据或None
+            Optional[Dict]: {'pmids', 'articles', 'issn_map', 'hit_type', 'stale'} 或None,
+            仅require='articles'时返回articles
         """
-        if not self.enabled:
-            return None
+        days_back = int(filter_params.get('days_back', 30))
+        max_results = int(filter_params.get('max_results', 10000))
 
+        if not self._redis_available():
+            return self._get_from_disk(keywords, days_back, max_results, require)
+
+        started_at = time.perf_counter()
         try:
-            # 1. 尝试精确匹配
-            exact_key = self.generate_cache_key(keywords, filter_params, include_filters=True)
-            cached_data = self._get_from_redis(exact_key)
-
-            if cached_data:
-                logging.info(f"[缓存命中-精确] 关键词: {keywords[:50]}")
-                self._record_hit(cache_type='exact')
-                return cached_data
-
-            # 2. 尝试宽松匹配
-            relaxed_key = self.generate_cache_key(keywords, filter_params, include_filters=False)
-            cached_data = self._get_from_redis(relaxed_key)
-
-            if cached_data:
-                logging.info(f"[缓存命中-宽松] 关键词: {keywords[:50]}, 需二次筛选")
-                self._record_hit(cache_type='relaxed')
-                # 注意: 宽松匹配返回的数据需要调用方进行二次筛选
-                cached_data['requires_filtering'] = True
-                return cached_data
-
-            # 3. 缓存未命中
-            logging.info(f"[缓存未命中] 关键词: {keywords[:50]}")
-            self._record_miss()
+            cache_key = self.generate_cache_key(keywords)
+            variants, read_fields, tier = self._load_variants_tiered(cache_key)
+
+            field, result = self._select_variant(variants, days_back, max_results, require)
+
+            if result and require == 'articles':
+                # 只读取本次实际用到的文章记录
+                result['articles'] = self._get_articles(result['pmids'])
+                if result['articles'] is None:
+                    logging.info(f"[缓存文章缺失] 关键词: {keywords[:50]}, 部分文章记录已过期或被淘汰")
+                    result = None
+
+            if record_stats:
+                self.telemetry.observe('lookup', time.perf_counter() - started_at)
+                self.telemetry.incr(tier if result else 'misses')
+                self.budget.record_access(self._keywords_digest(keywords))
+
+            if result:
+                # 读取次数: 加载时Redis中的计数 + 本进程加载后已读取过的记为1次;
+                # 本次读取经缓冲批量写回,不增加读路径的Redis往返
+                previous_reads = variants[field].get('reads', 0)
+                if read_fields is not None and field in read_fields:
+                    previous_reads += 1
+                if read_fields is not None:
+                    read_fields.add(field)
+                self.telemetry.record_read(cache_key, field, self._normalize_keywords(keywords)[:200])
+
+                hit_label = '精确' if result['hit_type'] == 'exact' else '包含'
+                if result['stale']:
+                    hit_label += '-过期'
+                    if previous_reads > 0:
+                        self._schedule_refresh(keywords, variants[field])
+                if record_stats:
+                    self.telemetry.incr(f"{result['hit_type']}_hits")
+                    if result['stale']:
+                        self.telemetry.incr('stale_hits')
+                if tier == 'l1_hits':
+                    logging.info(f"[缓存命中-{hit_label}] 关键词: {keywords[:50]}, 天数: {days_back}, 深度: {max_results}")
+                return result
+
+            logging.info(f"[缓存未命中] 关键词: {keywords[:50]}, 天数: {days_back}, 深度: {max_results}")
             return None
 
+        except REDIS_UNAVAILABLE_ERRORS as e:
+            self._mark_redis_down(e)
+            return self._get_from_disk(keywords, days_back, max_results, require)
         except Exception as e:
             logging.error(f"缓存读取失败: {e}", exc_info=True)
             return None
@@ -156,54 +708,148 @@ class SearchCacheService:
         keywords: str,
         filter_params: Dict[str, Any],
         pmids: List[str],
-        articles: List[Dict[str, Any]],
+        articles: Optional[List[Dict[str, Any]]] = None,
+        issn_map: Optional[Dict[str, List[str]]] = None,
         ttl: Optional[int] = None
     ) -> bool:
         """
         设置缓存结果
 
+        每个条目记录自己的时间窗口(截止日期+天数)和检索深度,
+        写入时会清理被新条目完全覆盖的旧条目。PMID列表打包为整数序列,
+        文章详情按PMID写入共享记录,相同文章在多个检索词之间只存一份。
+        条目同时交给后台线程写入本地磁盘层,保证Redis故障时已有可用的缓存;
+        Redis不可用时才在调用方线程中同步写入磁盘层
+
         Args:
             keywords: 搜索关键词
-            filter_params: 筛选参数
-            pmids: PMID列表
-            articles: 文章详细信息列表
-            ttl: 缓存时效(秒),默认使用智能计算
+            filter_params: 筛选参数,仅使用其中的days_back和max_results
+            pmids: PMID列表(按相关性排序,未经期刊筛选)
+            articles: 文章详细信息列表(未经期刊筛选),可选
+            issn_map: PMID→[ISSN, eISSN, 发表日期]映射,可选
+            ttl: 软TTL(秒),默认SOFT_TTL;硬TTL为ttl与HARD_TTL中的较大者
 
         Returns:
             bool: 是否设置成功
         """
-        if not self.enabled:
+        if not self.enabled and self.disk is None:
             return False
 
+        started_at = time.perf_counter()
+        disk_saved = False
         try:
-            # 生成精确匹配的缓存键
-            cache_key = self.generate_cache_key(keywords, filter_params, include_filters=True)
-
-            # 计算智能TTL(根据结果数量和当前时间)
-            if ttl is None:
-                ttl = self._calculate_dynamic_ttl(keywords, len(pmids))
-
-            # 构建缓存数据 (确保所有数据都可JSON序列化)
-            cache_data = {
-                'pmids': pmids,
-                'articles': self._sanitize_for_json(articles),
+            cache_key = self.generate_cache_key(keywords)
+            days_back = int(filter_params.get('days_back', 30))
+            max_results = int(filter_params.get('max_results', 10000))
+
+            soft_ttl = ttl or self.SOFT_TTL
+            hard_ttl = max(soft_ttl, self.HARD_TTL)
+
+            packed_pmids = self._pack_pmids(pmids)
+            if packed_pmids is None:
+                logging.warning(f"[缓存跳过] 关键词: {keywords[:50]}, PMID格式异常无法打包")
+                return False
+
+            if articles is not None:
+                # 文章条目同样保存ISSN映射,供更窄窗口按发表日期过滤;
+                # 映射同时标记哪些PMID有文章记录(efetch可能少返回部分文章)
+                issn_map = {}
+                for article in articles:
+                    issn_map.setdefault(article.get('pmid'), [
+                        article.get('issn', ''),
+                        article.get('eissn', ''),
+                        self._date_string(article.get('publish_date'))
+                    ])
+
+            now = time.time()
+            variant = {
+                'days_back': days_back,
+                'max_results': max_results,
+                'end_date': datetime.now().date().isoformat(),
+                'pmids': list(pmids),
+                'issn_map': issn_map,
+                'has_articles': articles is not None,
                 'created_at': datetime.now().isoformat(),
-                'keywords': keywords,
-                'filter_params': self._sanitize_for_json(filter_params),
-                'hit_count': 0,
-                'result_count': len(pmids)
+                'soft_expires_at': now + soft_ttl,
+                'expires_at': now + hard_ttl
             }
-
-            # 序列化并存储
-            cache_value = json.dumps(cache_data, ensure_ascii=False)
-            self.redis.setex(cache_key, ttl, cache_value)
-
-            logging.info(f"[缓存设置] 关键词: {keywords[:50]}, 结果数: {len(pmids)}, TTL: {ttl}秒")
+            field = self._variant_field(variant)
+            digest = self._keywords_digest(keywords)
+
+            if not self._redis_available():
+                return self._save_to_disk(digest, field, variant, articles)
+            disk_saved = self._queue_disk_write(digest, field, variant, articles)
+
+            # 清理过期条目和被新条目覆盖的条目
+            raw_fields = self.redis.hgetall(cache_key)
+            variants = self._decode_variants(raw_fields, include_expired=True)
+            stale_fields = self._superseded_fields(variants, variant, field, now)
+
+            remaining_expiry = [
+                existing['expires_at'] for name, existing in variants.items()
+                if name not in stale_fields and name != field
+            ]
+            key_ttl = int(max(remaining_expiry + [variant['expires_at']]) - now) + 1
+
+            meta = {name: value for name, value in variant.items() if name != 'pmids'}
+            encoded_meta = cache_codec.encode(meta)
+            encoded_articles = [
+                (f"{self.ARTICLE_PREFIX}:{article.get('pmid')}", cache_codec.encode(article))
+                for article in (articles or [])
+            ]
+
+            # 字节预算准入: 保留的旧条目 + 新条目 + 尚未被任何检索词引用的文章记录
+            # (文章记录单独记账,被多个检索词引用时只计一次)
+            article_sizes = [(key, len(key) + len(value)) for key, value in encoded_articles]
+            unreferenced = self.budget.unreferenced_articles([key for key, _ in article_sizes])
+            removed_fields = {name for stale_field in stale_fields + [field]
+                              for name in self._variant_field_names(stale_field)}
+            entry_bytes = sum(
+                len(name) + len(value) for name, value in raw_fields.items()
+                if (name.decode('utf-8') if isinstance(name, bytes) else name) not in removed_fields
+            )
+            entry_bytes += len(field) * 2 + len(encoded_meta) + len(packed_pmids)
+            new_article_bytes = sum(size for (_, size), new in zip(article_sizes, unreferenced) if new)
+
+            if not self.budget.admit(digest, entry_bytes + new_article_bytes):
+                logging.info(f"[缓存拒绝写入] 关键词: {keywords[:50]}, 大小: {entry_bytes + new_article_bytes}字节, "
+                             f"访问频率低于预算内的已缓存检索词")
+                return False
+
+            pipe = self.redis.pipeline(transaction=False)
+            # 先记账引用文章,使并发释放其他检索词时不会删除本次要写入的文章记录
+            self.budget.record(digest, entry_bytes, article_sizes, client=pipe)
+            # 已存在的文章记录只延长有效期,不缩短其他检索词仍在使用的记录
+            for article_key, encoded_article in encoded_articles:
+                pipe.set(article_key, encoded_article, ex=hard_ttl, nx=True)
+                pipe.expire(article_key, hard_ttl, gt=True)
+            pipe.hset(cache_key, mapping={
+                field: encoded_meta,
+                field + self.PMIDS_FIELD_SUFFIX: packed_pmids
+            })
+            # 新条目重新开始统计读取次数
+            pipe.hdel(cache_key, field + self.READS_FIELD_SUFFIX)
+            if stale_fields:
+                pipe.hdel(cache_key, *[name for stale_field in stale_fields
+                                       for name in self._variant_field_names(stale_field)])
+            pipe.expire(cache_key, key_ttl)
+            pipe.publish(self.INVALIDATION_CHANNEL, cache_key)
+            pipe.execute()
+            self.l0.discard(cache_key)
+
+            self.telemetry.observe('fill', time.perf_counter() - started_at)
+            self.telemetry.incr('fills')
+
+            logging.info(f"[缓存设置] 关键词: {keywords[:50]}, 天数: {days_back}, 深度: {max_results}, "
+                         f"结果数: {len(pmids)}, 清理旧条目: {len(stale_fields)}, TTL: {soft_ttl}/{hard_ttl}秒")
             return True
 
+        except REDIS_UNAVAILABLE_ERRORS as e:
+            self._mark_redis_down(e)
+            return disk_saved
         except Exception as e:
             logging.error(f"缓存写入失败: {e}", exc_info=True)
-            return False
+            return disk_saved
 
     def invalidate_cache(self, keywords: str, filter_params: Dict[str, Any] = None) -> bool:
         """
@@ -216,26 +862,41 @@ class SearchCacheService:
         Returns:
             bool: 是否成功
         """
-        if not self.enabled:
-            return False
+        disk_deleted = self._invalidate_disk(keywords, filter_params)
+        if not self._redis_available():
+            return disk_deleted > 0
 
         try:
+            cache_key = self.generate_cache_key(keywords)
+
             if filter_params is None:
-                # 删除该关键词的所有缓存(精确+宽松)
-                exact_key = self.generate_cache_key(keywords, {}, include_filters=True)
-                relaxed_key = self.generate_cache_key(keywords, {}, include_filters=False)
-                deleted = self.redis.delete(exact_key, relaxed_key)
-            else:
-                # 删除特定参数的缓存
-                cache_key = self.generate_cache_key(keywords, filter_params, include_filters=True)
+                # 删除该关键词的所有条目
                 deleted = self.redis.delete(cache_key)
-
-            logging.info(f"[缓存失效] 关键词: {keywords[:50]}, 删除: {deleted}个键")
-            return deleted > 0
-
+                self.budget.release(self._keywords_digest(keywords))
+            else:
+                # 删除特定时间窗口和深度的条目
+                days_back = int(filter_params.get('days_back', 30))
+                max_results = int(filter_params.get('max_results', 10000))
+                fields = [
+                    name for name, variant in self._load_variants(cache_key, include_expired=True).items()
+                    if variant['days_back'] == days_back and variant['max_results'] == max_results
+                ]
+                if fields:
+                    self.redis.hdel(cache_key, *[name for field in fields
+                                                 for name in self._variant_field_names(field)])
+                deleted = len(fields)
+
+            self._broadcast_invalidation(cache_key)
+
+            logging.info(f"[缓存失效] 关键词: {keywords[:50]}, 删除: {deleted}个条目")
+            return deleted > 0 or disk_deleted > 0
+
+        except REDIS_UNAVAILABLE_ERRORS as e:
+            self._mark_redis_down(e)
+            return disk_deleted > 0
         except Exception as e:
             logging.error(f"缓存失效失败: {e}", exc_info=True)
-            return False
+            return disk_deleted > 0
 
     def get_cache_stats(self) -> Dict[str, Any]:
         """
@@ -247,21 +908,19 @@ class SearchCacheService:
         if not self.enabled:
             return {
                 'enabled': False,
-                'message': 'Redis缓存未启用'
+                'message': 'Redis缓存未启用',
+                'disk': self._disk_stats()
             }
 
         try:
-            stats_data = self.redis.get(self.STATS_KEY)
-            if stats_data:
-                stats = json.loads(stats_data)
-            else:
-                stats = {
-                    'total_hits': 0,
-                    'exact_hits': 0,
-                    'relaxed_hits': 0,
-                    'total_misses': 0,
-                    'last_reset': datetime.now().isoformat()
-                }
+            telemetry = self.telemetry.snapshot()
+            counters = telemetry['counters']
+
+            stats = self._empty_stats()
+            stats.update({name: counters.get(name, 0) for name in stats if name != 'last_reset'})
+            stats['last_reset'] = telemetry['last_reset']
+            stats['total_hits'] = stats['exact_hits'] + stats['subsumption_hits']
+            stats['total_misses'] = counters.get('misses', 0)
 
             # 计算命中率
             total_requests = stats['total_hits'] + stats['total_misses']
@@ -272,19 +931,31 @@ class SearchCacheService:
             stats['enabled'] = True
 
             # 获取当前缓存键数量
-            cache_count = 0
-            cursor = 0
-            while True:
-                cursor, keys = self.redis.scan(
-                    cursor=cursor,
-                    match=f"{self.CACHE_PREFIX}:*",
-                    count=100
-                )
-                cache_count += len(keys)
-                if cursor == 0:
-                    break
+            cache_count = self._count_keys(f"{self.QUERY_PREFIX}:*")
 
             stats['cache_count'] = cache_count
+            stats['article_count'] = self._count_keys(f"{self.ARTICLE_PREFIX}:*")
+
+            # 分级命中率: L0为所有查询中由进程内缓存直接返回的比例,
+            # L1为未命中L0的查询中由Redis返回的比例
+            l0_hits = counters.get('l0_hits', 0)
+            l1_hits = counters.get('l1_hits', 0)
+            stats['l0_hits'] = l0_hits
+            stats['l1_hits'] = l1_hits
+            stats['l0_hit_rate'] = round(l0_hits / total_requests * 100, 2) if total_requests else 0
+            stats['l1_hit_rate'] = (
+                round(l1_hits / (total_requests - l0_hits) * 100, 2) if total_requests > l0_hits else 0
+            )
+            stats['l0_entries'] = len(self.l0)
+            stats['l0_bytes'] = self.l0.current_bytes
+
+            # 延迟直方图和热门检索词
+            stats['fills'] = counters.get('fills', 0)
+            stats['latency_buckets'] = telemetry['latency_buckets']
+            stats['lookup_latency'] = telemetry['lookup_latency']
+            stats['fill_latency'] = telemetry['fill_latency']
+            stats['hot_keys'] = telemetry['hot_keys']
+            stats['disk'] = self._disk_stats()
 
             return stats
 
@@ -292,7 +963,8 @@ class SearchCacheService:
             logging.error(f"获取统计信息失败: {e}", exc_info=True)
             return {
                 'enabled': True,
-                'error': str(e)
+                'error': str(e),
+                'disk': self._disk_stats()
             }
 
     def reset_cache_stats(self) -> bool:
@@ -301,29 +973,110 @@ class SearchCacheService:
             return False
 
         try:
-            stats = {
-                'total_hits': 0,
-                'exact_hits': 0,
-                'relaxed_hits': 0,
-                'total_misses': 0,
-                'last_reset': datetime.now().isoformat()
-            }
-            self.redis.set(self.STATS_KEY, json.dumps(stats))
+            self.telemetry.reset()
+            self.redis.delete(self.LEGACY_STATS_KEY)
             logging.info("[缓存统计] 已重置")
             return True
         except Exception as e:
             logging.error(f"重置统计失败: {e}", exc_info=True)
             return False
 
+    def evict_digest(self, digest: str) -> int:
+        """
+        淘汰检索词(预算不足时调用)
+
+        仍被其他检索词引用的文章记录保留,只被该检索词引用的文章记录随之删除
+
+        Returns:
+            int: 释放的字节数
+        """
+        cache_key = self.query_key_for_digest(digest)
+        self.redis.delete(cache_key)
+        freed = self.budget.release(digest)
+        self._broadcast_invalidation(cache_key)
+        logging.info(f"[缓存淘汰] 检索词摘要: {digest}, 释放: {freed}字节")
+        return freed
+
+    def get_memory_usage(self, scan_limit: int = 20000, sample_per_family: int = 200) -> Dict[str, Any]:
+        """
+        按键族统计Redis内存占用(MEMORY USAGE抽样估算)
+
+        分别扫描搜索缓存库和队列库,每个键族抽样若干键计算平均大小,
+        再乘以该键族的键数量得到估算值
+
+        Args:
+            scan_limit: 每个库最多扫描的键数量
+            sample_per_family: 每个键族抽样的键数量
+
+        Returns:
+            Dict: {'info': Redis内存信息, 'families': 键族列表}
+        """
+        if not self.enabled:
+            return {'enabled': False, 'message': 'Redis缓存未启用'}
+
+        connections = [('搜索缓存库', self.redis)]
+        if self.queue_redis is not None and not self._same_database(self.redis, self.queue_redis):
+            connections.append(('队列库', self.queue_redis))
+
+        families = []
+        for db_label, connection in connections:
+            keys_by_family = {}
+            scanned = 0
+            for key in connection.scan_iter(count=1000):
+                key = key.decode('utf-8') if isinstance(key, bytes) else key
+                keys_by_family.setdefault(self._key_family(key), []).append(key)
+                scanned += 1
+                if scanned >= scan_limit:
+                    break
+
+            for family, keys in keys_by_family.items():
+                sample = keys[:sample_per_family]
+                pipe = connection.pipeline(transaction=False)
+                for key in sample:
+                    pipe.memory_usage(key)
+                sizes = [size for size in pipe.execute() if size is not None]
+                average = sum(sizes) / len(sizes) if sizes else 0
+                families.append({
+                    'database': db_label,
+                    'family': family,
+                    'key_count': len(keys),
+                    'sampled': len(sizes),
+                    'avg_bytes': int(average),
+                    'estimated_bytes': int(average * len(keys)),
+                    'truncated': scanned >= scan_limit
+                })
+
+        families.sort(key=lambda item: item['estimated_bytes'], reverse=True)
+
+        memory_info = self.redis.info('memory')
+        return {
+            'enabled': True,
+            'info': {
+                'used_memory': memory_info.get('used_memory', 0),
+                'maxmemory': memory_info.get('maxmemory', 0),
+                'maxmemory_policy': memory_info.get('maxmemory_policy', ''),
+                'cache_budget_bytes': self.MAX_BYTES,
+                'cache_budget_used': self.budget.used_bytes()
+            },
+            'families': families
+        }
+
     def clear_all_cache(self) -> int:
         """
         清空所有搜索缓存
 
         Returns:
-            int: 删除的缓存键数量
+            int: 删除的缓存键数量(含磁盘层删除的行数)
         """
-        if not self.enabled:
-            return 0
+        disk_deleted = 0
+        if self.disk is not None:
+            try:
+                disk_deleted = self.disk.clear()
+            except Exception as e:
+                logging.error(f"清空磁盘缓存失败: {e}", exc_info=True)
+
+        if not self._redis_available():
+            return disk_deleted
 
         try:
             # 使用SCAN遍历所有匹配的键(避免KEYS阻塞)
@@ -343,142 +1096,566 @@ class SearchCacheService:
                 if cursor == 0:
                     break
 
-            logging.info(f"[缓存清空] 删除 {deleted_count} 个缓存键")
-            return deleted_count
+            self._broadcast_invalidation('*')
+
+            logging.info(f"[缓存清空] 删除 {deleted_count} 个缓存键, 磁盘层 {disk_deleted} 行")
+            return deleted_count + disk_deleted
 
         except Exception as e:
             logging.error(f"清空缓存失败: {e}", exc_info=True)
-            return 0
+            return disk_deleted
 
     # ==================== 私有辅助方法 ====================
 
-    def _get_from_redis(self, key: str) -> Optional[Dict[str, Any]]:
-        """从Redis获取并反序列化数据"""
-        try:
-            cached_value = self.redis.get(key)
-            if cached_value:
-                # 增加命中计数
-                self.redis.incr(f"{key}:hits")
-                return json.loads(cached_value)
+    def _redis_available(self) -> bool:
+        """Redis已配置且不在故障暂停期内"""
+        return self.enabled and time.time() >= self._redis_down_until
+
+    def _mark_redis_down(self, error: Exception) -> None:
+        """Redis不可达: 暂停使用Redis,期间读写走磁盘层"""
+        self._redis_down_until = time.time() + self.REDIS_RETRY_INTERVAL
+        # 暂停期间收不到失效广播,L0中的数据可能过时
+        self.l0.clear()
+        logging.warning(f"搜索缓存Redis不可用,{self.REDIS_RETRY_INTERVAL}秒内使用本地磁盘缓存: {error}")
+
+    def _superseded_fields(
+        self,
+        variants: Dict[str, Dict[str, Any]],
+        variant: Dict[str, Any],
+        field: str,
+        now: float
+    ) -> List[str]:
+        """写入新条目时需要删除的旧条目: 已过期或被新条目完全覆盖"""
+        return [
+            name for name, existing in variants.items()
+            if name != field and (
+                existing['expires_at'] <= now
+                or self._variant_covers(variant, existing, require=self._variant_level(existing))
+            )
+        ]
+
+    def _get_from_disk(
+        self,
+        keywords: str,
+        days_back: int,
+        max_results: int,
+        require: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        从磁盘层读取缓存结果(Redis不可用时使用)
+
+        选择规则与Redis层相同;不计入命中统计,也不提交后台刷新(任务队列同样依赖Redis)
+        """
+        if self.disk is None:
             return None
+
+        try:
+            variants = self.disk.load_variants(self._keywords_digest(keywords))
+            _, result = self._select_variant(variants, days_back, max_results, require)
+
+            if result and require == 'articles':
+                result['articles'] = self.disk.get_articles(result['pmids'])
+                if result['articles'] is None:
+                    result = None
+
+            if result:
+                logging.info(f"[磁盘缓存命中] 关键词: {keywords[:50]}, 天数: {days_back}, 深度: {max_results}")
+            else:
+                logging.info(f"[磁盘缓存未命中] 关键词: {keywords[:50]}, 天数: {days_back}, 深度: {max_results}")
+            return result
+
         except Exception as e:
-            logging.error(f"Redis读取失败: {e}")
+            logging.error(f"磁盘缓存读取失败: {e}", exc_info=True)
             return None
 
-    def _calculate_dynamic_ttl(self, keywords: str, result_count: int) -> int:
-        """
-        智能计算缓存TTL
+    def _save_to_disk(
+        self,
+        digest: str,
+        field: str,
+        variant: Dict[str, Any],
+        articles: Optional[List[Dict[str, Any]]]
+    ) -> bool:
+        """将条目写入磁盘层,同时清理磁盘层中被覆盖的旧条目"""
+        if self.disk is None:
+            return False
 
-        策略:
-        - 结果数多: 更长TTL(可能是热门关键词)
-        - 工作时间: 较短TTL(更新频繁)
-        - 夜间/周末: 较长TTL(更新较少)
+        try:
+            existing = self.disk.load_variants(digest, include_expired=True)
+            stale_fields = self._superseded_fields(existing, variant, field, time.time())
+            self.disk.save_variant(digest, field, variant, stale_fields, articles)
+            return True
+        except Exception as e:
+            logging.error(f"磁盘缓存写入失败: {e}", exc_info=True)
+            return False
 
-        Args:
-            keywords: 关键词
-            result_count: 结果数量
+    def flush_disk_writes(self) -> None:
+        """在调用方线程中写完排队的磁盘层写入,并等待后台线程正在进行的写入(RQ任务结束和进程退出时调用)"""
+        while True:
+            try:
+                item = self._disk_writes.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self._save_to_disk(*item)
+            finally:
+                self._disk_writes.task_done()
+        self._disk_writes.join()
+
+    def _queue_disk_write(
+        self,
+        digest: str,
+        field: str,
+        variant: Dict[str, Any],
+        articles: Optional[List[Dict[str, Any]]]
+    ) -> bool:
+        """将磁盘层写入交给后台线程,不在搜索和推送路径上持有SQLite写锁;队列已满时丢弃"""
+        if self.disk is None:
+            return False
+        if self._disk_writer is None:
+            with self._disk_writer_lock:
+                if self._disk_writer is None:
+                    self._disk_writer = threading.Thread(target=self._run_disk_writer, name='search-cache-disk', daemon=True)
+                    self._disk_writer.start()
+        try:
+            self._disk_writes.put_nowait((digest, field, variant, articles))
+            return True
+        except queue.Full:
+            self.telemetry.incr('disk_writes_dropped')
+            return False
 
-        Returns:
-            int: TTL秒数
+    def _run_disk_writer(self) -> None:
+        # _save_to_disk内部已捕获异常
+        while True:
+            item = self._disk_writes.get()
+            try:
+                self._save_to_disk(*item)
+            finally:
+                self._disk_writes.task_done()
+
+    def _reset_disk_writer(self) -> None:
+        self._disk_writes = queue.Queue(maxsize=self.DISK_WRITE_QUEUE_MAX)
+        self._disk_writer = None
+        self._disk_writer_lock = threading.Lock()
+
+    def _invalidate_disk(self, keywords: str, filter_params: Optional[Dict[str, Any]]) -> int:
+        """删除磁盘层中检索词的条目,返回删除数量"""
+        if self.disk is None:
+            return 0
+
+        try:
+            digest = self._keywords_digest(keywords)
+            if filter_params is None:
+                return self.disk.delete_variants(digest)
+
+            days_back = int(filter_params.get('days_back', 30))
+            max_results = int(filter_params.get('max_results', 10000))
+            fields = [
+                name for name, variant in self.disk.load_variants(digest, include_expired=True).items()
+                if variant['days_back'] == days_back and variant['max_results'] == max_results
+            ]
+            return self.disk.delete_variants(digest, fields) if fields else 0
+        except Exception as e:
+            logging.error(f"磁盘缓存失效失败: {e}", exc_info=True)
+            return 0
+
+    def _disk_stats(self) -> Dict[str, Any]:
+        """磁盘层统计"""
+        if self.disk is None:
+            return {'enabled': False}
+
+        try:
+            stats = self.disk.get_stats()
+            stats['enabled'] = True
+            stats['redis_available'] = self._redis_available()
+            return stats
+        except Exception as e:
+            logging.error(f"获取磁盘缓存统计失败: {e}")
+            return {'enabled': True, 'error': str(e)}
+
+    @staticmethod
+    def _same_database(first: Any, second: Any) -> bool:
+        """两个连接是否指向同一Redis逻辑库"""
+        first_kwargs = first.connection_pool.connection_kwargs
+        second_kwargs = second.connection_pool.connection_kwargs
+        return all(
+            first_kwargs.get(name) == second_kwargs.get(name)
+            for name in ('host', 'port', 'path', 'db')
+        )
+
+    @staticmethod
+    def _key_family(key: str) -> str:
+        """键族名称"""
+        families = (
+            ('pubmed:search_cache:q:', '搜索缓存-检索词条目'),
+            ('pubmed:search_cache:article:', '搜索缓存-文章记录'),
+            ('pubmed:search_cache:budget:', '搜索缓存-预算记账'),
+            ('pubmed:search_cache:', '搜索缓存-其他'),
+            ('pubmed:cache_stats', '缓存统计'),
+            ('rq:job:', 'RQ任务数据'),
+            ('rq:queue:', 'RQ队列'),
+            ('rq:scheduled:', 'RQ调度注册表'),
+            ('rq:worker', 'RQ Worker'),
+            ('rq:', 'RQ其他注册表'),
+        )
+        for prefix, name in families:
+            if key.startswith(prefix):
+                return name
+        return '其他'
+
+    @staticmethod
+    def _normalize_keywords(keywords: str) -> str:
+        """标准化关键词(去除多余空格,转小写)"""
+        return ' '.join(keywords.lower().strip().split())
+
+    @classmethod
+    def _keywords_digest(cls, keywords: str) -> str:
+        """标准化关键词并生成MD5摘要"""
+        return hashlib.md5(cls._normalize_keywords(keywords).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _empty_stats() -> Dict[str, Any]:
+        """初始统计数据"""
+        return {
+            'total_hits': 0,
+            'exact_hits': 0,
+            'subsumption_hits': 0,
+            'stale_hits': 0,
+            'refreshes_scheduled': 0,
+            'total_misses': 0,
+            'last_reset': None
+        }
+
+    def _count_keys(self, pattern: str) -> int:
+        """使用SCAN统计匹配的键数量(避免KEYS阻塞)"""
+        count = 0
+        cursor = 0
+        while True:
+            cursor, keys = self.redis.scan(cursor=cursor, match=pattern, count=1000)
+            count += len(keys)
+            if cursor == 0:
+                break
+        return count
+
+    def _load_variants(self, cache_key: str, include_expired: bool = False) -> Dict[str, Dict[str, Any]]:
+        """读取检索词下的全部缓存条目"""
+        return self._decode_variants(self.redis.hgetall(cache_key), include_expired)
+
+    def _decode_variants(self, raw_fields: Dict[Any, bytes], include_expired: bool = False) -> Dict[str, Dict[str, Any]]:
+        """解码HGETALL返回的条目字段"""
+        raw_fields = {
+            (field.decode('utf-8') if isinstance(field, bytes) else field): value
+            for field, value in raw_fields.items()
+        }
+        now = time.time()
+        variants = {}
+        for field, value in raw_fields.items():
+            if '#' in field:
+                continue
+            packed_pmids = raw_fields.get(field + self.PMIDS_FIELD_SUFFIX)
+            if packed_pmids is None:
+                continue
+            try:
+                variant = cache_codec.decode(value)
+                variant['pmids'] = self._unpack_pmids(packed_pmids)
+                variant['reads'] = int(raw_fields.get(field + self.READS_FIELD_SUFFIX) or 0)
+            except (TypeError, ValueError, struct.error):
+                continue
+            if include_expired or variant.get('expires_at', 0) > now:
+                variants[field] = variant
+        return variants
+
+    def _load_variants_tiered(self, cache_key: str) -> Tuple[Dict[str, Dict[str, Any]], Optional[set], str]:
         """
-        base_ttl = self.DEFAULT_TTL
+        依次从L0、Redis读取检索词下的缓存条目
 
-        # 根据结果数调整(结果越多,可能越热门,缓存时间越长)
-        if result_count > 100:
-            base_ttl = int(base_ttl * 1.5)
-        elif result_count > 50:
-            base_ttl = int(base_ttl * 1.2)
-        elif result_count < 10:
-            base_ttl = int(base_ttl * 0.8)
+        Returns:
+            Tuple: (条目字典, 本进程已计入读取次数的字段集合(未使用L0时为None), 命中层级)
+        """
+        if not self._l0_available():
+            return self._load_variants(cache_key), None, 'l1_hits'
+
+        cached = self.l0.get(cache_key)
+        if cached is not None:
+            variants, read_fields = cached
+            now = time.time()
+            return {name: v for name, v in variants.items() if v['expires_at'] > now}, read_fields, 'l0_hits'
+
+        raw_fields = self.redis.hgetall(cache_key)
+        variants = self._decode_variants(raw_fields)
+        read_fields = set()
+        # 不存在的键也缓存为空字典,写入时通过失效广播清除
+        size = sum(len(name) + len(value) for name, value in raw_fields.items()) + 64
+        self.l0.put(cache_key, (variants, read_fields), size)
+        return variants, read_fields, 'l1_hits'
+
+    def _l0_available(self) -> bool:
+        """L0是否可用(失效订阅线程必须在当前进程中运行)"""
+        if not self.L0_ENABLED or not self.enabled:
+            return False
 
-        # 根据时间调整
-        now = datetime.now()
-        hour = now.hour
-        weekday = now.weekday()
+        pid = os.getpid()
+        thread = self._subscriber_thread
+        if thread is not None and thread.is_alive() and self._subscriber_pid == pid:
+            return True
 
-        # 工作时间(9-18点,工作日): 较短TTL
-        if 9 <= hour <= 18 and weekday < 5:
-            base_ttl = int(base_ttl * 0.8)
-        # 夜间/周末: 较长TTL
-        elif hour < 6 or hour > 22 or weekday >= 5:
-            base_ttl = int(base_ttl * 1.5)
+        with self._subscriber_lock:
+            thread = self._subscriber_thread
+            if thread is not None and thread.is_alive() and self._subscriber_pid == pid:
+                return True
+            # 新进程(如RQ fork出的任务进程)或订阅线程已退出: 清空L0并重新订阅
+            self.l0.clear()
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.INVALIDATION_CHANNEL: self._handle_invalidation})
+                self._subscriber_thread = pubsub.run_in_thread(
+                    sleep_time=1.0, daemon=True, exception_handler=self._handle_subscriber_error
+                )
+                self._subscriber_pid = pid
+                return True
+            except Exception as e:
+                logging.warning(f"L0缓存失效订阅启动失败,本进程仅使用Redis缓存: {e}")
+                self._subscriber_thread = None
+                return False
+
+    def _handle_invalidation(self, message: Dict[str, Any]) -> None:
+        """处理失效广播"""
+        data = message.get('data')
+        cache_key = data.decode('utf-8') if isinstance(data, bytes) else data
+        if cache_key == '*':
+            self.l0.clear()
+        else:
+            self.l0.discard(cache_key)
 
-        # 限制在合理范围
-        ttl = max(self.MIN_TTL, min(self.MAX_TTL, base_ttl))
+    def _handle_subscriber_error(self, error: Exception, pubsub: Any, thread: Any) -> None:
+        """订阅连接异常: 停止订阅并清空L0,下次读取时重新订阅"""
+        logging.warning(f"L0缓存失效订阅中断: {error}")
+        self.l0.clear()
+        thread.stop()
+        try:
+            pubsub.close()
+        except Exception:
+            pass
+
+    def _broadcast_invalidation(self, cache_key: str) -> None:
+        """广播失效消息,各进程的L0删除对应条目"""
+        if cache_key == '*':
+            self.l0.clear()
+        else:
+            self.l0.discard(cache_key)
+        try:
+            self.redis.publish(self.INVALIDATION_CHANNEL, cache_key)
+        except Exception as e:
+            logging.error(f"缓存失效广播失败: {e}")
 
-        return ttl
+    def _get_articles(self, pmids: List[str]) -> Optional[List[Dict[str, Any]]]:
+        """
+        通过MGET批量读取共享文章记录
 
-    def _record_hit(self, cache_type: str = 'exact') -> None:
-        """记录缓存命中"""
+        Returns:
+            Optional[List]: 按pmids顺序排列的文章列表,任一记录缺失时返回None
+        """
+        if not pmids:
+            return []
+
+        use_l0 = self._l0_available()
+        keys = [f"{self.ARTICLE_PREFIX}:{pmid}" for pmid in pmids]
+        articles = {}
+        if use_l0:
+            for key in keys:
+                article = self.l0.get(key)
+                if article is not None:
+                    articles[key] = dict(article)  # 返回副本,避免调用方修改共享的L0数据
+
+        missing_keys = [key for key in keys if key not in articles]
+        if missing_keys:
+            values = self.redis.mget(missing_keys)
+            if any(value is None for value in values):
+                return None
+            for key, value in zip(missing_keys, values):
+                articles[key] = cache_codec.decode(value)
+                if use_l0:
+                    self.l0.put(key, articles[key], len(value))
+
+        return [articles[key] for key in keys]
+
+    @staticmethod
+    def _pack_pmids(pmids: List[str]) -> Optional[bytes]:
+        """将PMID列表打包为大端uint32序列,含非数字PMID时返回None"""
         try:
-            stats_data = self.redis.get(self.STATS_KEY)
-            if stats_data:
-                stats = json.loads(stats_data)
-            else:
-                stats = {
-                    'total_hits': 0,
-                    'exact_hits': 0,
-                    'relaxed_hits': 0,
-                    'total_misses': 0,
-                    'last_reset': datetime.now().isoformat()
-                }
+            return struct.pack(f">{len(pmids)}I", *(int(pmid) for pmid in pmids))
+        except (ValueError, TypeError, struct.error):
+            return None
 
-            stats['total_hits'] += 1
-            if cache_type == 'exact':
-                stats['exact_hits'] += 1
-            elif cache_type == 'relaxed':
-                stats['relaxed_hits'] += 1
+    @staticmethod
+    def _unpack_pmids(packed: bytes) -> List[str]:
+        """解包PMID序列"""
+        return [str(pmid) for pmid in struct.unpack(f">{len(packed) // 4}I", packed)]
 
-            self.redis.set(self.STATS_KEY, json.dumps(stats))
-        except Exception as e:
-            logging.error(f"记录命中失败: {e}")
+    @staticmethod
+    def _variant_field(variant: Dict[str, Any]) -> str:
+        """条目在Hash中的字段名"""
+        return f"{variant['end_date']}:{variant['days_back']}:{variant['max_results']}"
 
-    def _record_miss(self) -> None:
-        """记录缓存未命中"""
+    def _variant_field_names(self, field: str) -> List[str]:
+        """条目在Hash中占用的全部字段(元数据、PMID列表、读取次数)"""
+        return [field, field + self.PMIDS_FIELD_SUFFIX, field + self.READS_FIELD_SUFFIX]
+
+    @staticmethod
+    def _is_stale(variant: Dict[str, Any]) -> bool:
+        """条目是否已超过软TTL或截止日期已不是今天"""
+        if variant['end_date'] < datetime.now().date().isoformat():
+            return True
+        return time.time() >= variant.get('soft_expires_at', variant['expires_at'])
+
+    def _schedule_refresh(self, keywords: str, variant: Dict[str, Any]) -> bool:
+        """
+        提交后台刷新任务(低优先级队列)
+
+        通过SET NX锁保证同一检索词的同一窗口/深度只有一个刷新任务在排队或执行
+        """
+        lock_key = self._refresh_lock_key(keywords, variant['days_back'], variant['max_results'])
         try:
-            stats_data = self.redis.get(self.STATS_KEY)
-            if stats_data:
-                stats = json.loads(stats_data)
-            else:
-                stats = {
-                    'total_hits': 0,
-                    'exact_hits': 0,
-                    'relaxed_hits': 0,
-                    'total_misses': 0,
-                    'last_reset': datetime.now().isoformat()
-                }
+            if not self.redis.set(lock_key, 1, nx=True, ex=self.REFRESH_LOCK_TTL):
+                return False
+
+            from rq_config import enqueue_job
+            enqueue_job(
+                'tasks.refresh_search_cache',
+                keywords,
+                variant['days_back'],
+                variant['max_results'],
+                self._variant_level(variant),
+                priority='low',
+                job_timeout=self.REFRESH_LOCK_TTL
+            )
+            self.telemetry.incr('refreshes_scheduled')
+            logging.info(f"[缓存刷新] 已提交后台刷新: {keywords[:50]}, 天数: {variant['days_back']}, "
+                         f"深度: {variant['max_results']}")
+            return True
+        except Exception as e:
+            logging.error(f"提交缓存刷新任务失败: {e}")
+            try:
+                self.redis.delete(lock_key)
+            except Exception:
+                pass
+            return False
 
-            stats['total_misses'] += 1
-            self.redis.set(self.STATS_KEY, json.dumps(stats))
+    def release_refresh_lock(self, keywords: str, days_back: int, max_results: int) -> None:
+        """释放后台刷新锁(刷新任务结束时调用)"""
+        if not self.enabled:
+            return
+        try:
+            self.redis.delete(self._refresh_lock_key(keywords, days_back, max_results))
         except Exception as e:
-            logging.error(f"记录未命中失败: {e}")
+            logging.error(f"释放缓存刷新锁失败: {e}")
+
+    def _refresh_lock_key(self, keywords: str, days_back: int, max_results: int) -> str:
+        """后台刷新锁键"""
+        return f"{self.REFRESH_LOCK_PREFIX}:{self._keywords_digest(keywords)}:{days_back}:{max_results}"
 
-    def _sanitize_for_json(self, data: Any) -> Any:
+    def _variant_level(self, variant: Dict[str, Any]) -> str:
+        """条目包含的数据层级"""
+        if variant.get('has_articles'):
+            return 'articles'
+        if variant.get('issn_map') is not None:
+            return 'issn'
+        return 'pmids'
+
+    def _variant_covers(self, variant: Dict[str, Any], other: Dict[str, Any], require: str) -> bool:
         """
-        清理数据使其可JSON序列化
+        判断条目variant能否覆盖条目(或请求)other
 
-        处理常见的不可序列化类型:
-        - datetime对象 -> ISO格式字符串
-        - date对象 -> ISO格式字符串
-        - 递归处理dict和list
+        - 数据层级不低于require
+        - 同一窗口时: 深度不小于other,或variant已是完整结果
+        - 更宽窗口时: variant必须是完整结果,才能按日期过滤出窄窗口的全部结果
+        """
+        if self.LEVELS[self._variant_level(variant)] < self.LEVELS[require]:
+            return False
 
-        Args:
-            data: 需要清理的数据
+        exhaustive = len(variant['pmids']) < variant['max_results']
+        if variant['days_back'] == other['days_back']:
+            return variant['max_results'] >= other['max_results'] or exhaustive
+        return variant['days_back'] > other['days_back'] and exhaustive
+
+    def _select_variant(
+        self,
+        variants: Dict[str, Dict[str, Any]],
+        days_back: int,
+        max_results: int,
+        require: str
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        从缓存条目中选择能覆盖请求的条目并裁剪为请求的窗口和深度
 
         Returns:
-            可JSON序列化的数据
-        """
-        if isinstance(data, datetime):
-            return data.isoformat()
-        elif isinstance(data, dict):
-            return {key: self._sanitize_for_json(value) for key, value in data.items()}
-        elif isinstance(data, (list, tuple)):
-            return [self._sanitize_for_json(item) for item in data]
-        elif hasattr(data, '__dict__'):
-            # 处理自定义对象
-            return self._sanitize_for_json(data.__dict__)
-        else:
-            return data
+            Tuple: (条目字段名, 裁剪后的结果),无可用条目时为(None, None)
+        """
+        request = {
+            'days_back': days_back,
+            'max_results': max_results
+        }
+
+        candidates = []
+        for field, variant in variants.items():
+            if not self._variant_covers(variant, request, require):
+                continue
+            exact = variant['days_back'] == days_back and variant['max_results'] == max_results
+            candidates.append((field, variant, exact))
+
+        if not candidates:
+            return None, None
+
+        # 新鲜条目优先,其次精确命中,再次窗口最接近、深度最小(减少本地过滤量),最后取最新写入的
+        field, chosen, exact = min(candidates, key=lambda c: (
+            self._is_stale(c[1]), not c[2], c[1]['days_back'], c[1]['max_results'], -c[1]['expires_at']
+        ))
+        hit_type = 'exact' if exact else 'subsumption'
+
+        issn_map = chosen.get('issn_map') or {}
+
+        pmids = chosen['pmids']
+        if chosen.get('has_articles'):
+            pmids = [pmid for pmid in pmids if pmid in issn_map]
+        if chosen['days_back'] > days_back:
+            # 更宽窗口: 按发表日期过滤出本次请求的窗口
+            start_date = (datetime.now().date() - timedelta(days=days_back)).isoformat()
+            pmids = [
+                pmid for pmid in pmids
+                if self._within_window(issn_map.get(pmid), start_date)
+            ]
+        pmids = pmids[:max_results]
+
+        return field, {
+            'pmids': pmids,
+            'articles': None,
+            'issn_map': {pmid: issn_map[pmid] for pmid in pmids if pmid in issn_map}
+            if issn_map else None,
+            'hit_type': hit_type,
+            'stale': self._is_stale(chosen),
+            'created_at': chosen.get('created_at')
+        }
+
+    @staticmethod
+    def _within_window(issn_entry: Optional[List[str]], start_date: str) -> bool:
+        """
+        判断文章发表日期是否落在窗口内
+
+        PubMed的发表日期常只精确到月(解析时日补为1号),此时按月比较;
+        无日期信息的文章保留,宁可多计不可漏计
+        """
+        if not issn_entry or len(issn_entry) < 3 or not issn_entry[2]:
+            return True
+        publish_date = issn_entry[2][:10]
+        if publish_date.endswith('-01'):
+            return publish_date[:7] >= start_date[:7]
+        return publish_date >= start_date
+
+    @staticmethod
+    def _date_string(value: Any) -> str:
+        """发表日期转为YYYY-MM-DD字符串"""
+        if isinstance(value, (datetime, date)):
+            return value.strftime('%Y-%m-%d')
+        return (value or '')[:10]
 
 
 # 全局缓存服务实例
@@ -495,7 +1672,7 @@ def cache_search_results(
     keywords: str,
     filter_params: Dict[str, Any],
     pmids: List[str],
-    articles: List[Dict[str, Any]]
+    articles: Optional[List[Dict[str, Any]]] = None
 ) -> bool:
     """缓存搜索结果(便捷函数)"""
     return search_cache_service.set_cached_results(keywords, filter_params, pmids, articles)
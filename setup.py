@@ -126,6 +126,12 @@ def create_custom_database(admin_email, admin_password, user_email=None, user_pa
                 push_time VARCHAR(10) DEFAULT '09:00',
                 push_day VARCHAR(10) DEFAULT 'monday',
                 push_month_day INTEGER DEFAULT 1,
+                ai_query TEXT,
+                ai_query_hash VARCHAR(64),
+                ai_query_prompt_version VARCHAR(16),
+                ai_query_model VARCHAR(120),
+                ai_query_generated_at TIMESTAMP,
+                next_push_at TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES user (id)
             )
         ''')
@@ -181,6 +187,17 @@ def create_custom_database(admin_email, admin_password, user_email=None, user_pa
             )
         ''')
         
+        # 创建高频查询索引（与migrate_database.py迁移7一致）
+        cursor.execute('CREATE UNIQUE INDEX uq_user_article_user_article_subscription ON user_article (user_id, article_id, subscription_id)')
+        cursor.execute('CREATE INDEX ix_user_article_user_push_date ON user_article (user_id, push_date)')
+        cursor.execute('CREATE INDEX ix_user_article_article_id ON user_article (article_id)')
+        cursor.execute('CREATE INDEX ix_user_article_subscription_id ON user_article (subscription_id)')
+        cursor.execute('CREATE INDEX ix_system_log_timestamp ON system_log (timestamp)')
+        cursor.execute('CREATE INDEX ix_system_log_level_timestamp ON system_log (level, timestamp)')
+        cursor.execute('CREATE INDEX ix_system_log_module_timestamp ON system_log (module, timestamp)')
+        cursor.execute('CREATE INDEX ix_subscription_user_active ON subscription (user_id, is_active)')
+        cursor.execute('CREATE INDEX ix_subscription_active_next_push ON subscription (is_active, next_push_at)')
+        
         # 创建系统设置表
         cursor.execute('''
             CREATE TABLE system_setting (
@@ -371,8 +388,11 @@ def create_custom_database(admin_email, admin_password, user_email=None, user_pa
             ('push_max_articles', '50', '每次推送最大文章数', 'push'),
             ('push_enabled', 'true', '启用自动推送', 'push'),
             ('push_check_frequency', '0.0833', '推送任务检查频率(小时)', 'push'),
+            ('push_digest_enabled', 'false', '合并同一用户的订阅推送', 'push'),
+            ('push_digest_window', '30', '推送合并窗口(分钟)', 'push'),
             ('system_name', 'PubMed Literature Push', '系统名称', 'system'),
             ('log_retention_days', '30', '日志保留天数', 'system'),
+            ('article_retention_days', '180', '推送记录保留天数', 'system'),
             ('user_registration_enabled', 'true', '允许用户注册', 'system'),
             ('require_invite_code', 'false', '需要邀请码注册', 'system'),
         ]
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+SMTP连接池
+按邮箱配置保持已登录的SMTP连接,同一会话连续发送多封邮件,
+不再为每封邮件重新建立TLS连接和登录,也不修改Flask的全局MAIL_*配置
+"""
+
+import os
+import time
+import atexit
+import hashlib
+import logging
+import socket
+import smtplib
+import threading
+from collections import namedtuple
+from email.message import EmailMessage
+from email.utils import formataddr, make_msgid, formatdate
+from typing import Dict, List, Optional, Tuple
+
+
+# 连接参数: security 为 'ssl'(465端口) / 'starttls' / 'plain'
+SMTPSettings = namedtuple('SMTPSettings', ['config_id', 'server', 'port', 'username', 'password', 'security'])
+
+# 连接级错误: 丢弃连接后用新连接重试一次
+# (SMTPException都是OSError的子类,不能直接用OSError,否则服务器拒收的邮件也会被重发)
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout)
+
+# 服务器拒绝了这封邮件(如收件人无效),不重试,连接本身仍可用
+REJECTION_ERRORS = (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)
+
+
+def settings_from_config(config) -> SMTPSettings:
+    """根据MailConfig生成连接参数(加密方式与原flask_mail配置逻辑一致)"""
+    if config.smtp_port == 465:
+        security = 'ssl'
+    elif config.smtp_port == 587:
+        security = 'starttls'
+    else:
+        security = 'starttls' if config.use_tls else 'plain'
+    return SMTPSettings(config.id, config.smtp_server, config.smtp_port, config.username, config.password, security)
+
+
+def build_message(subject: str, sender: str, recipients: List[str], html_body: str,
+                  text_body: Optional[str] = None, sender_name: Optional[str] = None) -> EmailMessage:
+    """构建邮件(有纯文本时为 multipart/alternative)"""
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = formataddr((sender_name, sender)) if sender_name else sender
+    msg['To'] = ', '.join(recipients)
+    msg['Date'] = formatdate(localtime=True)
+    msg['Message-ID'] = make_msgid(domain=sender.split('@')[-1] if '@' in sender else None)
+    if text_body:
+        msg.set_content(text_body)
+        msg.add_alternative(html_body, subtype='html')
+    else:
+        msg.set_content(html_body, subtype='html')
+    return msg
+
+
+class _PooledConnection:
+    """池中的一个已登录连接"""
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.sent = 0
+
+    def close(self) -> None:
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """
+    按邮箱配置划分的SMTP连接池
+
+    - 每个配置最多保留 max_idle 个空闲连接,空闲超过 idle_timeout 秒的连接被关闭
+    - 取出空闲超过 healthcheck_after 秒的连接时先发送NOOP确认连接可用
+    - 单个连接发送 max_messages 封后重新连接(多数服务商限制单会话邮件数)
+    - 连接级错误时丢弃连接,用新连接重试一次
+    - 配置的服务器、账号或密码变化后使用新的连接池
+    """
+
+    def __init__(
+        self,
+        max_idle: int = 2,
+        idle_timeout: float = 60,
+        healthcheck_after: float = 10,
+        max_messages: int = 100,
+        timeout: float = 30
+    ):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.healthcheck_after = healthcheck_after
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple, List[_PooledConnection]] = {}
+        self._pid = os.getpid()
+        self.stats = {'connects': 0, 'reuses': 0, 'reconnects': 0, 'sent': 0}
+        atexit.register(self.close_all)
+
+    def send(self, settings: SMTPSettings, message: EmailMessage) -> None:
+        """发送一封邮件,失败时抛出smtplib异常"""
+        error = self.send_many(settings, [message])[0]
+        if error is not None:
+            raise error
+
+    def send_many(self, settings: SMTPSettings, messages: List[EmailMessage]) -> List[Optional[Exception]]:
+        """
+        在同一个会话中依次发送多封邮件
+
+        Returns:
+            与messages一一对应的异常列表,发送成功为None;
+            无法建立连接时所有邮件都返回该异常
+        """
+        results: List[Optional[Exception]] = []
+        try:
+            conn = self._checkout(settings)
+        except Exception as e:
+            return [e] * len(messages)
+
+        for message in messages:
+            if conn is None:
+                try:
+                    conn = self._connect(settings)
+                except Exception as e:
+                    results.append(e)
+                    continue
+            conn, error = self._send_with_retry(settings, conn, message)
+            results.append(error)
+
+        if conn is not None:
+            self._checkin(settings, conn)
+        return results
+
+    def close_all(self) -> None:
+        """关闭全部空闲连接"""
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for connections in pools.values():
+            for conn in connections:
+                conn.close()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            idle = sum(len(connections) for connections in self._idle.values())
+        return {**self.stats, 'idle_connections': idle}
+
+    # ==================== 私有辅助方法 ====================
+
+    def _send_with_retry(
+        self,
+        settings: SMTPSettings,
+        conn: _PooledConnection,
+        message: EmailMessage
+    ) -> Tuple[Optional[_PooledConnection], Optional[Exception]]:
+        """
+        发送一封邮件,连接断开时重新连接后重试一次
+
+        Returns:
+            (当前连接, 异常): 轮换或重连后返回新连接,连接已不可用时为None;发送成功时异常为None
+        """
+        try:
+            if conn.sent >= self.max_messages:
+                conn.close()
+                conn = None
+                conn = self._connect(settings)
+            try:
+                conn.smtp.send_message(message)
+            except CONNECTION_ERRORS as e:
+                logging.warning(f"[SMTP连接池] {settings.username} 连接已断开，重新连接后重试: {e}")
+                conn.close()
+                conn = None
+                self.stats['reconnects'] += 1
+                conn = self._connect(settings)
+                conn.smtp.send_message(message)
+        except REJECTION_ERRORS as e:
+            # 服务器拒收这封邮件: 重置会话后继续使用当前连接
+            if conn is not None:
+                try:
+                    conn.smtp.rset()
+                except Exception:
+                    conn.close()
+                    conn = None
+            return conn, e
+        except Exception as e:
+            if conn is not None:
+                conn.close()
+            return None, e
+        conn.sent += 1
+        conn.last_used = time.time()
+        self.stats['sent'] += 1
+        return conn, None
+
+    @staticmethod
+    def _key(settings: SMTPSettings) -> Tuple:
+        # 密码只以摘要形式出现在键中
+        password_digest = hashlib.sha256((settings.password or '').encode('utf-8')).hexdigest()[:16]
+        return (settings.config_id, settings.server, settings.port, settings.username, settings.security, password_digest)
+
+    def _checkout(self, settings: SMTPSettings) -> _PooledConnection:
+        """取出一个可用连接(没有空闲连接时新建)"""
+        key = self._key(settings)
+        while True:
+            with self._lock:
+                self._reset_after_fork()
+                expired = self._pop_expired_locked()
+                connections = self._idle.get(key)
+                conn = connections.pop() if connections else None
+            for stale in expired:
+                stale.close()
+            if conn is None:
+                return self._connect(settings)
+
+            if time.time() - conn.last_used > self.healthcheck_after:
+                try:
+                    code, _ = conn.smtp.noop()
+                    if code != 250:
+                        raise smtplib.SMTPServerDisconnected(f"NOOP返回 {code}")
+                except Exception:
+                    conn.close()
+                    continue
+            self.stats['reuses'] += 1
+            return conn
+
+    def _checkin(self, settings: SMTPSettings, conn: _PooledConnection) -> None:
+        """归还连接,超出空闲上限时关闭"""
+        key = self._key(settings)
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_idle and conn.sent < self.max_messages:
+                connections.append(conn)
+                return
+        conn.close()
+
+    def _connect(self, settings: SMTPSettings) -> _PooledConnection:
+        """建立并登录新连接"""
+        if settings.security == 'ssl':
+            smtp = smtplib.SMTP_SSL(settings.server, settings.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(settings.server, settings.port, timeout=self.timeout)
+            if settings.security == 'starttls':
+                smtp.starttls()
+        try:
+            if settings.username and settings.password:
+                smtp.login(settings.username, settings.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.stats['connects'] += 1
+        return _PooledConnection(smtp)
+
+    def _pop_expired_locked(self) -> List[_PooledConnection]:
+        """取出空闲超时的连接,由调用方在锁外关闭(调用方需持有锁)"""
+        now = time.time()
+        expired = []
+        for key, connections in list(self._idle.items()):
+            alive = []
+            for conn in connections:
+                (expired if now - conn.last_used > self.idle_timeout else alive).append(conn)
+            if alive:
+                self._idle[key] = alive
+            else:
+                del self._idle[key]
+        return expired
+
+    def _reset_after_fork(self) -> None:
+        """fork出的子进程不使用父进程的连接(调用方需持有锁)"""
+        if self._pid != os.getpid():
+            self._idle = {}
+            self._pid = os.getpid()
+
+
+# 全局SMTP连接池
+smtp_pool = SMTPConnectionPool(
+    max_idle=int(os.environ.get('SMTP_POOL_MAX_IDLE', 2)),
+    idle_timeout=float(os.environ.get('SMTP_POOL_IDLE_TIMEOUT', 60)),
+    max_messages=int(os.environ.get('SMTP_POOL_MAX_MESSAGES', 100)),
+    timeout=float(os.environ.get('SMTP_TIMEOUT', 30))
+)
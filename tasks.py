@@ -7,6 +7,7 @@ RQ任务定义模块
 import os
 import sys
 import datetime
+import functools
 from typing import Optional
 
 # 确保app模块可以被导入
@@ -16,15 +17,28 @@ if current_dir not in sys.path:
 
 # 在任务执行时需要Flask应用上下文
 from flask import Flask
-from app import app, db, User, Subscription, beijing_now
+from app import app, db, User, Subscription, Article, beijing_now, calculate_next_push_time, APP_TIMEZONE
 # 延迟导入避免循环导入问题
-from app import log_activity, SystemSetting, push_service
+from app import log_activity, SystemSetting, push_service, data_retention_service, PushGroupBusy
+from push_pipeline import push_pipeline, PUSH_PIPELINE_ENABLED
+from push_digest import push_digest
 import logging
 
-def process_subscription_push(subscription_id: int):
+def _push_group_defer(group_deferrals: int) -> bool:
+    """同组搜索被占用时是否继续延后（累计超过PUSH_GROUP_WAIT_SECONDS后直接搜索）"""
+    return group_deferrals * push_service.PUSH_GROUP_RETRY_DELAY < push_service.PUSH_GROUP_WAIT_SECONDS
+
+def _requeue_for_push_group(task_name, arg, group_deferrals, priority='default', **kwargs):
+    """同组搜索被占用: 延后重新排队，不在Worker中等待"""
+    from rq_config import enqueue_in
+    enqueue_in(task_name, push_service.PUSH_GROUP_RETRY_DELAY, arg,
+               priority=priority, group_deferrals=group_deferrals + 1, **kwargs)
+    logging.info(f"[RQ任务] {task_name}({arg}) 同组搜索进行中，{push_service.PUSH_GROUP_RETRY_DELAY} 秒后重试")
+
+def process_subscription_push(subscription_id: int, group_deferrals: int = 0, due_at: Optional[float] = None):
     """
     处理单个订阅推送任务
-    这是RQ任务队列中执行的核心函数
+    这是RQ任务队列中执行的核心函数（due_at为本次推送的计划到期时间戳，由调度器传入）
     """
     with app.app_context():  # 确保有Flask应用上下文
         try:
@@ -46,11 +60,27 @@ def process_subscription_push(subscription_id: int):
                 logging.error(f"[RQ任务] {error_msg}")
                 return {"status": "error", "message": error_msg}
 
+            # 分阶段推送: 交给检索阶段队列，本任务只负责调度下次推送
+            if PUSH_PIPELINE_ENABLED:
+                job = push_pipeline.enqueue_stage('fetch', subscription_id, due_at=due_at)
+                logging.info(f"[RQ任务] 订阅 {subscription_id} 已进入分阶段推送: {job.id}")
+                schedule_next_push_for_subscription(subscription)
+                return {"status": "queued", "subscription_id": subscription_id, "job_id": job.id}
+
             start_time = datetime.datetime.now()
             logging.info(f"[RQ任务] 开始处理订阅 {subscription_id} (用户: {user.email})")
 
-            # 调用推送服务处理订阅
-            result = push_service.process_single_subscription(subscription_id)
+            # 调用推送服务处理订阅（摘要模式下新文章进入用户摘要）
+            try:
+                result = push_service.process_single_subscription(
+                    subscription_id, on_new_articles=_new_articles_handler(due_at),
+                    defer_when_busy=_push_group_defer(group_deferrals)
+                )
+            except PushGroupBusy:
+                _requeue_for_push_group('tasks.process_subscription_push', subscription_id, group_deferrals,
+                                        due_at=due_at)
+                return {"status": "deferred", "subscription_id": subscription_id}
+            _report_unsent_to_digest([result], due_at)
 
             end_time = datetime.datetime.now()
             duration = (end_time - start_time).total_seconds()
@@ -104,6 +134,298 @@ def process_subscription_push(subscription_id: int):
                 
             return {"status": "error", "message": error_msg}
 
+def process_subscription_group_push(subscription_ids, wave_id: Optional[str] = None, group_deferrals: int = 0):
+    """
+    处理一组共享检索条件的订阅推送任务
+    同组订阅只调用一次PubMed，再分别去重、AI增强和发送邮件
+    """
+    with app.app_context():
+        try:
+            start_time = datetime.datetime.now()
+            logging.info(f"[RQ任务] 开始处理订阅分组 {subscription_ids}")
+
+            result = push_service.process_subscription_group(
+                subscription_ids, wave_id=wave_id, on_new_articles=_new_articles_handler(),
+                defer_when_busy=_push_group_defer(group_deferrals)
+            )
+            _report_unsent_to_digest(result.get('results', []))
+
+            duration = (datetime.datetime.now() - start_time).total_seconds()
+            articles_count = sum(
+                item.get('articles_found', 0) for item in result.get('results', []) if item and item.get('success')
+            )
+            logging.info(f"[RQ任务] 订阅分组处理完成: {result.get('subscriptions', 0)} 个订阅, "
+                         f"{result.get('searches', 0)} 次PubMed搜索, {articles_count} 篇文章 (耗时: {duration:.2f}秒)")
+            status = "success"
+            message = None
+        except PushGroupBusy:
+            # 延后的任务完成后再调度下次推送
+            _requeue_for_push_group('tasks.process_subscription_group_push', subscription_ids, group_deferrals,
+                                    wave_id=wave_id)
+            return {"status": "deferred", "subscription_ids": list(subscription_ids)}
+        except Exception as e:
+            error_msg = f"订阅分组 {subscription_ids} 推送异常: {str(e)}"
+            log_activity('ERROR', 'rq_push', error_msg)
+            logging.error(f"[RQ任务] {error_msg}")
+            result = {}
+            duration = 0
+            status = "error"
+            message = error_msg
+
+        # 无论成功与否都调度下次推送，避免订阅停止
+        try:
+            for subscription in Subscription.query.filter(Subscription.id.in_(subscription_ids)).all():
+                if subscription.is_active:
+                    schedule_next_push_for_subscription(subscription)
+        except Exception as e:
+            logging.error(f"[RQ任务] 订阅分组调度下次推送失败: {e}")
+
+        response = {
+            "status": status,
+            "subscription_ids": list(subscription_ids),
+            "subscriptions": result.get('subscriptions', 0),
+            "searches": result.get('searches', 0),
+            "duration": duration
+        }
+        if message:
+            response["message"] = message
+        return response
+
+def _hand_off_to_pipeline(subscription, user, articles):
+    """检索阶段完成: 保存新文章ID，交给AI增强阶段"""
+    run_id = push_pipeline.start({
+        'subscription_id': subscription.id,
+        'user_id': user.id,
+        'keywords': subscription.keywords,
+        'article_ids': [article.id for article in articles]
+    })
+    logging.info(f"[分阶段推送] 订阅 {subscription.id} 的 {len(articles)} 篇新文章进入AI增强阶段: {run_id}")
+
+def _new_articles_handler(due_at=None):
+    """
+    检索完成后新文章的去向: 摘要模式下进入用户摘要，启用分阶段推送时交给AI增强阶段，
+    否则返回None由推送服务直接发送
+    """
+    if _digest_window_seconds():
+        return functools.partial(_collect_for_digest, due_at=due_at)
+    return _hand_off_to_pipeline if PUSH_PIPELINE_ENABLED else None
+
+def _digest_window_seconds():
+    """推送摘要合并窗口(秒)，未启用摘要模式时为0"""
+    if SystemSetting.get_setting('push_digest_enabled', 'false') != 'true':
+        return 0
+    try:
+        return max(0, int(SystemSetting.get_setting('push_digest_window', '30'))) * 60
+    except ValueError:
+        return 0
+
+def _collect_for_digest(subscription, user, articles, due_at=None):
+    """摘要模式: 新文章作为一个关键词分节加入用户摘要，摘要不可用时按单个订阅推送"""
+    try:
+        _report_to_digest(subscription, user, {
+            'subscription_id': subscription.id,
+            'keywords': subscription.keywords,
+            'article_ids': [article.id for article in articles]
+        }, due_at)
+    except Exception as e:
+        logging.warning(f"[推送摘要] 订阅 {subscription.id} 加入摘要失败，单独推送: {e}")
+        if PUSH_PIPELINE_ENABLED:
+            _hand_off_to_pipeline(subscription, user, articles)
+        else:
+            push_service.deliver_push_wave([(subscription, user, articles)])
+
+def _report_to_digest(subscription, user, section, due_at=None):
+    """
+    向用户摘要报到，摘要打开时记录合并窗口内预计到期的其他订阅
+    
+    预计到期的订阅全部报到后立即合并发送，否则在窗口结束时发送。
+    窗口以本次推送的计划到期时间为起点：检索可能因阶段排队在到期很久之后才开始，
+    以当前时间为起点会漏掉同一时间到期的订阅
+    """
+    from rq_config import enqueue_job, enqueue_in
+    
+    window = _digest_window_seconds()
+    scheduled_at = _scheduled_push_time(subscription, due_at)
+    window_start = scheduled_at - datetime.timedelta(seconds=push_digest.LOOKBACK_SECONDS)
+    window_end = scheduled_at + datetime.timedelta(seconds=window)
+    expected_ids = []
+    for other in Subscription.query.filter_by(user_id=user.id, is_active=True).all():
+        next_push_time = calculate_next_push_time(other, after=window_start)
+        if next_push_time and next_push_time <= window_end:
+            expected_ids.append(other.id)
+    
+    state = push_digest.add(user.id, subscription.id, section, expected_ids, window)
+    if state['complete']:
+        enqueue_job('tasks.flush_push_digest', user.id, priority='default')
+    elif state['opened']:
+        enqueue_in('tasks.flush_push_digest', window, user.id, priority='default')
+        logging.info(f"[推送摘要] 用户 {user.id} 的摘要已打开，{window // 60} 分钟内到期的订阅合并发送")
+
+def _scheduled_push_time(subscription, due_at=None):
+    """本次推送的计划到期时间：调度器传入的到期时间戳，其次是已到期的next_push_at，否则为当前时间"""
+    now = beijing_now()
+    if due_at:
+        return datetime.datetime.fromtimestamp(due_at, APP_TIMEZONE)
+    next_push_at = subscription.next_push_at
+    if next_push_at is not None:
+        if next_push_at.tzinfo is None:
+            next_push_at = APP_TIMEZONE.localize(next_push_at)
+        if next_push_at <= now:
+            return next_push_at
+    return now
+
+def _report_unsent_to_digest(results, due_at=None):
+    """摘要模式下，没有新文章或处理失败的订阅也向摘要报到，避免合并发送等到窗口结束"""
+    if not _digest_window_seconds():
+        return
+    for item in results:
+        if not item or (item.get('success') and item.get('articles_found')):
+            continue
+        try:
+            subscription = Subscription.query.get(item.get('subscription_id'))
+            if subscription and subscription.user:
+                _report_to_digest(subscription, subscription.user, None, due_at)
+        except Exception as e:
+            logging.warning(f"[推送摘要] 订阅 {item.get('subscription_id')} 报到失败: {e}")
+
+def flush_push_digest(user_id: int):
+    """合并发送用户摘要: 窗口内各订阅的新文章按关键词分节，合成一封邮件"""
+    with app.app_context():
+        sections = push_digest.take(user_id)
+        if not sections:
+            return {"status": "skipped", "user_id": user_id}
+        user = User.query.get(user_id)
+        if not user or not user.is_active:
+            logging.info(f"[推送摘要] 用户 {user_id} 不存在或已禁用，丢弃 {len(sections)} 个分节")
+            return {"status": "skipped", "user_id": user_id}
+        
+        merged = push_digest.merge(sections)
+        payload = {
+            'subscription_id': merged[0]['subscription_id'],
+            'user_id': user_id,
+            'keywords': '、'.join(section['keywords'] for section in merged),
+            'article_ids': [article_id for section in merged for article_id in section['article_ids']],
+            'sections': merged
+        }
+        push_digest.record_sent(len(sections))
+        logging.info(f"[推送摘要] 用户 {user.email} 的 {len(sections)} 个订阅合并为一封邮件，"
+                     f"共 {len(payload['article_ids'])} 篇文章")
+        
+        if PUSH_PIPELINE_ENABLED:
+            run_id = push_pipeline.start(payload)
+            return {"status": "queued", "user_id": user_id, "run_id": run_id, "sections": len(merged)}
+        
+        articles = _load_pipeline_articles(payload)
+        push_service.enrich_push_articles(payload['subscription_id'], articles)
+        message = push_service.render_push_email(user, articles, _articles_by_section(payload, articles))
+        success = push_service.deliver_push_email(user, message)
+        return {"status": "success" if success else "error", "user_id": user_id, "sections": len(merged)}
+
+def _articles_by_section(payload, articles):
+    """邮件的关键词分节: 摘要推送每个关键词一节，单个订阅推送只有一节"""
+    if not payload.get('sections'):
+        return {payload['keywords']: articles}
+    by_id = {article.id: article for article in articles}
+    return {
+        section['keywords']: [by_id[article_id] for article_id in section['article_ids'] if article_id in by_id]
+        for section in payload['sections']
+    }
+
+def _load_pipeline_articles(payload):
+    """按交接的文章ID加载文章，保持检索结果的顺序"""
+    articles = {article.id: article for article in Article.query.filter(Article.id.in_(payload['article_ids'])).all()}
+    return [articles[article_id] for article_id in payload['article_ids'] if article_id in articles]
+
+def _load_pipeline_run(run_id, stage):
+    """读取阶段交接数据和接收用户，数据已过期或用户已禁用时结束本次推送"""
+    payload = push_pipeline.load_handoff(run_id)
+    if payload is None:
+        logging.warning(f"[分阶段推送] {stage} 阶段找不到 {run_id} 的交接数据（已完成或已过期），跳过")
+        return None, None
+    user = User.query.get(payload['user_id'])
+    if not user or not user.is_active:
+        logging.info(f"[分阶段推送] 订阅 {payload['subscription_id']} 的用户不存在或已禁用，结束推送 {run_id}")
+        push_pipeline.finish(run_id)
+        return None, None
+    return payload, user
+
+def push_stage_fetch(subscription_id: int, group_deferrals: int = 0, slot: Optional[str] = None,
+                     stage_deferrals: int = 0, due_at: Optional[float] = None):
+    """推送阶段1: 检索PubMed并保存新文章（slot/stage_deferrals由阶段信号量转交名额时传入）"""
+    with app.app_context():
+        def fetch():
+            try:
+                result = push_service.process_single_subscription(
+                    subscription_id,
+                    on_new_articles=(functools.partial(_collect_for_digest, due_at=due_at)
+                                     if _digest_window_seconds() else _hand_off_to_pipeline),
+                    defer_when_busy=_push_group_defer(group_deferrals)
+                )
+            except PushGroupBusy:
+                _requeue_for_push_group('tasks.push_stage_fetch', subscription_id, group_deferrals,
+                                        priority='push_fetch', job_timeout=push_pipeline.JOB_TIMEOUT['fetch'],
+                                        due_at=due_at)
+                return {"status": "deferred", "stage": "fetch", "subscription_id": subscription_id}
+            _report_unsent_to_digest([result], due_at)
+            return result
+
+        return push_pipeline.run_stage('fetch', subscription_id, fetch, slot, stage_deferrals,
+                                       group_deferrals=group_deferrals, due_at=due_at)
+
+def push_stage_enrich(run_id: str, slot: Optional[str] = None, stage_deferrals: int = 0):
+    """推送阶段2: AI翻译摘要和生成简介"""
+    def enrich():
+        payload, user = _load_pipeline_run(run_id, 'enrich')
+        if payload is None:
+            return {"status": "skipped", "run_id": run_id}
+        articles = _load_pipeline_articles(payload)
+        push_service.enrich_push_articles(payload['subscription_id'], articles)
+        push_pipeline.advance(run_id, 'render', payload)
+        return {"status": "success", "run_id": run_id, "articles_count": len(articles)}
+
+    with app.app_context():
+        return push_pipeline.run_stage('enrich', run_id, enrich, slot, stage_deferrals)
+
+def push_stage_render(run_id: str, slot: Optional[str] = None, stage_deferrals: int = 0):
+    """推送阶段3: 生成邮件内容"""
+    def render():
+        payload, user = _load_pipeline_run(run_id, 'render')
+        if payload is None:
+            return {"status": "skipped", "run_id": run_id}
+        articles = _load_pipeline_articles(payload)
+        payload['message'] = push_service.render_push_email(user, articles, _articles_by_section(payload, articles))
+        push_pipeline.advance(run_id, 'send', payload)
+        return {"status": "success", "run_id": run_id, "articles_count": len(articles)}
+
+    with app.app_context():
+        return push_pipeline.run_stage('render', run_id, render, slot, stage_deferrals)
+
+def push_stage_send(run_id: str, slot: Optional[str] = None, stage_deferrals: int = 0):
+    """推送阶段4: 发送邮件"""
+    def send():
+        payload, user = _load_pipeline_run(run_id, 'send')
+        if payload is None:
+            return {"status": "skipped", "run_id": run_id}
+        success = push_service.deliver_push_email(user, payload['message'])
+        push_pipeline.finish(run_id)
+
+        message = (f"订阅 {payload['subscription_id']} 推送完成：发送了 {payload['message']['articles_count']} "
+                   f"篇新文章给用户 {user.email}")
+        if success:
+            log_activity('INFO', 'rq_push', message)
+        return {"status": "success" if success else "error", "run_id": run_id,
+                "subscription_id": payload['subscription_id']}
+
+    with app.app_context():
+        return push_pipeline.run_stage('send', run_id, send, slot, stage_deferrals)
+
+def push_stage_watchdog(stage: str, rounds: int = 0):
+    """阶段等待列表看门狗: 名额持有者被强制终止时，把租约过期回收的名额转交给等待中的任务"""
+    granted = push_pipeline.run_watchdog(stage, rounds)
+    if granted:
+        logging.info(f"[分阶段推送] 看门狗为 {stage} 阶段转交了 {granted} 个名额")
+    return {"status": "success", "stage": stage, "granted": granted}
+
 def schedule_next_push_for_subscription(subscription):
     """为订阅调度下次推送任务"""
     try:
@@ -119,86 +441,45 @@ def schedule_next_push_for_subscription(subscription):
     except Exception as e:
         logging.error(f"[RQ调度] 为订阅 {subscription.id} 调度下次推送失败: {e}")
 
-def calculate_next_push_time(subscription) -> Optional[datetime.datetime]:
-    """计算订阅的下次推送时间"""
-    try:
-        current_time = beijing_now()
-        
-        # 解析推送时间
-        if not subscription.push_time:
-            push_hour, push_minute = 9, 0  # 默认9:00
-        else:
-            try:
-                push_hour, push_minute = map(int, subscription.push_time.split(':'))
-            except:
-                push_hour, push_minute = 9, 0
-        
-        # 根据推送频率计算下次时间
-        if subscription.push_frequency == 'daily':
-            next_time = current_time.replace(hour=push_hour, minute=push_minute, second=0, microsecond=0)
-            if next_time <= current_time:
-                next_time += datetime.timedelta(days=1)
-            return next_time
-            
-        elif subscription.push_frequency == 'weekly':
-            # 获取目标星期几
-            weekday_map = {
-                'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
-                'friday': 4, 'saturday': 5, 'sunday': 6
-            }
-            target_weekday = weekday_map.get(subscription.push_day or 'monday', 0)
-            
-            next_time = current_time.replace(hour=push_hour, minute=push_minute, second=0, microsecond=0)
-            days_ahead = target_weekday - current_time.weekday()
-            
-            if days_ahead <= 0 or (days_ahead == 0 and next_time <= current_time):
-                days_ahead += 7
-                
-            next_time += datetime.timedelta(days=days_ahead)
-            return next_time
-            
-        elif subscription.push_frequency == 'monthly':
-            # 每月指定日期
-            target_day = subscription.push_month_day or 1
-            
-            next_time = current_time.replace(day=target_day, hour=push_hour, minute=push_minute, second=0, microsecond=0)
-            if next_time <= current_time:
-                # 下个月的同一天
-                if current_time.month == 12:
-                    next_time = next_time.replace(year=current_time.year + 1, month=1)
-                else:
-                    try:
-                        next_time = next_time.replace(month=current_time.month + 1)
-                    except ValueError:
-                        # 处理月份天数不足的情况（如31号到2月）
-                        next_time = next_time.replace(month=current_time.month + 1, day=1)
-                        
-            return next_time
-        
-        return None
-        
-    except Exception as e:
-        logging.error(f"计算订阅 {subscription.id} 下次推送时间失败: {e}")
-        return None
-
 def batch_schedule_all_subscriptions():
     """批量调度所有活跃订阅"""
     with app.app_context():
         try:
             subscriptions = Subscription.query.filter_by(is_active=True).join(User).filter_by(is_active=True).all()
-            scheduled_count = 0
 
+            # 改用有序集合调度后清理RQ定时推送任务,避免同一推送被触发两次
+            from push_scheduler import PUSH_SCHEDULER_BACKEND
+            if PUSH_SCHEDULER_BACKEND == 'zset':
+                from rq_config import purge_legacy_subscription_jobs
+                purge_legacy_subscription_jobs()
+            else:
+                # 先用一次注册表扫描重建订阅任务索引,之后每个订阅的改期只取消索引中的一个任务
+                from rq_config import rebuild_subscription_job_index
+                rebuild_subscription_job_index()
+
+            # 一次算出全部下次推送时间,再分块通过pipeline写入(中断后重新执行会从上次进度继续)
+            schedule = []
             for subscription in subscriptions:
                 try:
                     next_push_time = calculate_next_push_time(subscription)
                     if next_push_time:
-                        from rq_config import schedule_subscription_push
-                        schedule_subscription_push(subscription.id, next_push_time)
-                        scheduled_count += 1
+                        schedule.append((subscription.id, next_push_time))
                 except Exception as e:
-                    logging.error(f"调度订阅 {subscription.id} 失败: {e}")
+                    logging.error(f"计算订阅 {subscription.id} 下次推送时间失败: {e}")
+
+            from rq_config import bulk_schedule_subscription_pushes
+            result = bulk_schedule_subscription_pushes(schedule)
+            scheduled_count = len(schedule)
+            if result['resumed_from'] is not None:
+                logging.info(f"[RQ批量调度] 从订阅 {result['resumed_from']} 之后继续，本次写入 {result['scheduled']} 个")
 
             log_activity('INFO', 'rq_schedule', f'批量调度完成: {scheduled_count}/{len(subscriptions)} 个订阅')
+
+            # 每日数据保留清理随订阅调度一起恢复
+            try:
+                schedule_data_retention()
+            except Exception as e:
+                logging.error(f"[RQ批量调度] 调度数据保留清理失败: {e}")
             logging.info(f"[RQ批量调度] 成功调度 {scheduled_count}/{len(subscriptions)} 个订阅")
 
             # 批量调度成功后创建标记文件
@@ -223,11 +504,69 @@ def batch_schedule_all_subscriptions():
             logging.error(f"[RQ批量调度] {error_msg}")
             return {"status": "error", "message": error_msg}
 
+# 每日数据保留清理时间（避开推送高峰）
+DATA_RETENTION_TIME = os.environ.get('DATA_RETENTION_TIME', '03:30')
+
+def schedule_data_retention():
+    """调度下一次数据保留清理（低优先级，固定任务ID避免重复调度）"""
+    from rq_config import enqueue_at
+
+    current_time = beijing_now()
+    hour, minute = map(int, DATA_RETENTION_TIME.split(':'))
+    run_at = current_time.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run_at <= current_time:
+        run_at += datetime.timedelta(days=1)
+
+    job = enqueue_at(cleanup_expired_data, run_at, priority='low', job_id=f'data_retention_{run_at.strftime("%Y%m%d")}')
+    logging.info(f"[数据清理] 已调度下次清理: {run_at.strftime('%Y-%m-%d %H:%M')}")
+    return job
+
+def cleanup_expired_data():
+    """按保留天数分批清理过期日志、推送记录和未引用的文章"""
+    with app.app_context():
+        try:
+            deleted = data_retention_service.run()
+            return {"status": "success", "deleted": deleted}
+        except Exception as e:
+            error_msg = f"数据保留清理失败: {str(e)}"
+            log_activity('ERROR', 'system', error_msg)
+            logging.error(f"[数据清理] {error_msg}")
+            return {"status": "error", "message": error_msg}
+        finally:
+            # 无论成功与否都调度下次清理
+            try:
+                schedule_data_retention()
+            except Exception as e:
+                logging.error(f"[数据清理] 调度下次清理失败: {e}")
+
 def immediate_push_subscription(subscription_id: int):
     """立即推送指定订阅（高优先级任务）"""
     from rq_config import enqueue_job
     return enqueue_job(process_subscription_push, subscription_id, priority='high')
 
+def refresh_search_cache(keywords: str, days_back: int, max_results: int, level: str = 'articles'):
+    """后台刷新已过软TTL的搜索缓存条目（低优先级任务）"""
+    from search_cache_service import search_cache_service
+
+    with app.app_context():
+        try:
+            from app import PubMedAPI
+
+            start_time = datetime.datetime.now()
+            pmid_count = PubMedAPI().refresh_search_cache(keywords, days_back, max_results, level)
+            duration = (datetime.datetime.now() - start_time).total_seconds()
+
+            logging.info(f"[RQ缓存刷新] {keywords[:50]} 刷新完成: {pmid_count} 个PMID (耗时: {duration:.2f}秒)")
+            return {"status": "success", "pmid_count": pmid_count, "duration": duration}
+
+        except Exception as e:
+            error_msg = f"搜索缓存刷新失败: {str(e)}"
+            logging.error(f"[RQ缓存刷新] {error_msg}")
+            return {"status": "error", "message": error_msg}
+
+        finally:
+            search_cache_service.release_refresh_lock(keywords, days_back, max_results)
+
 def test_rq_connection():
     """测试RQ连接和任务执行"""
     with app.app_context():
@@ -252,30 +591,43 @@ def batch_push_all_users():
                 logging.info(f"[RQ批量推送] {info_msg}")
                 return {"status": "success", "total_subscriptions": 0, "jobs_created": 0}
 
-            # 为每个订阅创建独立的推送任务
-            job_ids = []
+            # 按检索条件分组: 同组订阅只搜索一次PubMed
+            groups = {}
             for subscription in subscriptions:
+                groups.setdefault(push_service.get_push_group_key(subscription), []).append(subscription.id)
+
+            # 每个分组创建一个推送任务
+            wave_id = f"batch-{start_time:%Y-%m-%d %H:%M:%S}"
+            job_ids = []
+            for subscription_ids in groups.values():
                 try:
+                    # 分阶段推送时分组检索也在检索阶段队列上运行
                     job = enqueue_job(
-                        process_subscription_push,
-                        subscription.id,
-                        priority='default'
+                        process_subscription_group_push,
+                        subscription_ids,
+                        wave_id,
+                        priority='push_fetch' if PUSH_PIPELINE_ENABLED else 'default'
                     )
                     job_ids.append(job.id)
-                    logging.debug(f"[RQ批量推送] 已创建订阅 {subscription.id} 的推送任务: {job.id}")
+                    logging.debug(f"[RQ批量推送] 已创建订阅分组 {subscription_ids} 的推送任务: {job.id}")
                 except Exception as e:
-                    logging.error(f"[RQ批量推送] 创建订阅 {subscription.id} 任务失败: {e}")
+                    logging.error(f"[RQ批量推送] 创建订阅分组 {subscription_ids} 任务失败: {e}")
 
             end_time = datetime.datetime.now()
             duration = (end_time - start_time).total_seconds()
+            saved_searches = len(subscriptions) - len(groups)
 
-            success_msg = f'批量推送任务调度完成: 为 {len(subscriptions)} 个订阅创建了 {len(job_ids)} 个推送任务'
+            success_msg = (f'批量推送任务调度完成: {len(subscriptions)} 个订阅合并为 {len(groups)} 组, '
+                           f'创建了 {len(job_ids)} 个推送任务, 预计节省 {saved_searches} 次PubMed搜索')
             log_activity('INFO', 'rq_batch_push', success_msg)
             logging.info(f"[RQ批量推送] {success_msg} (耗时: {duration:.2f}秒)")
 
             return {
                 "status": "success",
+                "wave_id": wave_id,
                 "total_subscriptions": len(subscriptions),
+                "groups": len(groups),
+                "saved_searches": saved_searches,
                 "jobs_created": len(job_ids),
                 "duration": duration
             }
@@ -293,5 +645,10 @@ if __name__ == '__main__':
     print("- process_subscription_push: 处理订阅推送")
     print("- batch_schedule_all_subscriptions: 批量调度订阅")
     print("- batch_push_all_users: 批量推送所有用户")
+    print("- process_subscription_group_push: 分组推送共享检索条件的订阅")
+    print("- push_stage_fetch/enrich/render/send: 分阶段推送")
+    print("- push_stage_watchdog: 分阶段推送等待列表看门狗")
+    print("- cleanup_expired_data: 每日数据保留清理")
     print("- immediate_push_subscription: 立即推送")
+    print("- refresh_search_cache: 后台刷新搜索缓存")
     print("- test_rq_connection: 连接测试")
\ No newline at end of file